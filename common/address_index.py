@@ -0,0 +1,239 @@
+"""
+Local address validation with a memory-mapped reference index.
+
+The reference data (street, postcode, city), e.g. the CSV files in
+`spacy_address_model/corpus/trainingdata/`, is normalized and written once into a
+compact sorted index file. The file is memory-mapped (pages are shared by all worker
+processes) and searched with a binary search, so a lookup needs no parsing at startup.
+
+    python address_index.py build ../spacy_address_model/corpus/trainingdata/address_data.csv -o addresses.idx
+    python address_index.py bench addresses.idx
+
+Index file layout: magic (8 bytes), number of keys n (uint32), n+1 key offsets (uint32),
+followed by the sorted UTF-8 keys.
+"""
+import argparse
+import csv
+import mmap
+import re
+import struct
+import time
+import unicodedata
+from functools import lru_cache
+from typing import Iterable, Optional
+
+
+MAGIC = b"ADDRIDX1"
+SEPARATOR = "\x1f"
+
+CITY_PREFIX = "c"
+STREET_PREFIX = "s"
+POSTCODE_PREFIX = "p"
+
+_STREET_SUFFIXES = [
+    (re.compile(r"(str|straße|strasse|strase)\.?$"), "strasse"),
+    (re.compile(r"(str|straße|strasse)\.?(?=\s)"), "strasse"),
+    (re.compile(r"\bpl\.?$"), "platz"),
+    (re.compile(r"\bst\.?(?=\s|$)"), "street"),
+    (re.compile(r"\bave?\.?(?=\s|$)"), "avenue"),
+    (re.compile(r"\brd\.?(?=\s|$)"), "road"),
+]
+_UMLAUTS = str.maketrans({"ä": "ae", "ö": "oe", "ü": "ue", "ß": "ss"})
+_NON_ALNUM = re.compile(r"[^0-9a-z]+")
+HOUSE_NUMBER_PATTERN = re.compile(r"^\d{1,5}\s*[a-z]?(\s*[-/]\s*\d{1,5}\s*[a-z]?)?$", re.IGNORECASE)
+
+# validation errors (cached per normalized address) -> message with the address as given
+ERROR_MESSAGES = {
+    "invalid_street": "Invalid street name",
+    "missing_house_number": "House number is required",
+    "invalid_house_number": "Invalid house number: {house_number}",
+    "unknown_city": "Unknown city: {city}",
+    "unknown_street": "Unknown street in {city}: {street}",
+    "wrong_postcode": "Postcode {post_code} does not belong to {city}",
+}
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFC", text.strip().lower()).translate(_UMLAUTS)
+    # remove remaining accents (e.g. "dolní" -> "dolni")
+    return unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+
+
+@lru_cache(maxsize=65536)
+def normalize_street(street: str) -> str:
+    """
+    Normalizes spelling variants of a street name:
+    "Gustav-Freytag-Straße", "Gustav Freytag Str." and "gustav-freytag-strasse" -> "gustavfreytagstrasse"
+    """
+    street = unicodedata.normalize("NFC", street.strip().lower())
+    for pattern, replacement in _STREET_SUFFIXES:
+        street = pattern.sub(replacement, street)
+    return _NON_ALNUM.sub("", _fold(street))
+
+
+@lru_cache(maxsize=65536)
+def normalize_city(city: str) -> str:
+    return _NON_ALNUM.sub("", _fold(city))
+
+
+def normalize_postcode(post_code: str) -> str:
+    return _NON_ALNUM.sub("", post_code.lower())
+
+
+def _keys(rows: Iterable[dict]):
+    for row in rows:
+        city = normalize_city(row.get("City") or "")
+        if not city:
+            continue
+        yield SEPARATOR.join((CITY_PREFIX, city))
+        street = normalize_street(row.get("Street") or "")
+        if street:
+            yield SEPARATOR.join((STREET_PREFIX, city, street))
+        post_code = normalize_postcode(row.get("Post_Code") or "")
+        if post_code:
+            yield SEPARATOR.join((POSTCODE_PREFIX, post_code, city))
+
+
+def build_index(csv_paths: Iterable[str], output_path: str) -> int:
+    """
+    Builds the index file from CSV files with the columns Street, Post_Code and City.
+    Returns the number of keys.
+    """
+    keys = set()
+    for path in csv_paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            keys.update(_keys(csv.DictReader(f)))
+    encoded = sorted(key.encode("utf-8") for key in keys)
+
+    offsets = [0]
+    for key in encoded:
+        offsets.append(offsets[-1] + len(key))
+    with open(output_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<I", len(encoded)))
+        f.write(struct.pack(f"<{len(offsets)}I", *offsets))
+        f.write(b"".join(encoded))
+    return len(encoded)
+
+
+class AddressIndex:
+    """
+    Read-only, memory-mapped view on an index file built with `build_index`
+    """
+
+    def __init__(self, path: str):
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an address index file")
+        (self.size,) = struct.unpack_from("<I", self._map, len(MAGIC))
+        offsets_start = len(MAGIC) + 4
+        self._offsets = memoryview(self._map)[offsets_start:offsets_start + 4 * (self.size + 1)].cast("I")
+        self._data_start = offsets_start + 4 * (self.size + 1)
+
+    def _key(self, i: int) -> bytes:
+        return self._map[self._data_start + self._offsets[i]:self._data_start + self._offsets[i + 1]]
+
+    def _contains(self, key: str) -> bool:
+        key = key.encode("utf-8")
+        low, high = 0, self.size
+        while low < high:
+            middle = (low + high) // 2
+            if self._key(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self.size and self._key(low) == key
+
+    def has_city(self, city: str, normalized: bool = False) -> bool:
+        return self._contains(SEPARATOR.join((CITY_PREFIX, city if normalized else normalize_city(city))))
+
+    def has_street(self, city: str, street: str, normalized: bool = False) -> bool:
+        if not normalized:
+            city, street = normalize_city(city), normalize_street(street)
+        return self._contains(SEPARATOR.join((STREET_PREFIX, city, street)))
+
+    def has_postcode(self, post_code: str, city: str, normalized: bool = False) -> bool:
+        if not normalized:
+            post_code, city = normalize_postcode(post_code), normalize_city(city)
+        return self._contains(SEPARATOR.join((POSTCODE_PREFIX, post_code, city)))
+
+    def close(self):
+        self._offsets.release()
+        self._map.close()
+        self._file.close()
+
+
+class AddressValidator:
+    """
+    Validates addresses against the reference index, results are cached per normalized address.
+
+    The reference only covers some cities: for a city without reference data only the
+    format of street and house number is checked, unless `strict` is set.
+    """
+
+    def __init__(self, index: Optional[AddressIndex] = None, strict: bool = False, cache_size: int = 65536):
+        self.index = index
+        self.strict = strict
+        self._validate = lru_cache(maxsize=cache_size)(self._validate_normalized)
+
+    def validate(self, city: str, street: str, house_number: str, post_code: Optional[str] = None) -> Optional[str]:
+        """
+        Returns why the address is invalid, None if it is valid
+        """
+        house_number = house_number.strip()
+        error = self._validate(normalize_city(city), normalize_street(street), house_number,
+                               normalize_postcode(post_code) if post_code else None)
+        if error is None:
+            return None
+        return ERROR_MESSAGES[error].format(city=city, street=street, house_number=house_number, post_code=post_code)
+
+    def _validate_normalized(self, city, street, house_number, post_code) -> Optional[str]:
+        # only normalized values: spelling variants of an address share the cache entry
+        if len(street) < 2:
+            return "invalid_street"
+        if not house_number:
+            return "missing_house_number"
+        if not HOUSE_NUMBER_PATTERN.match(house_number):
+            return "invalid_house_number"
+        if self.index is None:
+            return None
+
+        if not self.index.has_city(city, normalized=True):
+            return "unknown_city" if self.strict else None
+        if not self.index.has_street(city, street, normalized=True):
+            return "unknown_street"
+        if post_code and not self.index.has_postcode(post_code, city, normalized=True):
+            return "wrong_postcode"
+        return None
+
+    def cache_info(self):
+        return self._validate.cache_info()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build an index file from reference CSV files")
+    build_parser.add_argument("csv", nargs="+", help="CSV files with the columns Street, Post_Code and City")
+    build_parser.add_argument("-o", "--output", default="addresses.idx")
+    bench_parser = subparsers.add_parser("bench", help="measure the validation time")
+    bench_parser.add_argument("index")
+    bench_parser.add_argument("--repeat", type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        print(f"{build_index(args.csv, args.output)} keys written to {args.output}")
+    else:
+        validator = AddressValidator(AddressIndex(args.index))
+        addresses = [("Hohn", "Hauptstraße", "34", "24806"), ("Hohn", "Hauptstr.", "34", None),
+                     ("Leipzig", "Gustav-Freytag-Straße", "42a", None), ("Hohn", "Nowhere Lane", "1", None)]
+        for address in addresses:
+            print(address, "->", validator.validate(*address) or "valid")
+
+        uncached = AddressValidator(validator.index, cache_size=0)
+        for name, instance in (("uncached", uncached), ("cached", validator)):
+            start = time.perf_counter()
+            for i in range(args.repeat):
+                instance.validate(*addresses[i % len(addresses)])
+            print(f"{name}: {(time.perf_counter() - start) / args.repeat * 1e6:.2f} µs per address")
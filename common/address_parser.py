@@ -0,0 +1,121 @@
+"""
+Free-text address parsing with the address NER model of `spacy_address_model/`
+(entities STREET, HOUSE_NR, POST_CODE, CITY).
+
+The pipeline is loaded once per process; many texts are processed with `nlp.pipe`
+(configurable batch size and number of processes). Without the statistical model, a
+ruler-only pipeline (token patterns and a city gazetteer) can be used instead.
+
+With `pool_size` > 1, batches are parsed by a persistent pool of processes forked from the
+process holding the pipeline: the workers share its memory pages copy-on-write instead of
+loading or receiving their own copy, and no processes are started per call (unlike `n_process`).
+The pool is started with `start_pool()` once per server worker, at startup (the app lifespan): forking
+from a request thread of a multithreaded worker would copy locks held by other threads.
+"""
+import gc
+import logging
+import multiprocessing
+import os
+from typing import Iterable, List, Optional
+
+# entity label of the model -> field of the Address model
+LABEL_FIELDS = {
+    "STREET": "street",
+    "HOUSE_NR": "house_number",
+    "POST_CODE": "post_code",
+    "CITY": "city",
+}
+
+
+# pipeline of the pool processes, inherited from the forking process
+_pool_nlp = None
+
+
+def _parse_chunk(texts: List[str], batch_size: int) -> List[dict]:
+    return [AddressParser.to_address(doc) for doc in _pool_nlp.pipe(texts, batch_size=batch_size)]
+
+
+class AddressParser:
+    """
+    Extracts structured addresses from texts with a trained spaCy pipeline
+    """
+
+    @classmethod
+    def from_patterns(cls, patterns_path: str, batch_size: int = 256, n_process: int = 1, lang: str = "en",
+                      pool_size: int = 0):
+        """
+        Ruler-only parser: a blank pipeline with an entity_ruler loaded from a patterns file
+        (`spacy_address_model/address_ruler.py build`), no trained model needed
+        """
+        import spacy
+
+        logging.info("Loading address patterns from %s", patterns_path)
+        nlp = spacy.blank(lang)
+        nlp.add_pipe("entity_ruler", config={"phrase_matcher_attr": "LOWER"}).from_disk(patterns_path)
+        return cls(batch_size=batch_size, n_process=n_process, nlp=nlp, pool_size=pool_size)
+
+    def __init__(self, model_path: str = "model-best", batch_size: int = 256, n_process: int = 1, nlp=None,
+                 pool_size: int = 0):
+        if nlp is None:
+            import spacy
+
+            logging.info("Loading address model from %s", model_path)
+            nlp = spacy.load(model_path)
+        self.nlp = nlp
+        self.batch_size = batch_size
+        self.n_process = n_process
+        self.pool_size = pool_size
+        self._pool = None
+        self._pool_pid = None
+
+    @staticmethod
+    def to_address(doc) -> dict:
+        """
+        Converts the entities of a document into address fields (first entity per label wins)
+        """
+        address = {field: None for field in LABEL_FIELDS.values()}
+        for ent in doc.ents:
+            field = LABEL_FIELDS.get(ent.label_)
+            if field and address[field] is None:
+                address[field] = ent.text
+        return {
+            "text": doc.text,
+            "address": address,
+            "entities": [{"text": ent.text, "label": ent.label_, "start": ent.start_char, "end": ent.end_char}
+                         for ent in doc.ents],
+        }
+
+    def parse(self, text: str) -> dict:
+        return self.to_address(self.nlp(text))
+
+    def start_pool(self):
+        """
+        Forks the process pool (with `pool_size` > 1); call it while the process has no other threads
+        """
+        if self.pool_size <= 1 or self._pool is not None and self._pool_pid == os.getpid():
+            return
+        global _pool_nlp
+        _pool_nlp = self.nlp
+        gc.freeze()  # the collector of the pool processes then leaves the shared pages alone
+        # a pool belongs to the process that created it: one per (forked) server worker
+        self._pool = multiprocessing.get_context("fork").Pool(self.pool_size)
+        self._pool_pid = os.getpid()
+
+    def parse_many(self, texts: Iterable[str], batch_size: Optional[int] = None,
+                   n_process: Optional[int] = None) -> List[dict]:
+        """
+        Parses many texts with `nlp.pipe` (or the started process pool), the results are in the order of the texts
+        """
+        batch_size = batch_size or self.batch_size
+        if self._pool is not None and self._pool_pid == os.getpid():
+            texts = list(texts)
+            if len(texts) > batch_size:
+                chunks = [(texts[i:i + batch_size], batch_size) for i in range(0, len(texts), batch_size)]
+                return [result for chunk in self._pool.starmap(_parse_chunk, chunks) for result in chunk]
+        docs = self.nlp.pipe(texts, batch_size=batch_size, n_process=n_process or self.n_process)
+        return [self.to_address(doc) for doc in docs]
+
+    def close(self):
+        if self._pool is not None and self._pool_pid == os.getpid():
+            self._pool.terminate()
+        self._pool = None
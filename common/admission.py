@@ -0,0 +1,227 @@
+"""
+Admission control for the pizza API: token-bucket rate limits and a global concurrency cap.
+
+* per client and route: every client (peer address, or the X-Forwarded-For address of requests from a trusted
+  proxy) gets a token bucket per route, the least recently seen clients are forgotten beyond `max_clients`
+* per route (optional): one token bucket per route shared by all clients
+* global: at most `max_concurrent` requests are processed at the same time
+
+Requests over a rate limit are rejected with 429, requests over the concurrency cap with 503,
+both immediately and with a Retry-After header. The counters of served and rejected requests
+per route are available via `AdmissionController.metrics()`.
+"""
+import ipaddress
+import json
+import math
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from starlette.routing import Match
+
+
+class TokenBucket:
+    """
+    Refills `rate` tokens per second up to `burst` tokens, every request takes one token
+    """
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self, now: float) -> float:
+        """
+        Takes a token, returns 0 on success or the seconds until the next token is available
+        """
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+def parse_route_limits(value: str) -> Dict[str, Tuple[float, float]]:
+    """
+    Parses "POST /orders/bulk=1:5;GET /pizza=100:200" into {"POST /orders/bulk": (1.0, 5.0), ...}
+    """
+    limits = {}
+    for item in filter(None, (part.strip() for part in value.split(";"))):
+        route, limit = item.rsplit("=", 1)
+        rate, burst = limit.split(":")
+        limits[route.strip()] = (float(rate), float(burst))
+    return limits
+
+
+def parse_trusted_proxies(value: str) -> tuple:
+    """
+    Parses "127.0.0.1,10.0.0.0/8" into networks
+    """
+    return tuple(ipaddress.ip_network(part.strip(), strict=False) for part in value.split(",") if part.strip())
+
+
+def _is_trusted(address: str, trusted_proxies) -> bool:
+    try:
+        ip = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(ip in network for network in trusted_proxies)
+
+
+class AdmissionController:
+    """
+    State of the admission control (token buckets, requests in flight, counters).
+    Rates are requests per second, 0 disables a limit. `route_limits` overrides the
+    per-client limit for single routes ("METHOD /path/template" -> (rate, burst)).
+    Long-lived routes (server-sent events) are not counted against the concurrency cap.
+    """
+
+    def __init__(self, client_rate: float = 20, client_burst: float = 40, route_rate: float = 0,
+                 route_burst: float = 0, max_concurrent: int = 64, route_limits: Optional[dict] = None,
+                 exempt_suffixes: tuple = ("/events",), max_clients: int = 100000, trusted_proxies: tuple = ()):
+        self.client_rate = client_rate
+        self.client_burst = client_burst or client_rate
+        self.route_rate = route_rate
+        self.route_burst = route_burst or route_rate
+        self.max_concurrent = max_concurrent
+        self.route_limits = route_limits or {}
+        self.exempt_suffixes = exempt_suffixes
+        self.max_clients = max_clients
+        self.trusted_proxies = trusted_proxies
+        self.in_flight = 0
+        self._client_buckets: "OrderedDict[tuple, TokenBucket]" = OrderedDict()  # least recently seen first
+        self._route_buckets: Dict[str, TokenBucket] = {}
+        self._counters: Dict[str, Dict[str, int]] = {}
+
+    def count(self, route: str, outcome: str):
+        counters = self._counters.setdefault(route, {"served": 0, "rate_limited": 0, "overloaded": 0})
+        counters[outcome] += 1
+
+    def check_rate(self, client: str, route: str, now: float) -> float:
+        """
+        Returns 0 if the request is within the rate limits, otherwise the seconds to wait
+        """
+        rate, burst = self.route_limits.get(route, (self.client_rate, self.client_burst))
+        if rate > 0:
+            key = (client, route)
+            bucket = self._client_buckets.get(key)
+            if bucket is None:
+                if len(self._client_buckets) >= self.max_clients:
+                    self._client_buckets.popitem(last=False)
+                bucket = self._client_buckets[key] = TokenBucket(rate, burst or rate)
+            else:
+                self._client_buckets.move_to_end(key)
+            wait = bucket.take(now)
+            if wait:
+                return wait
+        if self.route_rate > 0:
+            bucket = self._route_buckets.get(route)
+            if bucket is None:
+                bucket = self._route_buckets[route] = TokenBucket(self.route_rate, self.route_burst)
+            return bucket.take(now)
+        return 0.0
+
+    def is_exempt(self, route: str) -> bool:
+        return route.endswith(self.exempt_suffixes)
+
+    def metrics(self) -> dict:
+        totals = {"served": 0, "rate_limited": 0, "overloaded": 0}
+        for counters in self._counters.values():
+            for outcome, count in counters.items():
+                totals[outcome] += count
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "tracked_clients": len(self._client_buckets),
+            "totals": totals,
+            "routes": self._counters,
+        }
+
+
+def route_template(scope) -> str:
+    """
+    Returns "METHOD /path/template" of a request, so all /order/<id> requests share one bucket
+    """
+    path = "<unmatched>"  # unknown paths share one counter instead of one per path
+    app = scope.get("app")
+    if app is not None:
+        for route in app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                path = route.path
+                break
+    return f"{scope['method']} {path}"
+
+
+def client_address(scope, trusted_proxies: tuple = ()) -> str:
+    """
+    Peer address of the request. If the peer is a trusted proxy, the last X-Forwarded-For address that is
+    not a trusted proxy: addresses further left were set by the client and can be forged.
+    """
+    client = scope.get("client")
+    peer = client[0] if client else "unknown"
+    if not trusted_proxies or not _is_trusted(peer, trusted_proxies):
+        return peer
+    forwarded = [value.decode("latin-1") for name, value in scope.get("headers", []) if name == b"x-forwarded-for"]
+    addresses = [address.strip() for value in forwarded for address in value.split(",") if address.strip()]
+    for address in reversed(addresses):
+        if not _is_trusted(address, trusted_proxies):
+            return address
+    return addresses[0] if addresses else peer
+
+
+async def _reject(send, status: int, detail: str, retry_after: float):
+    body = json.dumps({"detail": detail}).encode("utf-8")
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(max(1, math.ceil(retry_after))).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionControlMiddleware:
+    """
+    Pure ASGI middleware (no per-request task like BaseHTTPMiddleware, streaming responses pass through):
+
+        app.add_middleware(AdmissionControlMiddleware, controller=AdmissionController(...))
+    """
+
+    def __init__(self, app, controller: AdmissionController):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        controller = self.controller
+        route = route_template(scope)
+        wait = controller.check_rate(client_address(scope, controller.trusted_proxies), route, time.monotonic())
+        if wait:
+            controller.count(route, "rate_limited")
+            await _reject(send, 429, "Too many requests", wait)
+            return
+
+        if controller.is_exempt(route):
+            controller.count(route, "served")
+            await self.app(scope, receive, send)
+            return
+
+        if controller.max_concurrent and controller.in_flight >= controller.max_concurrent:
+            controller.count(route, "overloaded")
+            await _reject(send, 503, "Server is busy, try again later", 1)
+            return
+
+        controller.in_flight += 1
+        try:
+            controller.count(route, "served")
+            await self.app(scope, receive, send)
+        finally:
+            controller.in_flight -= 1
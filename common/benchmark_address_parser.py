@@ -0,0 +1,58 @@
+"""
+Throughput of the address parser (texts per second) for different batch sizes and process counts.
+
+    python benchmark_address_parser.py [--model ../spacy_address_model/model-best] [--texts 5000]
+                                       [--batch-sizes 1 64 256 1024] [--n-process 1 2] [--pool-sizes 2 4]
+
+The texts are taken from the address column of the training data CSV (repeated up to --texts).
+Batch size 1 with one process corresponds to calling `nlp(text)` per text. `--n-process` starts
+new processes for every call, `--pool-sizes` uses the persistent forked process pool.
+"""
+import argparse
+import csv
+import itertools
+import time
+
+from address_parser import AddressParser
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="../spacy_address_model/model-best")
+    parser.add_argument("--data", default="../spacy_address_model/corpus/trainingdata/address_data.csv")
+    parser.add_argument("--texts", type=int, default=5000)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 64, 256, 1024])
+    parser.add_argument("--n-process", type=int, nargs="+", default=[1, 2])
+    parser.add_argument("--pool-sizes", type=int, nargs="*", default=[2])
+    args = parser.parse_args()
+
+    with open(args.data, newline="", encoding="utf-8") as f:
+        samples = [row["Address"] for row in csv.DictReader(f)]
+    texts = list(itertools.islice(itertools.cycle(samples), args.texts))
+
+    address_parser = AddressParser(args.model)
+    address_parser.parse_many(texts[:100])  # warm-up
+
+    start = time.perf_counter()
+    for text in texts:
+        address_parser.parse(text)
+    print(f"{'nlp(text) per text':<28} {len(texts) / (time.perf_counter() - start):>10.0f} texts/s")
+
+    for n_process in args.n_process:
+        for batch_size in args.batch_sizes:
+            start = time.perf_counter()
+            results = address_parser.parse_many(texts, batch_size=batch_size, n_process=n_process)
+            elapsed = time.perf_counter() - start
+            assert len(results) == len(texts)
+            print(f"{f'pipe batch={batch_size} n_process={n_process}':<28} {len(texts) / elapsed:>10.0f} texts/s")
+
+    for pool_size in args.pool_sizes:
+        pooled = AddressParser(nlp=address_parser.nlp, batch_size=256, pool_size=pool_size)
+        pooled.start_pool()
+        pooled.parse_many(texts[:1000])  # warm-up
+        start = time.perf_counter()
+        results = pooled.parse_many(texts)
+        elapsed = time.perf_counter() - start
+        assert len(results) == len(texts)
+        print(f"{f'process pool size={pool_size}':<28} {len(texts) / elapsed:>10.0f} texts/s")
+        pooled.close()
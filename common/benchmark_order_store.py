@@ -0,0 +1,128 @@
+"""
+Load benchmark of the order repositories.
+
+    python benchmark_order_store.py [--orders 20000] [--batch-size 500]
+    python benchmark_order_store.py --http [--workers 4] [--requests 5000] [--concurrency 64]
+
+Without --http the repositories are called directly (single writes, batched writes, reads).
+With --http the API is started with uvicorn for every backend (memory: 1 worker,
+sqlite: --workers workers), orders are created and read back over HTTP. Reads answered
+with 404 show orders that were created by another worker process.
+"""
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+from models import Address, Order, OrderStatus
+from order_store import InMemoryOrderRepository, SQLiteOrderRepository
+
+
+def make_orders(count: int):
+    return [Order(id=str(uuid.uuid4()), pizza_id=random.randint(1, 4),
+                  address=Address(city="Leipzig", street="Gustav-Freytag-Straße", house_number=str(i)),
+                  status=OrderStatus.RECEIVED) for i in range(count)]
+
+
+def benchmark_repository(name, repository, orders, batch_size):
+    half = len(orders) // 2
+    start = time.perf_counter()
+    for order in orders[:half]:
+        repository.add(order)
+    single = half / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(half, len(orders), batch_size):
+        repository.add_many(orders[i:i + batch_size])
+    batched = (len(orders) - half) / (time.perf_counter() - start)
+
+    ids = [order.id for order in random.sample(orders, len(orders))]
+    start = time.perf_counter()
+    for order_id in ids:
+        assert repository.get(order_id) is not None
+    reads = len(ids) / (time.perf_counter() - start)
+    print(f"{name:<8} {single:>14.0f} {batched:>16.0f} {reads:>12.0f}")
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def http_load(base_url, requests, concurrency):
+    import httpx
+
+    latencies, missing = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+    payload = {"pizza_id": 1, "city": "Leipzig", "street": "Gustav-Freytag-Straße", "house_number": "42a"}
+
+    async def one(client):
+        nonlocal missing
+        async with semaphore:
+            start = time.perf_counter()
+            order_id = (await client.post("/order", json=payload)).json()["order_id"]
+            response = await client.get(f"/order/{order_id}")
+            latencies.append(time.perf_counter() - start)
+            missing += response.status_code == 404
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client) for _ in range(requests)))
+        elapsed = time.perf_counter() - start
+    latencies.sort()
+    return 2 * requests / elapsed, latencies[int(0.95 * (len(latencies) - 1))] * 1000, missing
+
+
+def benchmark_http(backend, workers, requests, concurrency, db_path):
+    import httpx
+
+    port = free_port()
+    # the load comes from one client, which the admission control would rate limit
+    env = dict(os.environ, ORDER_STORE=backend, ORDER_DB_PATH=db_path, ADMISSION_CONTROL="false")
+    server = subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--workers",
+                               str(workers), "--log-level", "warning"], env=env)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        for _ in range(100):
+            try:
+                httpx.get(f"{base_url}/pizza")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        throughput, p95, missing = asyncio.run(http_load(base_url, requests, concurrency))
+        print(f"{backend:<8} {workers:>8} {throughput:>10.0f} {p95:>12.1f} {missing:>10}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--http", action="store_true", help="benchmark the API over HTTP")
+    parser.add_argument("--workers", type=int, default=4, help="uvicorn workers for the sqlite backend")
+    parser.add_argument("--requests", type=int, default=5000, help="orders created (and read back) over HTTP")
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if args.http:
+            print(f"{'backend':<8} {'workers':>8} {'req/s':>10} {'p95 ms':>12} {'404s':>10}")
+            benchmark_http("memory", 1, args.requests, args.concurrency, "")
+            benchmark_http("sqlite", args.workers, args.requests, args.concurrency, os.path.join(tmp, "orders.db"))
+        else:
+            orders = make_orders(args.orders)
+            print(f"{'backend':<8} {'single writes/s':>14} {'batched writes/s':>16} {'reads/s':>12}")
+            benchmark_repository("memory", InMemoryOrderRepository(), orders, args.batch_size)
+            sqlite = SQLiteOrderRepository(os.path.join(tmp, "orders.db"))
+            benchmark_repository("sqlite", sqlite, orders, args.batch_size)
+            sqlite.close()
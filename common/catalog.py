@@ -0,0 +1,73 @@
+"""
+Pizza catalog and delivery area of the pizza API.
+
+Every request reads an immutable `Catalog` snapshot with indexed structures
+(pizzas by ID, frozenset of cities) and the pre-encoded `/pizza` response.
+`CatalogStore.update` builds a new snapshot and swaps it in one assignment,
+so requests never see a half-updated catalog.
+"""
+import hashlib
+import json
+import threading
+from typing import Dict, Iterable, List, Optional
+
+
+class Catalog:
+    """
+    Immutable snapshot of the pizzas and the delivery cities
+    """
+
+    def __init__(self, pizzas: Iterable[dict], cities: Iterable[str]):
+        self.pizzas: List[dict] = [dict(pizza) for pizza in pizzas]
+        self.pizzas_by_id: Dict[int, dict] = {pizza["id"]: pizza for pizza in self.pizzas}
+        self.city_list: List[str] = list(dict.fromkeys(cities))
+        self.cities = frozenset(self.city_list)
+        self.cities_text = ", ".join(self.city_list)
+        # the /pizza response is encoded once per snapshot, not per request
+        self.pizzas_json: bytes = json.dumps(self.pizzas, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self.etag = '"%s"' % hashlib.sha256(self.pizzas_json).hexdigest()[:32]
+
+    def get_pizza(self, pizza_id: int) -> Optional[dict]:
+        return self.pizzas_by_id.get(pizza_id)
+
+    def is_valid_city(self, city: str) -> bool:
+        return city in self.cities
+
+    def etag_matches(self, if_none_match: Optional[str]) -> bool:
+        """
+        Checks an If-None-Match header (list of ETags, weak ETags or "*") against the current ETag
+        """
+        if not if_none_match:
+            return False
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            if tag == "*" or tag == self.etag:
+                return True
+        return False
+
+
+class CatalogStore:
+    """
+    Holds the current catalog snapshot and replaces it atomically on changes
+    """
+
+    def __init__(self, pizzas: Iterable[dict], cities: Iterable[str]):
+        self._current = Catalog(pizzas, cities)
+        self._lock = threading.Lock()
+
+    @property
+    def current(self) -> Catalog:
+        return self._current
+
+    def update(self, pizzas: Optional[Iterable[dict]] = None, cities: Optional[Iterable[str]] = None) -> Catalog:
+        """
+        Rebuilds the catalog with new pizzas and/or cities (unchanged parts are taken over)
+        """
+        with self._lock:  # serializes writers, readers keep using the old snapshot until the swap
+            current = self._current
+            catalog = Catalog(current.pizzas if pizzas is None else pizzas,
+                              current.city_list if cities is None else cities)
+            self._current = catalog
+        return catalog
@@ -0,0 +1,22 @@
+"""
+gunicorn settings for the pizza API with copy-on-write model sharing:
+
+    gunicorn main:app -c gunicorn.conf.py
+
+With `preload_app` the app, including the spaCy address model, is imported once in the master
+process and the workers are forked from it, so all workers share the pages of the model instead of
+loading a private copy each (uvicorn --workers starts every worker with a fresh interpreter).
+"""
+import gc
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+worker_class = "uvicorn_worker.UvicornWorker"
+preload_app = os.environ.get("PRELOAD_APP", "true").lower() not in ("0", "false", "no")
+
+
+def when_ready(server):
+    # runs in the master after the app was loaded: objects in the permanent generation are skipped
+    # by the garbage collector, so the workers never write to (and copy) their pages
+    gc.freeze()
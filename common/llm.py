@@ -1,24 +1,16 @@
-from openai import OpenAI
-from os import environ
 from dotenv import load_dotenv
 from pprint import pprint
 
 load_dotenv()  # create .env file locally
 
-# Set up with the API key provided by your professor
-openai_api_key = environ.get('OPENAI_API_KEY')
-# Set up with the URL provided by your professor
-openai_api_base = environ.get('OPENAI_API_BASE')
-# Set up with the currently deployed model (check via HTTP GET to BASE_URL + "/v1/models")
-model_name = environ.get("MODEL_NAME")
+from llm_gateway import get_gateway
 
-client = OpenAI(
-    api_key=openai_api_key,
-    base_url=openai_api_base,
-)
+# OPENAI_API_KEY: set up with the API key provided by your professor
+# OPENAI_API_BASE: set up with the URL provided by your professor
+# MODEL_NAME: set up with the currently deployed model (check via HTTP GET to BASE_URL + "/v1/models")
+gateway = get_gateway()
 
-chat_response = client.chat.completions.create(
-    model=model_name,
+chat_response = gateway.chat_sync(
     messages=[
         {"role": "system", "content": """You are a Named Entity Recognition Tool.
 Recognize named entities and output the structured data as a JSON. **Output ONLY the structured data.**
@@ -28,3 +20,4 @@ Below is a text for you to analyze."""},
 )
 
 pprint(chat_response)
+pprint(gateway.stats())
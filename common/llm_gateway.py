@@ -0,0 +1,181 @@
+"""
+Shared gateway for calls to an OpenAI-compatible chat completion API.
+
+* one `AsyncOpenAI` client per process with a pooled HTTP transport (keep-alive connections)
+* a global semaphore limits the concurrent calls
+* a per-minute token budget (prompt + completion tokens) delays calls once it is used up
+* 429, timeouts, connection and server errors are retried with exponential backoff (Retry-After is honored)
+* a timeout per request
+* accounting of prompt and completion tokens and latency per call (`stats()`)
+
+All calls run on the gateway's own event loop thread, so the limits apply to async code (any event loop)
+and synchronous code alike:
+
+    gateway = get_gateway()
+    text = await gateway.complete(messages)     # async code
+    text = gateway.complete_sync(messages)      # synchronous code
+
+Configuration: OPENAI_API_KEY, OPENAI_API_BASE, MODEL_NAME, LLM_MAX_CONCURRENCY (default 8),
+LLM_TOKENS_PER_MINUTE (default 0: no budget), LLM_TIMEOUT (seconds, default 60), LLM_MAX_RETRIES (default 4).
+"""
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+from typing import List, Optional
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+RETRY_ERRORS = (openai.RateLimitError, openai.APITimeoutError, openai.APIConnectionError, openai.InternalServerError)
+
+
+class LLMGateway:
+    """
+    Rate-limited, retrying access to a chat completion API with per-call accounting
+    """
+
+    def __init__(self, api_key: Optional[str] = None, base_url: Optional[str] = None, model: Optional[str] = None,
+                 max_concurrency: int = 8, tokens_per_minute: int = 0, timeout: float = 60.0, max_retries: int = 4,
+                 history: int = 1000):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.calls = deque(maxlen=history)
+        self.totals = {"calls": 0, "errors": 0, "retries": 0, "prompt_tokens": 0, "completion_tokens": 0}
+        self._window = deque()  # [start time, tokens] of the calls of the last minute
+
+        self._loop = asyncio.new_event_loop()
+        threading.Thread(target=self._loop.run_forever, name="llm-gateway", daemon=True).start()
+        self._semaphore = None
+        self._client = None
+        asyncio.run_coroutine_threadsafe(self._setup(api_key, base_url, timeout), self._loop).result()
+
+    async def _setup(self, api_key, base_url, timeout):
+        # created on the gateway loop, which the connection pool and the semaphore belong to
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        http_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency),
+            timeout=httpx.Timeout(timeout))
+        self._client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+
+    async def _reserve_tokens(self, estimate: int) -> list:
+        while True:
+            now = time.monotonic()
+            while self._window and self._window[0][0] < now - 60:
+                self._window.popleft()
+            used = sum(tokens for _, tokens in self._window)
+            if not self.tokens_per_minute or not self._window or used + estimate <= self.tokens_per_minute:
+                entry = [now, estimate]
+                self._window.append(entry)
+                return entry
+            await asyncio.sleep(self._window[0][0] + 60 - now)
+
+    @staticmethod
+    def _retry_after(error, attempt: int) -> float:
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                return float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        return min(30.0, 0.5 * 2 ** attempt) * (0.5 + random.random())
+
+    async def _chat(self, messages: List[dict], **kwargs):
+        model = kwargs.pop("model", None) or self.model
+        # rough estimate until the API reports the usage: 4 characters per token
+        estimate = sum(len(str(message.get("content", ""))) for message in messages) // 4 + kwargs.get("max_tokens", 0)
+        record = {"model": model, "prompt_tokens": 0, "completion_tokens": 0, "latency_ms": 0.0, "retries": 0,
+                  "error": None}
+        async with self._semaphore:
+            entry = await self._reserve_tokens(estimate) if self.tokens_per_minute else [0, 0]
+            start = time.perf_counter()
+            try:
+                for attempt in range(self.max_retries + 1):
+                    try:
+                        response = await self._client.chat.completions.create(model=model, messages=messages, **kwargs)
+                        break
+                    except RETRY_ERRORS as e:
+                        if attempt == self.max_retries:
+                            raise
+                        delay = self._retry_after(e, attempt)
+                        logging.warning("LLM call failed (%s), retry in %.1f s", type(e).__name__, delay)
+                        record["retries"] += 1
+                        await asyncio.sleep(delay)
+                if response.usage is not None:
+                    record["prompt_tokens"] = response.usage.prompt_tokens
+                    record["completion_tokens"] = response.usage.completion_tokens
+                    entry[1] = response.usage.total_tokens
+                return response
+            except Exception as e:
+                record["error"] = type(e).__name__
+                raise
+            finally:
+                record["latency_ms"] = (time.perf_counter() - start) * 1000
+                self._account(record)
+
+    def _account(self, record: dict):
+        self.calls.append(record)
+        self.totals["calls"] += 1
+        self.totals["errors"] += record["error"] is not None
+        self.totals["retries"] += record["retries"]
+        self.totals["prompt_tokens"] += record["prompt_tokens"]
+        self.totals["completion_tokens"] += record["completion_tokens"]
+        logging.info("LLM call: %(prompt_tokens)d prompt + %(completion_tokens)d completion tokens, "
+                     "%(latency_ms).0f ms, %(retries)d retries", record)
+
+    async def chat(self, messages: List[dict], **kwargs):
+        """
+        Chat completion (the complete response), usable from any event loop
+        """
+        future = asyncio.run_coroutine_threadsafe(self._chat(messages, **kwargs), self._loop)
+        return await asyncio.wrap_future(future)
+
+    async def complete(self, messages: List[dict], **kwargs) -> str:
+        """
+        Content of the first choice of a chat completion
+        """
+        return (await self.chat(messages, **kwargs)).choices[0].message.content
+
+    def chat_sync(self, messages: List[dict], **kwargs):
+        return asyncio.run_coroutine_threadsafe(self._chat(messages, **kwargs), self._loop).result()
+
+    def complete_sync(self, messages: List[dict], **kwargs) -> str:
+        return self.chat_sync(messages, **kwargs).choices[0].message.content
+
+    def stats(self) -> dict:
+        """
+        Totals and latency percentiles, taken on the gateway loop which updates the call records
+        """
+        return asyncio.run_coroutine_threadsafe(self._stats(), self._loop).result()
+
+    async def _stats(self) -> dict:
+        latencies = sorted(record["latency_ms"] for record in self.calls)
+        return {
+            **self.totals,
+            "tokens_last_minute": sum(tokens for start, tokens in self._window if start >= time.monotonic() - 60),
+            "latency_p50_ms": latencies[len(latencies) // 2] if latencies else None,
+            "latency_p95_ms": latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+        }
+
+
+@lru_cache(maxsize=None)
+def get_gateway() -> LLMGateway:
+    """
+    The gateway of this process, configured from the environment
+    """
+    return LLMGateway(
+        api_key=os.environ.get("OPENAI_API_KEY"),
+        base_url=os.environ.get("OPENAI_API_BASE"),
+        model=os.environ.get("MODEL_NAME"),
+        max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", "8")),
+        tokens_per_minute=int(os.environ.get("LLM_TOKENS_PER_MINUTE", "0")),
+        timeout=float(os.environ.get("LLM_TIMEOUT", "60")),
+        max_retries=int(os.environ.get("LLM_MAX_RETRIES", "4")),
+    )
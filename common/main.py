@@ -1,34 +1,43 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel
+from fastapi import FastAPI, HTTPException, Header, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from contextlib import asynccontextmanager
 from typing import List, Optional
+import asyncio
+import os
 import uuid
-from enum import Enum
-
-app = FastAPI(root_path='/pizza-api')
-
-# Enums and Models
-class OrderStatus(str, Enum):
-    RECEIVED = "received"
-    PREPARING = "preparing"
-    ON_DELIVERY = "on_delivery"
-    DELIVERED = "delivered"
-
-class Address(BaseModel):
-    city: str
-    street: str
-    house_number: str
-
-class OrderCreate(BaseModel):
-    pizza_id: int
-    city: str
-    street: str
-    house_number: str
-
-class Order(BaseModel):
-    id: str
-    pizza_id: int
-    address: Address
-    status: OrderStatus
+
+from admission import AdmissionController, AdmissionControlMiddleware, parse_route_limits, parse_trusted_proxies
+from address_index import AddressIndex, AddressValidator
+from address_parser import AddressParser
+from catalog import CatalogStore
+from models import OrderStatus, Address, OrderCreate, Order, AddressText, AddressTexts
+from order_events import OrderEventBroker, sse_message
+from order_store import create_order_repository, InMemoryOrderRepository
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # the parser's process pool is forked once per worker, before any request threads exist
+    if address_parser is not None:
+        address_parser.start_pool()
+    yield
+    if address_parser is not None:
+        address_parser.close()
+
+app = FastAPI(root_path='/pizza-api', lifespan=lifespan)
+
+# Admission control: token buckets per client and route (requests per second), global concurrency cap
+admission = AdmissionController(
+    client_rate=float(os.environ.get("RATE_LIMIT_CLIENT", "20")),
+    client_burst=float(os.environ.get("RATE_LIMIT_CLIENT_BURST", "40")),
+    route_rate=float(os.environ.get("RATE_LIMIT_ROUTE", "0")),
+    route_burst=float(os.environ.get("RATE_LIMIT_ROUTE_BURST", "0")),
+    max_concurrent=int(os.environ.get("MAX_CONCURRENT_REQUESTS", "64")),
+    route_limits=parse_route_limits(os.environ.get("RATE_LIMIT_ROUTES", "POST /orders/bulk=1:5")),
+    trusted_proxies=parse_trusted_proxies(os.environ.get("TRUSTED_PROXIES", ""))
+)
+if os.environ.get("ADMISSION_CONTROL", "true").lower() not in ("0", "false", "no"):
+    app.add_middleware(AdmissionControlMiddleware, controller=admission)
 
 # Mock database
 pizzas = [
@@ -38,47 +47,131 @@ pizzas = [
     {"id": 4, "name": "Quattro Formaggi"}
 ]
 
-# Store orders in memory (in a real application, use a proper database)
-orders = {}
+# Order repository: in memory by default, ORDER_STORE=sqlite for a database shared by all workers;
+# its calls block (SQLite), so the endpoints run them in the thread pool
+orders = create_order_repository()
+
+# Status change notifications; with a shared store, changes made by other workers are picked up by polling
+order_events = OrderEventBroker(
+    orders,
+    poll_interval=float(os.environ.get(
+        "ORDER_EVENTS_POLL_INTERVAL", "0" if isinstance(orders, InMemoryOrderRepository) else "1"))
+)
+
+# Seconds between keep-alive comments on idle event streams
+EVENTS_KEEPALIVE = float(os.environ.get("ORDER_EVENTS_KEEPALIVE", "15"))
+
+# Order of the status transitions
+STATUS_SEQUENCE = list(OrderStatus)
 
 # Valid cities for delivery
 VALID_CITIES = ["Leipzig", "Halle", "Dresden"]
 
+# Indexed catalog, use catalog.update(...) to change pizzas or cities at runtime
+catalog = CatalogStore(pizzas, VALID_CITIES)
+
+# Address validation, optionally against a reference index built with address_index.py
+ADDRESS_INDEX_PATH = os.environ.get("ADDRESS_INDEX_PATH")
+address_validator = AddressValidator(
+    AddressIndex(ADDRESS_INDEX_PATH) if ADDRESS_INDEX_PATH else None,
+    strict=os.environ.get("ADDRESS_STRICT", "").lower() in ("1", "true", "yes")
+)
+
+# Free-text address parsing with the trained NER model (spacy_address_model), loaded once if it exists;
+# ADDRESS_PARSER_MODE=ruler uses only the rule-based patterns (no model, sub-millisecond per text)
+ADDRESS_MODEL_PATH = os.environ.get("ADDRESS_MODEL_PATH", "../spacy_address_model/model-best")
+ADDRESS_RULER_PATTERNS = os.environ.get("ADDRESS_RULER_PATTERNS", "../spacy_address_model/config/address_patterns.jsonl")
+ADDRESS_PARSER_BATCH_SIZE = int(os.environ.get("ADDRESS_PARSER_BATCH_SIZE", "256"))
+ADDRESS_PARSER_N_PROCESS = int(os.environ.get("ADDRESS_PARSER_N_PROCESS", "1"))
+ADDRESS_PARSER_POOL_SIZE = int(os.environ.get("ADDRESS_PARSER_POOL_SIZE", "0"))
+if os.environ.get("ADDRESS_PARSER_MODE", "model") == "ruler":
+    address_parser = AddressParser.from_patterns(ADDRESS_RULER_PATTERNS, ADDRESS_PARSER_BATCH_SIZE,
+                                                 ADDRESS_PARSER_N_PROCESS, pool_size=ADDRESS_PARSER_POOL_SIZE)
+elif os.path.isdir(ADDRESS_MODEL_PATH):
+    address_parser = AddressParser(ADDRESS_MODEL_PATH, ADDRESS_PARSER_BATCH_SIZE, ADDRESS_PARSER_N_PROCESS,
+                                   pool_size=ADDRESS_PARSER_POOL_SIZE)
+else:
+    address_parser = None
+
+# Maximum number of orders per bulk request
+MAX_BULK_ITEMS = int(os.environ.get("MAX_BULK_ITEMS", "1000"))
+
 @app.get("/pizza")
-async def list_pizzas():
+async def list_pizzas(if_none_match: Optional[str] = Header(default=None)):
     """List all available pizzas"""
-    return pizzas
+    current = catalog.current
+    headers = {"ETag": current.etag, "Cache-Control": "no-cache"}
+    if current.etag_matches(if_none_match):
+        return Response(status_code=304, headers=headers)
+    return Response(content=current.pizzas_json, media_type="application/json", headers=headers)
+
+def city_error(city: str, current=None) -> Optional[str]:
+    """Returns why the city is not serviceable, None if it is"""
+    current = current or catalog.current
+    if not current.is_valid_city(city):
+        return f"We don't deliver to {city}. Available cities: {current.cities_text}"
+    return None
+
+def street_error(address: Address) -> Optional[str]:
+    """Returns why street, house number or postcode are invalid, None if they are valid"""
+    # results are cached per normalized address
+    return address_validator.validate(address.city, address.street, address.house_number, address.post_code)
 
 @app.post("/address/validate")
 async def validate_address(address: Address):
     """Validate delivery address"""
     # Check if city is serviceable
-    if address.city not in VALID_CITIES:
+    error = city_error(address.city) or street_error(address)
+    if error:
         raise HTTPException(
             status_code=400,
-            detail=f"We don't deliver to {address.city}. Available cities: {', '.join(VALID_CITIES)}"
+            detail=error
         )
-    
-    # Basic validation for street and house number
-    if len(address.street) < 2:
+
+    return {"message": "Address is valid", "address": address}
+
+def parsed_address_result(parsed: dict) -> dict:
+    """Adds the validation result to a parsed address"""
+    fields = parsed["address"]
+    missing = [field for field in ("city", "street", "house_number") if not fields[field]]
+    if missing:
+        error = f"Missing address fields: {', '.join(missing)}"
+    else:
+        address = Address(**fields)
+        error = city_error(address.city) or street_error(address)
+    return {**parsed, "valid": error is None, "detail": error}
+
+def require_address_parser() -> AddressParser:
+    if address_parser is None:
         raise HTTPException(
-            status_code=400,
-            detail="Invalid street name"
+            status_code=503,
+            detail=f"Address model not available ({ADDRESS_MODEL_PATH})"
         )
-    
-    if not address.house_number:
+    return address_parser
+
+@app.post("/address/parse")
+async def parse_address(request: AddressText):
+    """Extract and validate an address from free text"""
+    parser = require_address_parser()
+    return parsed_address_result(await run_in_threadpool(parser.parse, request.text))
+
+@app.post("/address/parse/batch")
+async def parse_addresses(request: AddressTexts):
+    """Extract and validate addresses from many texts (one result per text)"""
+    parser = require_address_parser()
+    if len(request.texts) > MAX_BULK_ITEMS:
         raise HTTPException(
-            status_code=400,
-            detail="House number is required"
+            status_code=413,
+            detail=f"At most {MAX_BULK_ITEMS} texts per request"
         )
-
-    return {"message": "Address is valid", "address": address}
+    parsed = await run_in_threadpool(parser.parse_many, request.texts)
+    return {"results": [parsed_address_result(item) for item in parsed]}
 
 @app.post("/order")
 async def create_order(order: OrderCreate):
     """Create a neworder"""
     # Validate pizza_id
-    if not any(pizza["id"] == order.pizza_id for pizza in pizzas):
+    if catalog.current.get_pizza(order.pizza_id) is None:
         raise HTTPException(
             status_code=404,
             detail="Pizza not found"
@@ -88,7 +181,8 @@ async def create_order(order: OrderCreate):
     address = Address(
         city=order.city,
         street=order.street,
-        house_number=order.house_number
+        house_number=order.house_number,
+        post_code=order.post_code
     )
     await validate_address(address)
 
@@ -102,26 +196,149 @@ async def create_order(order: OrderCreate):
     )
     
     # Save order
-    orders[order_id] = new_order
+    await run_in_threadpool(orders.add, new_order)
 
     return {"order_id": order_id, "status": OrderStatus.RECEIVED}
 
 @app.get("/order/{order_id}")
 async def get_order_status(order_id: str):
     """Get order status by order ID"""
-    if order_id not in orders:
+    order = await run_in_threadpool(orders.get, order_id)
+    if order is None:
         raise HTTPException(
             status_code=404,
             detail="Order not found"
         )
     
+    return order_status(order)
+
+@app.post("/order/{order_id}/advance")
+async def advance_order_status(order_id: str):
+    """Move an order to its next status (received -> preparing -> on_delivery -> delivered)"""
+    order = await run_in_threadpool(orders.get, order_id)
+    if order is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Order not found"
+        )
+    if order.status == STATUS_SEQUENCE[-1]:
+        raise HTTPException(
+            status_code=409,
+            detail="Order is already delivered"
+        )
+
+    # only succeeds if no other request advanced the order in the meantime
+    order = await run_in_threadpool(orders.update_status, order_id,
+                                    STATUS_SEQUENCE[STATUS_SEQUENCE.index(order.status) + 1], order.status)
+    if order is None:
+        raise HTTPException(
+            status_code=409,
+            detail="Order status was changed by another request"
+        )
+    order_events.publish(order_id, order.status)
+    return order_status(order)
+
+@app.get("/order/{order_id}/events")
+async def order_status_events(order_id: str, request: Request):
+    """Subscribe to the status changes of an order (server-sent events), the stream ends after delivery"""
+    order = await run_in_threadpool(orders.get, order_id)
+    if order is None:
+        raise HTTPException(
+            status_code=404,
+            detail="Order not found"
+        )
+
+    queue = order_events.subscribe(order)
+
+    async def stream():
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=EVENTS_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    if await request.is_disconnected():
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield sse_message(event)
+                if event["status"] == STATUS_SEQUENCE[-1].value:
+                    break
+        finally:
+            order_events.unsubscribe(order_id, queue)
+
+    return StreamingResponse(stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def order_status(order: Order) -> dict:
     return {
-        "order_id": order_id,
-        "status": orders[order_id].status,
-        "pizza_id": orders[order_id].pizza_id,
-        "address": orders[order_id].address
+        "order_id": order.id,
+        "status": order.status,
+        "pizza_id": order.pizza_id,
+        "address": order.address
     }
 
+@app.post("/orders/bulk")
+async def create_orders_bulk(items: List[OrderCreate]):
+    """Create many orders at once, returns one result per item (in request order)"""
+    if len(items) > MAX_BULK_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BULK_ITEMS} orders per request"
+        )
+
+    current = catalog.current
+    city_errors = {}  # every distinct city is checked once per request
+    results = []
+    new_orders = []
+    for index, item in enumerate(items):
+        address = Address(city=item.city, street=item.street, house_number=item.house_number,
+                          post_code=item.post_code)
+        if current.get_pizza(item.pizza_id) is None:
+            results.append({"index": index, "error": {"status_code": 404, "detail": "Pizza not found"}})
+            continue
+        if item.city not in city_errors:
+            city_errors[item.city] = city_error(item.city, current)
+        error = city_errors[item.city] or street_error(address)
+        if error:
+            results.append({"index": index, "error": {"status_code": 400, "detail": error}})
+            continue
+
+        new_order = Order(
+            id=str(uuid.uuid4()),
+            pizza_id=item.pizza_id,
+            address=address,
+            status=OrderStatus.RECEIVED
+        )
+        new_orders.append(new_order)
+        results.append({"index": index, "order_id": new_order.id, "status": new_order.status})
+
+    # Save all valid orders in one write
+    await run_in_threadpool(orders.add_many, new_orders)
+
+    return {"created": len(new_orders), "failed": len(items) - len(new_orders), "results": results}
+
+@app.get("/orders/status")
+async def get_orders_status(ids: str = Query(..., description="Comma-separated order IDs")):
+    """Get the status of many orders by their IDs"""
+    order_ids = [order_id.strip() for order_id in ids.split(",") if order_id.strip()]
+    if len(order_ids) > MAX_BULK_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {MAX_BULK_ITEMS} order IDs per request"
+        )
+
+    found = await run_in_threadpool(orders.get_many, order_ids)
+    return {
+        "orders": [order_status(found[order_id]) if order_id in found
+                   else {"order_id": order_id, "error": "Order not found"}
+                   for order_id in order_ids]
+    }
+
+@app.get("/metrics/admission")
+async def admission_metrics():
+    """Served and rejected requests per route of this worker"""
+    return admission.metrics()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,142 @@
+"""
+Memory per worker process and throughput of the address parsing endpoint for two ways to run workers:
+
+* per-worker load: `uvicorn --workers N`, every worker starts a fresh interpreter and loads the model
+* preload: `gunicorn -c gunicorn.conf.py`, the model is loaded once in the master and the workers
+  are forked from it (copy-on-write)
+
+    python memory_report.py --workers 4 [--model ../spacy_address_model/model-best] [--requests 400]
+
+Memory is read from /proc/<pid>/smaps_rollup (Linux). RSS counts shared pages in every process
+that maps them, PSS divides them between these processes: the sum of PSS is the memory actually
+used by the server.
+"""
+import argparse
+import csv
+import itertools
+import os
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+from benchmark_order_store import free_port
+
+FIELDS = ("Rss", "Pss", "Shared_Clean", "Shared_Dirty", "Private_Clean", "Private_Dirty")
+
+
+def memory(pid: int) -> dict:
+    """
+    Memory of a process in MB from /proc/<pid>/smaps_rollup
+    """
+    values = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in FIELDS:
+                values[name] = int(rest.split()[0]) / 1024
+    return values
+
+
+def process_tree(pid: int) -> list:
+    """
+    The process and all its descendants
+    """
+    children = {}
+    for entry in os.listdir("/proc"):
+        if entry.isdigit():
+            try:
+                with open(f"/proc/{entry}/stat") as f:
+                    parent = int(f.read().rsplit(")", 1)[1].split()[1])
+            except (OSError, IndexError):
+                continue
+            children.setdefault(parent, []).append(int(entry))
+    tree, pending = [], [pid]
+    while pending:
+        current = pending.pop()
+        tree.append(current)
+        pending.extend(children.get(current, []))
+    return tree
+
+
+def command_line(pid: int) -> str:
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        return f.read().replace(b"\0", b" ").decode(errors="replace").strip()
+
+
+def load(base_url, texts, requests, concurrency, batch) -> float:
+    """
+    Sends `requests` batch parse requests with `concurrency` threads, returns the parsed texts per second
+    """
+    payloads = [{"texts": list(itertools.islice(itertools.cycle(texts), i * batch, (i + 1) * batch))}
+                for i in range(requests)]
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        def one(payload):
+            response = client.post("/address/parse/batch", json=payload)
+            response.raise_for_status()
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as executor:
+            list(executor.map(one, payloads))
+        return requests * batch / (time.perf_counter() - start)
+
+
+def run(name, command, env, texts, args):
+    port = free_port()
+    server = subprocess.Popen(command + [f"--bind=127.0.0.1:{port}" if "gunicorn" in command[2] else f"--port={port}"],
+                              env=env)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        for _ in range(600):
+            try:
+                httpx.get(f"{base_url}/pizza")
+                break
+            except httpx.TransportError:
+                time.sleep(0.1)
+        # every worker has to handle requests before its memory is representative
+        load(base_url, texts, 4 * args.workers, args.workers, args.batch)
+        throughput = load(base_url, texts, args.requests, args.concurrency, args.batch)
+
+        print(f"\n{name}: {throughput:.0f} texts/s")
+        print(f"{'pid':>8} {'RSS MB':>8} {'PSS MB':>8} {'shared':>8} {'private':>8}  command")
+        total_pss = 0.0
+        for pid in process_tree(server.pid):
+            try:
+                values = memory(pid)
+            except OSError:
+                continue
+            total_pss += values["Pss"]
+            shared = values["Shared_Clean"] + values["Shared_Dirty"]
+            private = values["Private_Clean"] + values["Private_Dirty"]
+            print(f"{pid:>8} {values['Rss']:>8.1f} {values['Pss']:>8.1f} {shared:>8.1f} {private:>8.1f}  "
+                  f"{command_line(pid)[:60]}")
+        print(f"{'total PSS':>17} {total_pss:>8.1f} MB")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default="../spacy_address_model/model-best")
+    parser.add_argument("--data", default="../spacy_address_model/corpus/trainingdata/address_data.csv")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--requests", type=int, default=400, help="batch requests of the throughput measurement")
+    parser.add_argument("--batch", type=int, default=50, help="texts per request")
+    parser.add_argument("--concurrency", type=int, default=8)
+    args = parser.parse_args()
+
+    with open(args.data, newline="", encoding="utf-8") as f:
+        texts = [row["Address"] for row in csv.DictReader(f)]
+    # all requests come from this client, which the admission control would rate limit
+    env = dict(os.environ, ADDRESS_MODEL_PATH=args.model, ADMISSION_CONTROL="false",
+               WEB_CONCURRENCY=str(args.workers))
+
+    run("per-worker load (uvicorn --workers)",
+        [sys.executable, "-m", "uvicorn", "main:app", "--workers", str(args.workers), "--log-level", "warning"],
+        env, texts, args)
+    run("preload (gunicorn -c gunicorn.conf.py)",
+        [sys.executable, "-m", "gunicorn", "main:app", "-c", "gunicorn.conf.py", "--log-level", "warning"],
+        env, texts, args)
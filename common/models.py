@@ -0,0 +1,37 @@
+from enum import Enum
+from typing import List, Optional
+
+from pydantic import BaseModel
+
+
+# Enums and Models
+class OrderStatus(str, Enum):
+    RECEIVED = "received"
+    PREPARING = "preparing"
+    ON_DELIVERY = "on_delivery"
+    DELIVERED = "delivered"
+
+class Address(BaseModel):
+    city: str
+    street: str
+    house_number: str
+    post_code: Optional[str] = None
+
+class OrderCreate(BaseModel):
+    pizza_id: int
+    city: str
+    street: str
+    house_number: str
+    post_code: Optional[str] = None
+
+class Order(BaseModel):
+    id: str
+    pizza_id: int
+    address: Address
+    status: OrderStatus
+
+class AddressText(BaseModel):
+    text: str
+
+class AddressTexts(BaseModel):
+    texts: List[str]
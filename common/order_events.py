@@ -0,0 +1,87 @@
+"""
+In-process publish/subscribe of order status transitions.
+
+Subscribers (e.g. the server-sent events endpoint) get one event per status change
+instead of polling `GET /order/{order_id}`. With a shared order store (several
+workers) a status change made by another worker is not published in this process;
+for that case the broker can watch the subscribed orders itself: one batched read
+of all subscribed orders per `poll_interval` and worker, instead of one poll per client.
+"""
+import asyncio
+import json
+import logging
+from typing import Dict, Optional, Set
+
+from models import Order, OrderStatus
+
+
+class OrderEventBroker:
+    """
+    Fans out status events of orders to asyncio queues of the subscribers
+    """
+
+    def __init__(self, repository=None, poll_interval: float = 0.0):
+        self.repository = repository
+        self.poll_interval = poll_interval
+        self._subscribers: Dict[str, Set[asyncio.Queue]] = {}
+        self._last_status: Dict[str, OrderStatus] = {}
+        self._watcher: Optional[asyncio.Task] = None
+
+    def subscribe(self, order: Order) -> asyncio.Queue:
+        """
+        Registers a subscriber for the order, the current status is the first event in the queue
+        """
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(order.id, set()).add(queue)
+        self._last_status.setdefault(order.id, order.status)
+        queue.put_nowait(self._event(order.id, self._last_status[order.id]))
+        if self.poll_interval > 0 and self.repository is not None and self._watcher is None:
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+        return queue
+
+    def unsubscribe(self, order_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(order_id)
+        if queues is None:
+            return
+        queues.discard(queue)
+        if not queues:
+            del self._subscribers[order_id]
+            self._last_status.pop(order_id, None)
+
+    def publish(self, order_id: str, status: OrderStatus):
+        """
+        Notifies all subscribers of the order, repeated events with the same status are dropped
+        """
+        if order_id not in self._subscribers or self._last_status.get(order_id) == status:
+            return
+        self._last_status[order_id] = status
+        event = self._event(order_id, status)
+        for queue in self._subscribers[order_id]:
+            queue.put_nowait(event)
+
+    @staticmethod
+    def _event(order_id: str, status: OrderStatus) -> dict:
+        return {"order_id": order_id, "status": status.value}
+
+    async def _watch(self):
+        loop = asyncio.get_running_loop()
+        try:
+            while self._subscribers:
+                await asyncio.sleep(self.poll_interval)
+                try:
+                    # the repository blocks (SQLite), read in a thread instead of on the event loop
+                    found = await loop.run_in_executor(None, self.repository.get_many, list(self._subscribers))
+                except Exception as e:
+                    logging.error("Order status watcher could not read the orders: %s", e)
+                    continue
+                for order_id, order in found.items():
+                    self.publish(order_id, order.status)
+        finally:
+            self._watcher = None
+
+
+def sse_message(event: dict, event_type: str = "status") -> str:
+    """
+    Formats an event as a server-sent events message
+    """
+    return f"event: {event_type}\ndata: {json.dumps(event)}\n\n"
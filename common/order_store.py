@@ -0,0 +1,251 @@
+"""
+Order repositories for the pizza API.
+
+* InMemoryOrderRepository (default): a dict, orders are lost on restart and are
+  only visible to the worker process that created them.
+* SQLiteOrderRepository: an embedded SQLite database in WAL mode, shared by all
+  uvicorn workers on the same host (readers do not block the writer).
+
+The backend is selected with environment variables:
+
+    ORDER_STORE=memory|sqlite   (default: memory)
+    ORDER_DB_PATH=orders.db     (sqlite only)
+    ORDER_DB_POOL_SIZE=4        (sqlite only, connections per worker process)
+"""
+import abc
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from models import Address, Order, OrderStatus
+
+
+class OrderRepository(abc.ABC):
+    """
+    Interface of an order store
+    """
+
+    def add(self, order: Order):
+        self.add_many([order])
+
+    @abc.abstractmethod
+    def add_many(self, orders: Iterable[Order]):
+        """
+        Stores several orders at once (one transaction where the backend supports it)
+        """
+
+    def get(self, order_id: str) -> Optional[Order]:
+        return self.get_many([order_id]).get(order_id)
+
+    @abc.abstractmethod
+    def get_many(self, order_ids: Iterable[str]) -> Dict[str, Order]:
+        """
+        Returns the found orders by ID, unknown IDs are left out
+        """
+
+    @abc.abstractmethod
+    def update_status(self, order_id: str, status: OrderStatus,
+                      expected: Optional[OrderStatus] = None) -> Optional[Order]:
+        """
+        Sets the status of an order, returns the updated order or None if it does not exist
+        or (with `expected`) its status is no longer `expected`
+        """
+
+    @abc.abstractmethod
+    def by_status(self, status: OrderStatus, limit: int = 100) -> List[Order]:
+        ...
+
+    def __contains__(self, order_id: str) -> bool:
+        return self.get(order_id) is not None
+
+
+class InMemoryOrderRepository(OrderRepository):
+    """
+    Stores the orders in a dict of the current process
+    """
+
+    def __init__(self):
+        self._orders: Dict[str, Order] = {}
+        self._lock = threading.Lock()  # the endpoints call the repository from the thread pool
+
+    def add_many(self, orders: Iterable[Order]):
+        orders = list(orders)
+        with self._lock:
+            for order in orders:
+                self._orders[order.id] = order
+
+    def get(self, order_id: str) -> Optional[Order]:
+        return self._orders.get(order_id)
+
+    def get_many(self, order_ids: Iterable[str]) -> Dict[str, Order]:
+        order_ids = list(order_ids)
+        with self._lock:
+            return {order_id: self._orders[order_id] for order_id in order_ids if order_id in self._orders}
+
+    def update_status(self, order_id: str, status: OrderStatus,
+                      expected: Optional[OrderStatus] = None) -> Optional[Order]:
+        with self._lock:
+            order = self._orders.get(order_id)
+            if order is None or expected is not None and order.status != expected:
+                return None
+            order = order.model_copy(update={"status": status})
+            self._orders[order_id] = order
+            return order
+
+    def by_status(self, status: OrderStatus, limit: int = 100) -> List[Order]:
+        with self._lock:
+            orders = list(self._orders.values())
+        return [order for order in orders if order.status == status][:limit]
+
+
+class SQLiteOrderRepository(OrderRepository):
+    """
+    Stores the orders in an SQLite database (WAL mode) with a small connection pool.
+    The order ID is the primary key, the status has its own index.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS orders (
+            id TEXT PRIMARY KEY,
+            pizza_id INTEGER NOT NULL,
+            city TEXT NOT NULL,
+            street TEXT NOT NULL,
+            house_number TEXT NOT NULL,
+            post_code TEXT,
+            status TEXT NOT NULL
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS idx_orders_status ON orders (status);
+    """
+    COLUMNS = "id, pizza_id, city, street, house_number, post_code, status"
+    # SQLite limits the number of host parameters per statement
+    MAX_PARAMETERS = 500
+
+    def __init__(self, path: str = "orders.db", pool_size: int = 4, timeout: float = 5.0):
+        if path == ":memory:":
+            raise ValueError("an in-memory SQLite database cannot be shared, use InMemoryOrderRepository")
+        self.path = path
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self._forget_pool()
+        with self._connection() as connection:
+            connection.executescript(self.SCHEMA)
+            self._migrate(connection)
+        # connections must not be shared with forked processes (e.g. gunicorn --preload workers): a forked
+        # process opens its own on first use, so processes that never use the store (parser pool) open none
+        os.register_at_fork(after_in_child=self._forget_pool)
+
+    @staticmethod
+    def _migrate(connection: sqlite3.Connection):
+        # databases created before the post code was stored
+        columns = {row[1] for row in connection.execute("PRAGMA table_info(orders)")}
+        if "post_code" not in columns:
+            connection.execute("ALTER TABLE orders ADD COLUMN post_code TEXT")
+
+    def _forget_pool(self):
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def _open_pool(self) -> queue.Queue:
+        with self._pool_lock:
+            if self._pool is None:
+                pool = queue.Queue(maxsize=self.pool_size)
+                for _ in range(self.pool_size):
+                    pool.put(self._connect())
+                self._pool = pool
+            return self._pool
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, timeout=self.timeout, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode=WAL")
+        # in WAL mode NORMAL is safe against corruption and avoids an fsync per commit
+        connection.execute("PRAGMA synchronous=NORMAL")
+        connection.execute(f"PRAGMA busy_timeout={int(self.timeout * 1000)}")
+        return connection
+
+    @contextmanager
+    def _connection(self):
+        pool = self._pool or self._open_pool()
+        connection = pool.get(timeout=self.timeout)
+        try:
+            with connection:  # commits, or rolls back on an exception
+                yield connection
+        finally:
+            pool.put(connection)
+
+    @staticmethod
+    def _row(order: Order) -> tuple:
+        return (order.id, order.pizza_id, order.address.city, order.address.street,
+                order.address.house_number, order.address.post_code, order.status.value)
+
+    @staticmethod
+    def _order(row: tuple) -> Order:
+        order_id, pizza_id, city, street, house_number, post_code, status = row
+        return Order(id=order_id, pizza_id=pizza_id,
+                     address=Address(city=city, street=street, house_number=house_number, post_code=post_code),
+                     status=OrderStatus(status))
+
+    def add_many(self, orders: Iterable[Order]):
+        rows = [self._row(order) for order in orders]
+        if not rows:
+            return
+        with self._connection() as connection:
+            connection.executemany(f"INSERT OR REPLACE INTO orders ({self.COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def get(self, order_id: str) -> Optional[Order]:
+        with self._connection() as connection:
+            row = connection.execute(f"SELECT {self.COLUMNS} FROM orders WHERE id = ?", (order_id,)).fetchone()
+        return self._order(row) if row else None
+
+    def get_many(self, order_ids: Iterable[str]) -> Dict[str, Order]:
+        order_ids = list(dict.fromkeys(order_ids))
+        result = {}
+        with self._connection() as connection:
+            for i in range(0, len(order_ids), self.MAX_PARAMETERS):
+                chunk = order_ids[i:i + self.MAX_PARAMETERS]
+                rows = connection.execute(
+                    f"SELECT {self.COLUMNS} FROM orders WHERE id IN ({', '.join('?' * len(chunk))})", chunk)
+                for row in rows:
+                    result[row[0]] = self._order(row)
+        return result
+
+    def update_status(self, order_id: str, status: OrderStatus,
+                      expected: Optional[OrderStatus] = None) -> Optional[Order]:
+        with self._connection() as connection:
+            if expected is None:
+                cursor = connection.execute("UPDATE orders SET status = ? WHERE id = ?", (status.value, order_id))
+            else:
+                # compare and set in one statement, concurrent updates of the same order cannot both succeed
+                cursor = connection.execute("UPDATE orders SET status = ? WHERE id = ? AND status = ?",
+                                            (status.value, order_id, expected.value))
+            if cursor.rowcount == 0:
+                return None
+            row = connection.execute(f"SELECT {self.COLUMNS} FROM orders WHERE id = ?", (order_id,)).fetchone()
+        return self._order(row) if row else None
+
+    def by_status(self, status: OrderStatus, limit: int = 100) -> List[Order]:
+        with self._connection() as connection:
+            rows = connection.execute(
+                f"SELECT {self.COLUMNS} FROM orders WHERE status = ? LIMIT ?", (status.value, limit)).fetchall()
+        return [self._order(row) for row in rows]
+
+    def close(self):
+        while self._pool is not None and not self._pool.empty():
+            self._pool.get_nowait().close()
+
+
+def create_order_repository() -> OrderRepository:
+    """
+    Creates the order repository configured by the environment (see module docstring)
+    """
+    backend = os.environ.get("ORDER_STORE", "memory").lower()
+    if backend == "memory":
+        return InMemoryOrderRepository()
+    if backend == "sqlite":
+        return SQLiteOrderRepository(
+            path=os.environ.get("ORDER_DB_PATH", "orders.db"),
+            pool_size=int(os.environ.get("ORDER_DB_POOL_SIZE", "4")),
+        )
+    raise ValueError(f"Unknown ORDER_STORE '{backend}', use 'memory' or 'sqlite'")
@@ -0,0 +1,236 @@
+"""
+The greeting graphs of `langgraph_basics.ipynb` as an importable module.
+
+Interactive input is not called directly inside the nodes: it is read from an input provider,
+which is passed per run via `config={"configurable": {"input_provider": ...}}` (default: `input`).
+This allows to run many states at once with `run_batch`/`arun_batch`.
+
+Throughput benchmark (sequential `invoke` vs. `batch`/`abatch`):
+
+    python greeting_graphs.py [--states 5000] [--max-concurrency 16] [--input-delay-ms 0]
+"""
+import argparse
+import asyncio
+import logging
+import time
+from typing import Callable, Dict, List, Literal, Optional, TypedDict
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.graph import StateGraph, START, END
+
+
+logger = logging.getLogger(__name__)
+
+USER_NAME_KEY = "user_name"
+OUTPUT_KEY = "output"
+COUNTER_KEY = "counter"
+
+ASK_USER_NAME_NODE = "ask_user_name"
+GREETING_NODE = "greeting"
+
+INPUT_PROVIDER_KEY = "input_provider"
+
+
+class AgentState(TypedDict):
+    """State for the agent. (schema)"""
+    user_name: str
+    output: List[str]
+
+
+class ScriptedInput:
+    """
+    Input provider that returns prepared answers instead of reading from the console
+    """
+
+    def __init__(self, answers: List[str], delay: float = 0.0):
+        self.answers = list(answers)
+        self.delay = delay  # simulated waiting time per answer (seconds)
+        self._position = 0
+
+    def __call__(self, prompt: str = "") -> str:
+        if self.delay:
+            time.sleep(self.delay)
+        answer = self.answers[self._position]
+        self._position += 1
+        return answer
+
+
+def get_input_provider(config: Optional[RunnableConfig]) -> Callable[[str], str]:
+    """
+    Returns the input provider of the current run (default: console input)
+    """
+    return ((config or {}).get("configurable") or {}).get(INPUT_PROVIDER_KEY, input)
+
+
+def greeting_node(state: AgentState) -> AgentState:
+    """
+        user_name: should be the user's name
+        output: Greet the user.
+    """
+    # update the state
+    logger.info(f"Greeting user: {state[USER_NAME_KEY]}")
+    state[OUTPUT_KEY].append(f"Hello, {state[USER_NAME_KEY]}!")
+    return state
+
+
+def ask_user_name(state: AgentState, config: RunnableConfig) -> AgentState:
+    """
+        asks the user for their name
+        stores the name in the state
+    """
+    logger.info("Interactive: Ask for user name")
+    state[OUTPUT_KEY].append("Please enter your name: ")
+    state[USER_NAME_KEY] = get_input_provider(config)(state[OUTPUT_KEY][-1])
+    return state
+
+
+def should_ask_user_name(state: AgentState) -> Literal[ASK_USER_NAME_NODE, GREETING_NODE]:
+    """
+        returns the node to go to next
+        if the user name is not known, ask for it
+        otherwise, go to the greeting node
+    """
+    logger.info(f"User name: {state.get(USER_NAME_KEY)}")
+    if state.get(USER_NAME_KEY) is not None:
+        logger.info("let's go to the greeting node")
+        return GREETING_NODE
+    else:
+        logger.info("let's go to the ask user name node")
+        return ASK_USER_NAME_NODE
+
+
+def ask_for_more_users(state: AgentState, config: RunnableConfig) -> Literal[ASK_USER_NAME_NODE, END]:
+    """
+        asks the user if they want to add another user
+        returns the ASK_USER_NAME_NODE if they want to add another user
+        otherwise, returns the END node
+    """
+    logger.info("Interactive: Ask for more users")
+    state[OUTPUT_KEY].append("Do you want to add another user? (y/n)")
+    user_input = get_input_provider(config)(state[OUTPUT_KEY][-1])
+    if user_input == "y":
+        logger.info("let's go to the ask user name node for another user name.")
+        return ASK_USER_NAME_NODE
+    else:
+        logger.info("let's go to the end node")
+        return END
+
+
+def build_hello_world():
+    """START --> greeting --> END"""
+    graph = StateGraph(AgentState)
+    graph.add_node(GREETING_NODE, greeting_node)
+    graph.set_entry_point(GREETING_NODE)
+    graph.set_finish_point(GREETING_NODE)
+    return graph.compile()
+
+
+def build_ask_user_name():
+    """START --> ask_user_name --> greeting --> END"""
+    graph = StateGraph(AgentState)
+    graph.add_node(ASK_USER_NAME_NODE, ask_user_name)
+    graph.add_node(GREETING_NODE, greeting_node)
+    graph.add_edge(START, ASK_USER_NAME_NODE)
+    graph.add_edge(ASK_USER_NAME_NODE, GREETING_NODE)
+    graph.add_edge(GREETING_NODE, END)
+    return graph.compile()
+
+
+def build_conditional():
+    """START --(name unknown)--> ask_user_name --> greeting --> END, START --(name known)--> greeting"""
+    graph = StateGraph(AgentState)
+    graph.add_node(ASK_USER_NAME_NODE, ask_user_name)
+    graph.add_node(GREETING_NODE, greeting_node)
+    graph.add_conditional_edges(START, should_ask_user_name)
+    graph.add_edge(ASK_USER_NAME_NODE, GREETING_NODE)
+    graph.add_edge(GREETING_NODE, END)
+    return graph.compile()
+
+
+def build_loop():
+    """Like `build_conditional`, but loops back to ask_user_name while more users should be greeted"""
+    graph = StateGraph(AgentState)
+    graph.add_node(ASK_USER_NAME_NODE, ask_user_name)
+    graph.add_node(GREETING_NODE, greeting_node)
+    graph.add_conditional_edges(START, should_ask_user_name)
+    graph.add_edge(ASK_USER_NAME_NODE, GREETING_NODE)
+    graph.add_conditional_edges(GREETING_NODE, ask_for_more_users)
+    return graph.compile()
+
+
+def _configs(input_providers: Optional[List[Callable]], max_concurrency: int, count: int):
+    if input_providers is None:
+        return {"max_concurrency": max_concurrency}
+    if len(input_providers) != count:
+        raise ValueError("one input provider per state is required")
+    return [{"max_concurrency": max_concurrency, "configurable": {INPUT_PROVIDER_KEY: provider}}
+            for provider in input_providers]
+
+
+def run_batch(app, states: List[Dict], max_concurrency: int = 16,
+              input_providers: Optional[List[Callable]] = None) -> List[Dict]:
+    """
+    Runs all states through the compiled graph with at most `max_concurrency` runs at the same time.
+    `input_providers` (optional) holds one input provider per state.
+    """
+    return app.batch(states, config=_configs(input_providers, max_concurrency, len(states)))
+
+
+async def arun_batch(app, states: List[Dict], max_concurrency: int = 16,
+                     input_providers: Optional[List[Callable]] = None) -> List[Dict]:
+    """
+    Async variant of `run_batch`
+    """
+    return await app.abatch(states, config=_configs(input_providers, max_concurrency, len(states)))
+
+
+def _benchmark_states(count: int, delay: float):
+    """
+    Half of the states know the user name, the other half is asked for it (and for one more user)
+    """
+    states, providers = [], []
+    for i in range(count):
+        if i % 2:
+            states.append({USER_NAME_KEY: f"User {i}", OUTPUT_KEY: []})
+            providers.append(ScriptedInput(["n"], delay))
+        else:
+            states.append({OUTPUT_KEY: []})
+            providers.append(ScriptedInput([f"User {i}", "y", f"Guest {i}", "n"], delay))
+    return states, providers
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--states", type=int, default=5000)
+    parser.add_argument("--max-concurrency", type=int, default=16)
+    parser.add_argument("--input-delay-ms", type=float, default=0.0,
+                        help="simulated waiting time of every input, e.g. for a remote input source")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING)
+
+    app = build_loop()
+    delay = args.input_delay_ms / 1000
+
+    states, providers = _benchmark_states(args.states, delay)
+    start = time.perf_counter()
+    sequential = [app.invoke(state, config={"configurable": {INPUT_PROVIDER_KEY: provider}})
+                  for state, provider in zip(states, providers)]
+    sequential_seconds = time.perf_counter() - start
+
+    states, providers = _benchmark_states(args.states, delay)
+    start = time.perf_counter()
+    batched = run_batch(app, states, args.max_concurrency, providers)
+    batch_seconds = time.perf_counter() - start
+
+    states, providers = _benchmark_states(args.states, delay)
+    start = time.perf_counter()
+    abatched = asyncio.run(arun_batch(app, states, args.max_concurrency, providers))
+    abatch_seconds = time.perf_counter() - start
+
+    assert sequential == batched == abatched, "batched results differ from sequential results"
+
+    print(f"{args.states} states, max_concurrency={args.max_concurrency}, input delay {args.input_delay_ms} ms")
+    for name, seconds in (("invoke (sequential)", sequential_seconds), ("batch", batch_seconds),
+                          ("abatch", abatch_seconds)):
+        print(f"{name:<20} {seconds:8.2f} s {args.states / seconds:10.0f} states/s "
+              f"{sequential_seconds / seconds:6.2f}x")
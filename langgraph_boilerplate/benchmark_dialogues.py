@@ -0,0 +1,168 @@
+"""
+Replays scripted dialogues against the compiled pizza bot graph (no console I/O).
+
+Usage:
+    python benchmark_dialogues.py [--corpus data/dialogues.json] [--repeat 20]
+    python benchmark_dialogues.py --save-baseline baseline.json
+    python benchmark_dialogues.py --baseline baseline.json [--tolerance 0.25]
+
+Reports turns per second, per-turn latency, the time per node (CheckerNode, RetrievalNode, OrderNode),
+the memory growth per conversation and the number of message objects created.
+With --baseline the script exits with status 1 if a dialogue does not reach its expected outcome
+or a metric is more than --tolerance worse than the baseline (regression gate).
+"""
+import argparse
+import json
+import logging
+import sys
+import time
+import tracemalloc
+
+from pizzabot import build_graph, get_graph, next_state, logger as pizzabot_logger
+from tracing import GraphTracer
+
+
+def load_corpus(path: str) -> list:
+    """
+    Loads the dialogues and expands `repeat_turns`/`final_turns` into the plain list of turns
+    """
+    with open(path, encoding="utf-8") as f:
+        dialogues = json.load(f)
+    for dialogue in dialogues:
+        dialogue["turns"] = dialogue["turns"] * dialogue.get("repeat_turns", 1) + dialogue.get("final_turns", [])
+    return dialogues
+
+
+def replay(graph, turns: list, latencies: list = None) -> dict:
+    """
+    Plays the user turns of one conversation, returns the final state
+    """
+    outputs = None
+    for user_input in turns:
+        start = time.perf_counter()
+        outputs = graph.invoke(next_state(user_input, outputs))
+        if latencies is not None:
+            latencies.append(time.perf_counter() - start)
+    return outputs
+
+
+def check_outcome(dialogue: dict, outputs: dict) -> list:
+    expect = dialogue.get("expect", {})
+    errors = []
+    for key in ("ended", "slots"):
+        if key in expect and outputs[key] != expect[key]:
+            errors.append(f"{dialogue['name']}: expected {key}={expect[key]!r}, got {outputs[key]!r}")
+    return errors
+
+
+def percentile(values: list, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def run(dialogues: list, repeat: int) -> dict:
+    graph = get_graph()
+    results = {"errors": []}
+
+    # 1. throughput and per-turn latency (untraced)
+    for dialogue in dialogues:
+        results["errors"].extend(check_outcome(dialogue, replay(graph, dialogue["turns"])))  # also warms up
+    latencies = []
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for dialogue in dialogues:
+            replay(graph, dialogue["turns"], latencies)
+    elapsed = time.perf_counter() - start
+    results["turns"] = len(latencies)
+    results["turns_per_second"] = len(latencies) / elapsed
+    results["latency_ms"] = {q: percentile(latencies, p) * 1000
+                             for q, p in (("p50", 0.50), ("p95", 0.95), ("p99", 0.99))}
+
+    # 2. time per node
+    tracer = GraphTracer()
+    traced_graph = build_graph(tracer)
+    for _ in range(repeat):
+        for dialogue in dialogues:
+            replay(traced_graph, dialogue["turns"])
+    results["nodes_mean_ms"] = {name: row["mean_ms"] for name, row in tracer.histogram().items()}
+
+    # 3. memory growth and message objects per conversation
+    results["conversations"] = {}
+    tracemalloc.start()
+    for dialogue in dialogues:
+        before = tracemalloc.take_snapshot()
+        outputs = replay(graph, dialogue["turns"])
+        growth = sum(stat.size_diff for stat in tracemalloc.take_snapshot().compare_to(before, "filename"))
+        results["conversations"][dialogue["name"]] = {
+            "turns": len(dialogue["turns"]),
+            "memory_growth_kb": growth / 1024,
+            "messages_created": len(outputs["messages"]),
+        }
+        del outputs
+    tracemalloc.stop()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Returns the metrics that regressed by more than the tolerance
+    """
+    regressions = []
+
+    def check(name, value, reference, higher_is_better=False):
+        if not reference:
+            return
+        change = (reference - value) / reference if higher_is_better else (value - reference) / reference
+        if change > tolerance:
+            regressions.append(f"{name}: {value:.4g} vs. baseline {reference:.4g} ({change:+.0%})")
+
+    check("turns_per_second", results["turns_per_second"], baseline.get("turns_per_second"), higher_is_better=True)
+    for q, value in results["latency_ms"].items():
+        check(f"latency_ms.{q}", value, baseline.get("latency_ms", {}).get(q))
+    for name, value in results["nodes_mean_ms"].items():
+        check(f"nodes_mean_ms.{name}", value, baseline.get("nodes_mean_ms", {}).get(name))
+    for name, row in results["conversations"].items():
+        reference = baseline.get("conversations", {}).get(name, {})
+        check(f"{name}.messages_created", row["messages_created"], reference.get("messages_created"))
+    return regressions
+
+
+def report(results: dict):
+    print(f"turns: {results['turns']}, {results['turns_per_second']:.0f} turns/s")
+    print("per-turn latency: " + ", ".join(f"{q} {v:.3f} ms" for q, v in results["latency_ms"].items()))
+    print("\nmean time per node:")
+    for name, value in sorted(results["nodes_mean_ms"].items(), key=lambda item: item[1], reverse=True):
+        print(f"  {name:<22} {value:.4f} ms")
+    print(f"\n{'conversation':<34} {'turns':>6} {'memory growth':>14} {'messages':>9}")
+    for name, row in results["conversations"].items():
+        print(f"{name:<34} {row['turns']:>6} {row['memory_growth_kb']:>11.1f} KB {row['messages_created']:>9}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="data/dialogues.json")
+    parser.add_argument("--repeat", type=int, default=20, help="replays of the whole corpus for the timing")
+    parser.add_argument("--save-baseline", metavar="FILE", help="store the results as the new baseline")
+    parser.add_argument("--baseline", metavar="FILE", help="compare against a stored baseline (regression gate)")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed relative regression (default 0.25)")
+    parser.add_argument("--log", action="store_true", help="keep the pizza bot's INFO logging (slows down the run)")
+    args = parser.parse_args()
+
+    if not args.log:
+        pizzabot_logger.setLevel(logging.WARNING)
+
+    results = run(load_corpus(args.corpus), args.repeat)
+    report(results)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nBaseline saved to {args.save_baseline}")
+
+    failures = list(results["errors"])
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            failures.extend(compare(results, json.load(f), args.tolerance))
+    if failures:
+        print("\nFAILED:\n  " + "\n  ".join(failures))
+        sys.exit(1)
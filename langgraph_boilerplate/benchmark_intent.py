@@ -0,0 +1,84 @@
+"""
+Benchmark of the intent classifiers behind the CheckerNode.
+
+Usage: python benchmark_intent.py [--data data/intent_utterances.csv] [--repeat 2000]
+
+Reports accuracy and the mean time per utterance for
+* the previous keyword scan (lower-case + one `in` search per keyword),
+* the precompiled KeywordIntentMatcher,
+* the HashedNgramClassifier (accuracy via k-fold cross-validation, requires numpy).
+"""
+import argparse
+import csv
+import time
+
+from intent import HashedNgramClassifier, KeywordIntentMatcher, ORDER_INTENT, OTHER_INTENT
+
+
+class LegacyKeywordScan:
+    """
+    The keyword check the CheckerNode used before the compiled matcher (baseline)
+    """
+
+    def __init__(self, keywords: list = ["order", "pizza"]):
+        self.keywords = keywords
+
+    def predict(self, text: str) -> str:
+        _input = text.lower()
+        return ORDER_INTENT if all(keyword in _input for keyword in self.keywords) else OTHER_INTENT
+
+
+def load_utterances(path: str):
+    with open(path, newline="", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    return [row["text"] for row in rows], [row["label"] for row in rows]
+
+
+def accuracy(classifier, texts, labels):
+    return sum(classifier.predict(text) == label for text, label in zip(texts, labels)) / len(texts)
+
+
+def time_per_utterance(classifier, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            classifier.predict(text)
+    return (time.perf_counter() - start) / (repeat * len(texts))
+
+
+def cross_validated_accuracy(texts, labels, folds=5):
+    correct = 0
+    for fold in range(folds):
+        train = [i for i in range(len(texts)) if i % folds != fold]
+        model = HashedNgramClassifier(labels=sorted(set(labels))).fit(
+            [texts[i] for i in train], [labels[i] for i in train])
+        correct += sum(model.predict(texts[i]) == labels[i] for i in range(fold, len(texts), folds))
+    return correct / len(texts)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default="data/intent_utterances.csv", help="CSV file with `text` and `label` columns")
+    parser.add_argument("--repeat", type=int, default=2000, help="passes over the utterances for the timing")
+    parser.add_argument("--save-model", help="stores the n-gram model trained on all utterances (.npz)")
+    args = parser.parse_args()
+
+    texts, labels = load_utterances(args.data)
+    print(f"{len(texts)} labelled utterances from {args.data}\n")
+    print(f"{'classifier':<24} {'accuracy':>9} {'µs/utterance':>13}")
+
+    for name, classifier in [("legacy keyword scan", LegacyKeywordScan()),
+                             ("compiled matcher", KeywordIntentMatcher.from_keywords(["order", "pizza"]))]:
+        print(f"{name:<24} {accuracy(classifier, texts, labels):>9.1%} "
+              f"{time_per_utterance(classifier, texts, args.repeat) * 1e6:>13.2f}")
+
+    try:
+        model = HashedNgramClassifier(labels=sorted(set(labels))).fit(texts, labels)
+    except ImportError as e:
+        print(f"{'hashed n-gram':<24} skipped: {e}")
+    else:
+        print(f"{'hashed n-gram (5-fold)':<24} {cross_validated_accuracy(texts, labels):>9.1%} "
+              f"{time_per_utterance(model, texts, max(1, args.repeat // 10)) * 1e6:>13.2f}")
+        if args.save_model:
+            model.save(args.save_model)
+            print(f"\nModel saved to {args.save_model}")
@@ -0,0 +1,166 @@
+import abc
+import re
+import zlib
+from typing import Dict, Iterable, List, Optional
+
+
+ORDER_INTENT = "order_pizza"
+OTHER_INTENT = "other"
+
+# Variants that count as the same keyword (inflections, synonyms, German/Italian/French forms)
+DEFAULT_SYNONYMS = {
+    "order": ["order", "buy", "get me", "deliver", "bestell", "ordinar", "commande"],
+    "pizza": ["pizza", "pizze", "pizzen"],
+}
+
+
+class IntentClassifier(abc.ABC):
+    """
+    Base class for intent classifiers used by the CheckerNode
+    """
+
+    @abc.abstractmethod
+    def predict(self, text: str) -> str:
+        """
+        Returns the intent label for the given utterance
+        """
+
+
+class KeywordIntentMatcher(IntentClassifier):
+    """
+    Matches all keyword groups of an intent with a single precompiled regex union.
+
+    Every group (e.g. "order", "pizza") is a named alternative of the union, so one
+    scan over the utterance finds all groups at once instead of one `in` search per keyword.
+    A variant matches at a word start and swallows the rest of the word, i.e. "bestell"
+    also matches "bestellen" and "Bestellung".
+    """
+
+    def __init__(self, groups: Dict[str, List[str]], intent: str = ORDER_INTENT, fallback: str = OTHER_INTENT):
+        self.intent = intent
+        self.fallback = fallback
+        self._group_names = {f"g{i}": name for i, name in enumerate(groups)}
+        alternatives = []
+        for group_id, name in self._group_names.items():
+            # longest variants first, so a short variant never shadows a longer one in the alternation
+            variants = sorted(groups[name], key=len, reverse=True)
+            variants = "|".join(re.escape(variant).replace(r"\ ", r"\s+") for variant in variants)
+            alternatives.append(f"(?P<{group_id}>{variants})")
+        self._pattern = re.compile(r"\b(?:" + "|".join(alternatives) + r")\w*", re.IGNORECASE)
+        self._required = len(self._group_names)
+
+    @classmethod
+    def from_keywords(cls, keywords: Iterable[str], synonyms: Optional[Dict[str, List[str]]] = None, **kwargs):
+        """
+        Builds a matcher that requires every keyword (or one of its synonyms) to be present
+        """
+        synonyms = DEFAULT_SYNONYMS if synonyms is None else synonyms
+        return cls({keyword: synonyms.get(keyword, [keyword]) for keyword in keywords}, **kwargs)
+
+    def matched_groups(self, text: str) -> set:
+        """
+        Returns the names of the keyword groups found in the text
+        """
+        found = set()
+        for match in self._pattern.finditer(text):
+            found.add(match.lastgroup)
+            if len(found) == self._required:
+                break
+        return {self._group_names[group_id] for group_id in found}
+
+    def predict(self, text: str) -> str:
+        if len(self.matched_groups(text)) == self._required:
+            return self.intent
+        return self.fallback
+
+
+class HashedNgramClassifier(IntentClassifier):
+    """
+    Linear classifier over hashed character n-grams, scored with NumPy.
+
+    Character n-grams make the model robust to inflections and typos and need no
+    language-specific tokenizer. Features are hashed with crc32 (stable across processes)
+    into a fixed number of buckets, so no vocabulary has to be kept in memory.
+    """
+
+    def __init__(self, labels: List[str], n_features: int = 2 ** 16, ngram_range: tuple = (2, 4)):
+        try:
+            import numpy as np
+        except ImportError as e:
+            raise ImportError("HashedNgramClassifier requires numpy (pip install numpy)") from e
+        self._np = np
+        self.labels = list(labels)
+        self.n_features = n_features
+        self.ngram_range = ngram_range
+        self.weights = np.zeros((n_features, len(self.labels)), dtype=np.float32)
+        self.bias = np.zeros(len(self.labels), dtype=np.float32)
+
+    def features(self, text: str):
+        """
+        Returns the hashed feature indices of the character n-grams of the text
+        """
+        text = f" {' '.join(text.lower().split())} "
+        low, high = self.ngram_range
+        indices = {
+            zlib.crc32(text[i:i + n].encode("utf-8")) % self.n_features
+            for n in range(low, high + 1)
+            for i in range(len(text) - n + 1)
+        }
+        return self._np.fromiter(indices, dtype=self._np.int64, count=len(indices))
+
+    def scores(self, text: str):
+        """
+        Returns one score per label
+        """
+        return self.weights[self.features(text)].sum(axis=0) + self.bias
+
+    def predict(self, text: str) -> str:
+        return self.labels[int(self.scores(text).argmax())]
+
+    def fit(self, texts: List[str], labels: List[str], epochs: int = 10, learning_rate: float = 1.0, seed: int = 0):
+        """
+        Trains the weights with the averaged multiclass perceptron rule
+        """
+        np = self._np
+        label_ids = [self.labels.index(label) for label in labels]
+        examples = [self.features(text) for text in texts]
+        rng = np.random.default_rng(seed)
+        # averaging trick: keep the step-weighted sum of all updates instead of summing the weights every step
+        updates = np.zeros_like(self.weights)
+        bias_updates = np.zeros_like(self.bias)
+        step = 1
+        for _ in range(epochs):
+            for i in rng.permutation(len(examples)):
+                features, gold = examples[i], label_ids[i]
+                guess = int((self.weights[features].sum(axis=0) + self.bias).argmax())
+                if guess != gold:
+                    for label, sign in ((gold, learning_rate), (guess, -learning_rate)):
+                        self.weights[features, label] += sign
+                        updates[features, label] += step * sign
+                        self.bias[label] += sign
+                        bias_updates[label] += step * sign
+                step += 1
+        self.weights -= updates / step
+        self.bias -= bias_updates / step
+        return self
+
+    def save(self, path: str):
+        """
+        Stores the model as a compressed .npz file
+        """
+        self._np.savez_compressed(path, weights=self.weights, bias=self.bias, labels=self.labels,
+                                  ngram_range=self.ngram_range)
+
+    @classmethod
+    def load(cls, path: str):
+        """
+        Loads a model stored with `save`
+        """
+        import numpy as np
+
+        data = np.load(path)
+        model = cls(labels=[str(label) for label in data["labels"]], n_features=data["weights"].shape[0],
+                    ngram_range=tuple(int(n) for n in data["ngram_range"]))
+        model.weights = data["weights"]
+        model.bias = data["bias"]
+        return model
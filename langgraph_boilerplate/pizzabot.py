@@ -1,3 +1,6 @@
+import time
+_IMPORT_START = time.perf_counter()
+
 from typing import TypedDict
 
 from langgraph.graph import END, StateGraph
@@ -6,9 +9,13 @@ from langchain_core.messages import (
     FunctionMessage,
 )
 from enum import Enum
-from IPython.display import Image, display
-from PIL import Image as PILImage
+from functools import lru_cache
+import argparse
 import logging
+import os
+
+from intent import IntentClassifier, KeywordIntentMatcher, ORDER_INTENT
+from tracing import GraphTracer
 
 # LOGGING with colorformatter
 
@@ -62,8 +69,10 @@ class CheckerNode:
     This node checks whether user input is valid
     """
 
-    def __init__(self, keywords: list = ["order", "pizza"]):
+    def __init__(self, keywords: list = ["order", "pizza"], classifier: IntentClassifier = None):
         self.keywords = keywords
+        # all keywords are compiled into one matcher once, instead of scanning the input per keyword
+        self.classifier = classifier or KeywordIntentMatcher.from_keywords(keywords)
 
     def invoke(self, state: ChatbotState) -> str:
         """
@@ -77,8 +86,7 @@ class CheckerNode:
                 "ended": state["ended"]
             }
 
-        _input = state['input'].lower()
-        if not all(keyword in _input for keyword in self.keywords):
+        if self.classifier.predict(state['input']) != ORDER_INTENT:
             state['messages'].append(AIMessage(
                 content="Invalid order. Please specify a pizza order. Try writing 'I want to order a pizza'."))
             return {
@@ -206,20 +214,33 @@ class RetrievalNode:
             }
 
 
-if __name__ == "__main__":
+_IMPORT_SECONDS = time.perf_counter() - _IMPORT_START
+
+
+def build_graph(tracer: GraphTracer = None):
+    """
+    Builds and compiles the dialogue graph of the pizza bot.
+    If a tracer is given, all nodes and routers are instrumented with it.
+    """
     # Initialize nodes
     order_node = OrderNode()
     checker_node = CheckerNode()
     retrieval_node = RetrievalNode()
 
+    def node(name, func):
+        return tracer.wrap_node(name, func) if tracer else func
+
+    def router(name, func):
+        return tracer.wrap_router(name, func) if tracer else func
+
     workflow = StateGraph(ChatbotState)
-    workflow.add_node(Nodes.CHECKER.value, checker_node.invoke)
-    workflow.add_node(Nodes.RETRIEVAL.value, retrieval_node.invoke)
-    workflow.add_node(Nodes.ORDER_FORM.value, order_node.invoke)
+    workflow.add_node(Nodes.CHECKER.value, node(Nodes.CHECKER.value, checker_node.invoke))
+    workflow.add_node(Nodes.RETRIEVAL.value, node(Nodes.RETRIEVAL.value, retrieval_node.invoke))
+    workflow.add_node(Nodes.ORDER_FORM.value, node(Nodes.ORDER_FORM.value, order_node.invoke))
 
     workflow.add_conditional_edges(
         Nodes.CHECKER.value,
-        checker_node.route,
+        router(Nodes.CHECKER.value, checker_node.route),
         {
             Nodes.RETRIEVAL.value: Nodes.RETRIEVAL.value,
             END: END,
@@ -229,30 +250,109 @@ if __name__ == "__main__":
     workflow.add_edge(Nodes.ORDER_FORM.value, END)
 
     workflow.set_entry_point(Nodes.CHECKER.value)
-    graph = workflow.compile()
+    return workflow.compile()
+
+
+@lru_cache(maxsize=None)
+def get_graph():
+    """
+    Returns the compiled dialogue graph, built once per process
+    """
+    return build_graph()
+
+
+def draw_graph(graph, path: str = "pizzabot.png", force: bool = False) -> bool:
+    """
+    Renders the graph to a PNG file.
+    The Mermaid source is stored next to the image (`.mmd`), the (remote) rendering
+    is skipped while the graph is unchanged. Returns True if the image was rendered.
+    """
+    mermaid = graph.get_graph().draw_mermaid()
+    source_path = os.path.splitext(path)[0] + ".mmd"
+    if not force and os.path.exists(path) and os.path.exists(source_path):
+        with open(source_path, encoding="utf-8") as f:
+            if f.read() == mermaid:
+                return False
 
     img_data = graph.get_graph().draw_mermaid_png()
-    with open("pizzabot.png", "wb") as f:
+    with open(path, "wb") as f:
         f.write(img_data)
+    with open(source_path, "w", encoding="utf-8") as f:
+        f.write(mermaid)
+    return True
 
-    # save the image to a file
 
+def display_graph(graph):
+    """
+    Displays the graph in a Jupyter notebook (requires IPython)
+    """
+    from IPython.display import Image, display
+
+    display(Image(graph.get_graph().draw_mermaid_png()))
+
+
+def last_ai_message(messages: list) -> str:
+    return [m.content for m in messages if isinstance(m, AIMessage)][-1]
+
+
+def next_state(user_input: str, outputs: dict = None) -> ChatbotState:
+    """
+    Returns the graph input for the next turn, continuing from the outputs of the previous turn
+    """
+    if outputs is None:
+        return {"input": user_input, "slots": {}, "messages": [], "active_order": False, "ended": False}
+    return {"input": user_input, "slots": outputs["slots"], "messages": outputs["messages"],
+            "active_order": outputs["active_order"], "ended": outputs["ended"]}
+
+
+def run_dialogue(graph, read=input, write=print):
+    """
+    Runs the console dialogue until the order is completed
+    """
     # START DIALOGUE: first message
-    print("-- Chatbot: ", "Hi! I am a pizza bot. I can help you order a pizza. What would you like to order?")
-    user_input = input("-> Your response: ")
-    outputs = graph.invoke({"input": user_input, "slots": {}, "messages": [
-    ], "active_order": False, "ended": False})
+    write("-- Chatbot: ", "Hi! I am a pizza bot. I can help you order a pizza. What would you like to order?")
+    user_input = read("-> Your response: ")
+    outputs = graph.invoke(next_state(user_input))
 
     while True:
-        print("-- Chatbot: ", [m.content for m in outputs["messages"]
-              if isinstance(m, AIMessage)][-1])  # print chatbot response
-        user_input = input("-> Your response: ")
+        write("-- Chatbot: ", last_ai_message(outputs["messages"]))  # print chatbot response
+        user_input = read("-> Your response: ")
 
-        outputs = graph.invoke({"input": user_input, "slots": outputs["slots"], "messages": outputs[
-                               "messages"], "active_order": outputs["active_order"], "ended": outputs["ended"]})
+        outputs = graph.invoke(next_state(user_input, outputs))
 
         # check if the conversation has ended
         if outputs["ended"]:
-            print("-- Chatbot: ", [m.content for m in outputs["messages"]
-                  if isinstance(m, AIMessage)][-1])  # print chatbot response
-            break
+            write("-- Chatbot: ", last_ai_message(outputs["messages"]))  # print chatbot response
+            return outputs
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pizza ordering chatbot")
+    parser.add_argument("--timing", action="store_true", help="report the cold start time")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="trace the node executions, write the events (JSON lines) to FILE and print a histogram")
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.add_parser("chat", help="start the dialogue (default)")
+    draw_parser = subparsers.add_parser("draw", help="render the dialogue graph to a PNG file")
+    draw_parser.add_argument("--output", default="pizzabot.png")
+    draw_parser.add_argument("--force", action="store_true", help="render even if the graph is unchanged")
+    args = parser.parse_args()
+
+    tracer = GraphTracer() if args.trace else None
+    build_start = time.perf_counter()
+    graph = build_graph(tracer) if tracer else get_graph()
+    if args.timing:
+        logger.info("Cold start: imports %.1f ms, graph build %.1f ms" % (
+            _IMPORT_SECONDS * 1000, (time.perf_counter() - build_start) * 1000))
+
+    if args.command == "draw":
+        if draw_graph(graph, args.output, force=args.force):
+            logger.info("Graph rendered to %s" % args.output)
+        else:
+            logger.info("Graph unchanged, reusing %s" % args.output)
+    else:
+        run_dialogue(graph)
+
+    if tracer:
+        tracer.export_jsonl(args.trace)
+        print(tracer.summary())
@@ -0,0 +1,189 @@
+import bisect
+import functools
+import inspect
+import json
+import logging
+import threading
+import time
+from collections.abc import Sized
+from typing import Callable, Dict, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (ms) of the latency histogram buckets, the last bucket is open-ended
+DEFAULT_BUCKETS_MS = (0.01, 0.1, 0.5, 1, 5, 10, 50, 100, 500, 1000, 5000)
+
+
+def _fingerprint(value):
+    """
+    Cheap fingerprint of a state value. Nodes often mutate lists/dicts in place,
+    so containers are compared by identity and length instead of by equality.
+    """
+    if isinstance(value, (list, dict, set)):
+        return id(value), len(value)
+    return value
+
+
+def _messages_count(state) -> Optional[int]:
+    messages = state.get("messages") if isinstance(state, dict) else None
+    return len(messages) if isinstance(messages, Sized) else None
+
+
+class GraphTracer:
+    """
+    Records the execution of StateGraph nodes and conditional routers.
+
+    Wrap the callables before adding them to the graph:
+
+        tracer = GraphTracer()
+        workflow.add_node("checker", tracer.wrap_node("checker", checker_node.invoke))
+        workflow.add_conditional_edges("checker", tracer.wrap_router("checker", checker_node.route), {...})
+
+    Every call produces one structured event (see `events`), which can be exported as
+    JSON lines; `histogram()` aggregates the wall times per node.
+    """
+
+    def __init__(self, buckets_ms: tuple = DEFAULT_BUCKETS_MS):
+        self.buckets_ms = tuple(buckets_ms)
+        self.events: List[dict] = []
+        self._lock = threading.Lock()
+
+    def _record(self, event: dict):
+        with self._lock:
+            self.events.append(event)
+        logger.debug("trace: %s", event)
+
+    def _node_event(self, name, state, before, result, started, duration, error):
+        event = {
+            "type": "node",
+            "name": name,
+            "start": started,
+            "duration_ms": duration * 1000,
+            "error": error,
+        }
+        if isinstance(result, dict):
+            delta = [key for key, value in result.items()
+                     if key not in before or before[key] != _fingerprint(value)]
+            event["delta_keys"] = delta
+            event["delta_size"] = len(delta)
+        messages_after = _messages_count(result) if isinstance(result, dict) else None
+        event["messages"] = messages_after if messages_after is not None else _messages_count(state)
+        return event
+
+    def wrap_node(self, name: str, func: Callable) -> Callable:
+        """
+        Wraps a node function; records wall time, changed state keys and the size of the messages list
+        """
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(state, *args, **kwargs):
+                before = {key: _fingerprint(value) for key, value in state.items()}
+                started, error, result = time.time(), None, None
+                start = time.perf_counter()
+                try:
+                    result = await func(state, *args, **kwargs)
+                    return result
+                except Exception as e:
+                    error = repr(e)
+                    raise
+                finally:
+                    self._record(self._node_event(
+                        name, state, before, result, started, time.perf_counter() - start, error))
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(state, *args, **kwargs):
+            before = {key: _fingerprint(value) for key, value in state.items()}
+            started, error, result = time.time(), None, None
+            start = time.perf_counter()
+            try:
+                result = func(state, *args, **kwargs)
+                return result
+            except Exception as e:
+                error = repr(e)
+                raise
+            finally:
+                self._record(self._node_event(
+                    name, state, before, result, started, time.perf_counter() - start, error))
+        return wrapper
+
+    def wrap_router(self, name: str, func: Callable) -> Callable:
+        """
+        Wraps a routing function of a conditional edge; records wall time and the chosen route
+        """
+        @functools.wraps(func)
+        def wrapper(state, *args, **kwargs):
+            started, route, error = time.time(), None, None
+            start = time.perf_counter()
+            try:
+                route = func(state, *args, **kwargs)
+                return route
+            except Exception as e:
+                error = repr(e)
+                raise
+            finally:
+                self._record({
+                    "type": "route",
+                    "name": name,
+                    "start": started,
+                    "duration_ms": (time.perf_counter() - start) * 1000,
+                    "route": route,
+                    "messages": _messages_count(state),
+                    "error": error,
+                })
+        return wrapper
+
+    def reset(self):
+        with self._lock:
+            self.events = []
+
+    def export_jsonl(self, path: str):
+        """
+        Writes all events as JSON lines
+        """
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, default=str) + "\n")
+
+    def histogram(self) -> Dict[str, dict]:
+        """
+        Aggregates the wall times per node (routers are reported as "<name>:route")
+        """
+        with self._lock:
+            events = list(self.events)
+        durations: Dict[str, List[float]] = {}
+        for event in events:
+            key = event["name"] if event["type"] == "node" else f"{event['name']}:route"
+            durations.setdefault(key, []).append(event["duration_ms"])
+
+        result = {}
+        for key, values in durations.items():
+            values.sort()
+            counts = [0] * (len(self.buckets_ms) + 1)
+            for value in values:
+                counts[bisect.bisect_left(self.buckets_ms, value)] += 1
+            result[key] = {
+                "count": len(values),
+                "total_ms": sum(values),
+                "mean_ms": sum(values) / len(values),
+                "p50_ms": values[int(0.50 * (len(values) - 1))],
+                "p95_ms": values[int(0.95 * (len(values) - 1))],
+                "max_ms": values[-1],
+                "buckets": dict(zip([f"<={b}ms" for b in self.buckets_ms] + [f">{self.buckets_ms[-1]}ms"], counts)),
+            }
+        return result
+
+    def summary(self) -> str:
+        """
+        Returns the histogram as a table, sorted by total time
+        """
+        histogram = self.histogram()
+        grand_total = sum(row["total_ms"] for row in histogram.values()) or 1.0
+        lines = [f"{'node':<24} {'calls':>6} {'total ms':>10} {'share':>6} {'mean ms':>9} {'p95 ms':>9} {'max ms':>9}"]
+        for key, row in sorted(histogram.items(), key=lambda item: item[1]["total_ms"], reverse=True):
+            lines.append(f"{key:<24} {row['count']:>6} {row['total_ms']:>10.3f} {row['total_ms'] / grand_total:>6.1%} "
+                         f"{row['mean_ms']:>9.3f} {row['p95_ms']:>9.3f} {row['max_ms']:>9.3f}")
+        return "\n".join(lines)
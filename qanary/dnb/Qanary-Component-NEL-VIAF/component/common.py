@@ -2,23 +2,22 @@ import os
 import json
 import logging
 
-from openai import OpenAI
 from qanary_helpers.qanary_queries import query_triplestore
 
+from component.llm_gateway import get_gateway
+from component.resilience import upstream
+
 
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
 
-OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
-OPENAI_API_BASE = os.environ.get('OPENAI_API_BASE')
-MODEL_NAME = os.environ.get("MODEL_NAME")
 NEL_SPARQL_ENDPOINT = os.environ['SPARQL_ENDPOINT']
 
-client = OpenAI(
-    api_key=OPENAI_API_KEY,
-    base_url=OPENAI_API_BASE,
-)
+dbpedia = upstream("dbpedia-sparql")
+# no hedging: a duplicate LLM call costs tokens, the gateway retries rate limited calls itself
+llm = upstream("llm", hedge_ratio=0)
+
 
-def llm_ner(text):
+async def llm_ner(text):
     """
     Perform Named Entity Recognition (NER) on the given text using a language model.
     Args:
@@ -26,18 +25,20 @@ def llm_ner(text):
     Returns:
         list: A list of recognized named entities. If the response cannot be parsed as JSON, an empty list is returned.
     Example:
-        >>> llm_ner("Show me works created by Friedrich Schiller")
+        >>> await llm_ner("Show me works created by Friedrich Schiller")
         ["Friedrich Schiller"]
     Note:
         This function uses a language model to perform NER and expects the model to return the recognized entities
         in a structured JSON format. If the response is not valid JSON, an error is logged and an empty list is returned.
+        The call goes through the shared LLM gateway (concurrency limit, token budget, retries; see llm_gateway.py).
     """
 
     example_string = "Show me works created by Friedrich Schiller"
     assistant_docstring = """["Friedrich Schiller"]"""
 
-    chat_response = client.chat.completions.create(
-        model=MODEL_NAME,
+    result = await llm.acall(
+        get_gateway().complete,
+        key=text,
         messages=[
             {"role": "system", "content": """You are a Named Entity Recognition Tool.
 Recognize named entities and output the structured data as a LIST. **Output ONLY the structured data.**
@@ -48,8 +49,6 @@ Below is a text for you to analyze."""},
         ]
     )
 
-    result = chat_response.choices[0].message.content
-    
     logging.info("LLM NER Result: %s", result)
 
     try:
@@ -81,7 +80,7 @@ def dbpedia_search(label, lang="de"):
         }}
     """
 
-    entity_result = query_triplestore(NEL_SPARQL_ENDPOINT, query)
+    entity_result = dbpedia.call(query_triplestore, NEL_SPARQL_ENDPOINT, query, key=query)
     entities = []
 
     for bind in entity_result["results"]["bindings"]:
@@ -0,0 +1,111 @@
+"""
+Idempotent annotation: a repeated request (Qanary retries a component, the question is run again in the same
+graph) is answered from a local record instead of repeating the lookups, and annotations are never inserted twice.
+
+* the key of a request is sha256(inGraph, component, sha256(input text))
+* the SQLite record (IDEMPOTENCY_DB, empty: no record) stores the found entities per key for IDEMPOTENCY_TTL seconds
+* annotation IRIs are derived from the key and the entity, and inserted with FILTER NOT EXISTS, so concurrent
+  duplicates of a request add no triples either
+
+    key = request_key(graph, SERVICE_NAME_COMPONENT, question_text)
+    entities = record.get(key)        # None: not seen before
+    ...
+    insert_into_triplestore(endpoint, insert_entity_annotation(graph, annotation_iri(key, entity), ...))
+    record.put(key, graph, SERVICE_NAME_COMPONENT, entities)
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+IDEMPOTENCY_DB = os.environ.get("IDEMPOTENCY_DB", "idempotency.db")
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", str(7 * 24 * 3600)))
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def request_key(graph: str, component: str, text: str) -> str:
+    return sha256("\n".join((graph, component, sha256(text))))
+
+
+def annotation_iri(key: str, entity: str) -> str:
+    return "urn:qanary:annotation:entity:" + sha256(f"{key}\n{entity}")[:32]
+
+
+def insert_entity_annotation(graph: str, annotation: str, entity: str, question_uri: str, component: str,
+                             score: float = 1.0) -> str:
+    """
+    INSERT of a qa:AnnotationOfEntity, which does nothing if the annotation is already in the graph
+    """
+    return f"""
+        PREFIX qa: <http://www.wdaqua.eu/qa#>
+        PREFIX oa: <http://www.w3.org/ns/openannotation/core/>
+        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
+        PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
+        INSERT {{
+        GRAPH <{graph}> {{
+            <{annotation}> rdf:type qa:AnnotationOfEntity ;
+                oa:hasBody <{entity}> ;
+                qa:score \"{score}\"^^xsd:float ;
+                oa:annotatedAt ?time ;
+                oa:annotatedBy <urn:qanary:{component.replace(" ", "-")}> ;
+                oa:hasTarget [
+                    a    oa:SpecificResource ;
+                    oa:hasSource <{question_uri}> ;
+                ] .
+            }}
+        }}
+        WHERE {{
+            BIND (now() as ?time)
+            FILTER NOT EXISTS {{ GRAPH <{graph}> {{ <{annotation}> rdf:type qa:AnnotationOfEntity }} }}
+        }}
+    """
+
+
+class IdempotencyRecord:
+    """
+    Entities found per request key, in SQLite (shared by all workers of the component)
+    """
+
+    def __init__(self, path: str = IDEMPOTENCY_DB, ttl: float = IDEMPOTENCY_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0}
+        if path:
+            with self._transaction() as connection:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("CREATE TABLE IF NOT EXISTS requests (key TEXT PRIMARY KEY, graph TEXT, "
+                                   "component TEXT, entities TEXT, created_at REAL)")
+
+    @contextmanager
+    def _transaction(self):
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get(self, key: str):
+        """
+        Entities of an earlier request with this key, None if there is none (or it expired)
+        """
+        if not self.path:
+            return None
+        with self._transaction() as connection:
+            row = connection.execute("SELECT entities FROM requests WHERE key = ? AND created_at > ?",
+                                     (key, time.time() - self.ttl)).fetchone()
+        self.stats["hits" if row else "misses"] += 1
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, graph: str, component: str, entities):
+        if not self.path:
+            return
+        with self._transaction() as connection:
+            connection.execute("INSERT OR REPLACE INTO requests VALUES (?, ?, ?, ?, ?)",
+                               (key, graph, component, json.dumps(entities), time.time()))
+            connection.execute("DELETE FROM requests WHERE created_at <= ?", (time.time() - self.ttl,))
@@ -2,12 +2,15 @@ import os
 import json
 import logging
 
-from openai import OpenAI
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse, PlainTextResponse
 
 from qanary_helpers.qanary_queries import insert_into_triplestore, get_text_question_in_graph
+from component import jobs
 from component.common import llm_ner, dbpedia_search
+from component.idempotency import IdempotencyRecord, request_key, annotation_iri, insert_entity_annotation
+from component.llm_gateway import get_gateway
+from component.resilience import metrics
 
 
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
@@ -23,6 +26,7 @@ LANG = os.environ['LANG']
 
 
 headers = {'Content-Type': 'application/json'}
+record = IdempotencyRecord()
 
 router = APIRouter(
     tags=[SERVICE_NAME_COMPONENT],
@@ -31,56 +35,59 @@ router = APIRouter(
 
 @router.post("/annotatequestion")
 async def qanary_service(request: Request):
-    request_json = await request.json()
+    return await jobs.run_or_submit(request, annotate)
+
+
+async def annotate(request_json):
+    """
+    Annotates the question of the Qanary request, returns the response JSON
+    """
     triplestore_endpoint_url = request_json["values"]["urn:qanary#endpoint"]
     triplestore_ingraph_uuid = request_json["values"]["urn:qanary#inGraph"]
     # get question text from triplestore
     question_text = get_text_question_in_graph(triplestore_endpoint_url, triplestore_ingraph_uuid)[0]['text']
     question_uri = get_text_question_in_graph(triplestore_endpoint=triplestore_endpoint_url, graph=triplestore_ingraph_uuid)[0]['uri']
 
+    key = request_key(triplestore_ingraph_uuid, SERVICE_NAME_COMPONENT, question_text)
+    viaf_ids = record.get(key)
+    if viaf_ids is not None:
+        # repeated request: the annotations are already in the graph
+        logging.info("Repeated request %s, annotations exist: %s", key, viaf_ids)
+        return request_json
+
     logging.info("Identifying named entities for question: %s", question_text)
-    entities = llm_ner(question_text)
+    entities = await llm_ner(question_text)
 
     viaf_ids = []
     for entity in entities:
         logging.info("Querying endpoint for: %s", entity)
         viaf_ids.extend(dbpedia_search(entity, LANG))
+    viaf_ids = list(dict.fromkeys(viaf_ids))
 
     logging.info("Endpoint response: %s", viaf_ids)
 
     for viaf_id in viaf_ids:
-        sparql_query = f"""
-                        PREFIX dbr: <http://dbpedia.org/resource/>
-                        PREFIX dbo: <http://dbpedia.org/ontology/>
-                        PREFIX qa: <http://www.wdaqua.eu/qa#>
-                        PREFIX oa: <http://www.w3.org/ns/openannotation/core/>
-                        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-                        PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
-                        INSERT {{
-                        GRAPH <{triplestore_ingraph_uuid}> {{
-                            ?newAnnotation rdf:type qa:AnnotationOfEntity ;
-                                oa:hasBody <{viaf_id}> ;
-                                qa:score \"1.0\"^^xsd:float ;
-                                oa:annotatedAt ?time ;
-                                oa:annotatedBy <urn:qanary:{SERVICE_NAME_COMPONENT.replace(" ", "-")}> ;
-                                oa:hasTarget [ 
-                                    a    oa:SpecificResource ;
-                                    oa:hasSource <{question_uri}> ;
-                                ] .
-                            }}
-                        }}
-                        WHERE {{
-                            BIND (IRI(str(RAND())) AS ?newAnnotation) .
-                            BIND (now() as ?time) 
-                        }}
-                    """
-
+        sparql_query = insert_entity_annotation(triplestore_ingraph_uuid, annotation_iri(key, viaf_id), viaf_id,
+                                                question_uri, SERVICE_NAME_COMPONENT)
         insert_into_triplestore(triplestore_endpoint_url,
                                 sparql_query)  # inserting new data to the triplestore
 
-    return JSONResponse(content=request_json)
+    record.put(key, triplestore_ingraph_uuid, SERVICE_NAME_COMPONENT, viaf_ids)
+
+    return request_json
 
 
 @router.get("/health")
 def health():
     return PlainTextResponse(content="alive")
+
+
+@router.get("/llm-stats")
+def llm_stats():
+    # tokens and latency of the LLM calls of this process
+    return JSONResponse(content=get_gateway().stats())
+
+
+@router.get("/metrics/resilience")
+def resilience_metrics():
+    return JSONResponse(content=metrics())
@@ -2,9 +2,11 @@ import os
 import logging
 
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import PlainTextResponse
 
 from qanary_helpers.qanary_queries import insert_into_triplestore, get_text_question_in_graph, query_triplestore
+from component import jobs
+from component.query_guard import guard_query, QueryRejected, QUERY_TIMEOUT, TIMEOUT_PREDICATE
 
 
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
@@ -24,7 +26,13 @@ router = APIRouter(
 
 @router.post("/annotatequestion")
 async def qanary_service(request: Request):
-    request_json = await request.json()
+    return await jobs.run_or_submit(request, annotate)
+
+
+async def annotate(request_json):
+    """
+    Annotates the question of the Qanary request, returns the response JSON
+    """
     triplestore_endpoint_url = request_json["values"]["urn:qanary#endpoint"]
     triplestore_ingraph_uuid = request_json["values"]["urn:qanary#inGraph"]
 
@@ -65,6 +73,12 @@ async def qanary_service(request: Request):
         ?creator owl:sameAs ?viaId .
     }}
     """
+    try:
+        answer_sparql, query_cost = guard_query(answer_sparql)
+    except QueryRejected as e:
+        logging.warning("Generated query rejected: %s", e)
+        return request_json
+    logging.info("Query cost estimate: %s", query_cost)
     answer_sparql = answer_sparql.replace("\n", " ")
 
     sparql_annotation_of_answer_sparql = f"""
@@ -80,6 +94,7 @@ async def qanary_service(request: Request):
                 ?newAnnotation oa:hasTarget <{question_uri}> .
                 ?newAnnotation oa:hasBody "{answer_sparql}" .
                 ?newAnnotation qa:score "1.0"^^xsd:float .
+                ?newAnnotation <{TIMEOUT_PREDICATE}> "{QUERY_TIMEOUT}"^^xsd:decimal .
                 ?newAnnotation oa:annotatedAt ?time .
                 ?newAnnotation oa:annotatedBy <urn:qanary:{SERVICE_NAME_COMPONENT}> .
             }}
@@ -94,7 +109,7 @@ async def qanary_service(request: Request):
 
     insert_into_triplestore(triplestore_endpoint_url, sparql_annotation_of_answer_sparql)
 
-    return JSONResponse(content=request_json)
+    return request_json
 
 
 @router.get("/health")
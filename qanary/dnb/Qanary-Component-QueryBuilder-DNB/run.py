@@ -7,7 +7,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from qanary_helpers.registrator import Registrator
 from qanary_helpers.registration import Registration
 
-from component import qb, version
+from component import qb, jobs, version
 
 
 SERVICE_NAME_COMPONENT = os.environ['SERVICE_NAME_COMPONENT']
@@ -38,6 +38,7 @@ app = FastAPI(
 )
 
 app.include_router(qb.router)
+app.include_router(jobs.router)
 
 app.add_middleware(
     CORSMiddleware,
@@ -0,0 +1,149 @@
+"""
+Asynchronous job mode for /annotatequestion.
+
+With `Prefer: respond-async` (or JOB_MODE=always) the request is answered right away with
+202 Accepted, the job id and `Location: /jobs/<id>`; a bounded pool of JOB_WORKERS worker threads
+processes the queued jobs, lowest priority value first (`X-Priority` header, default 0). When more
+than JOB_QUEUE_DEPTH jobs wait, new jobs are refused with 503 and Retry-After. The job record is polled
+with GET /jobs/<id> and, if the request has an `X-Callback-Url` header, POSTed to that URL when the job
+is finished. GET /jobs reports the queue depth.
+
+    @router.post("/annotatequestion")
+    async def qanary_service(request: Request):
+        return await jobs.run_or_submit(request, annotate)   # annotate(request_json) -> response JSON
+"""
+import asyncio
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import requests
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse
+
+JOB_MODE = os.environ.get("JOB_MODE", "optional")  # optional: on `Prefer: respond-async`, always or off
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+JOB_QUEUE_DEPTH = int(os.environ.get("JOB_QUEUE_DEPTH", "100"))
+JOB_HISTORY = int(os.environ.get("JOB_HISTORY", "1000"))  # finished jobs kept for polling
+JOB_CALLBACK_TIMEOUT = float(os.environ.get("JOB_CALLBACK_TIMEOUT", "10"))
+
+router = APIRouter(tags=["jobs"])
+
+
+class JobQueue:
+    """
+    Priority queue of annotation jobs with a fixed number of worker threads
+    """
+
+    def __init__(self, workers: int = JOB_WORKERS, max_depth: int = JOB_QUEUE_DEPTH, history: int = JOB_HISTORY):
+        self.workers = workers
+        self.max_depth = max_depth
+        self.history = history
+        self.jobs = OrderedDict()
+        self.running = 0
+        self.stats = {"submitted": 0, "rejected": 0, "done": 0, "failed": 0}
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()  # first in, first out within a priority
+        self._lock = threading.Lock()
+        self._threads = []
+
+    def _start(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._work, name=f"job-worker-{len(self._threads)}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def submit(self, function, request_json, priority: int = 0, callback: str = None):
+        """
+        Queues `function(request_json)`, returns the job record or None if the queue is full
+        """
+        with self._lock:
+            if self._queue.qsize() >= self.max_depth:
+                self.stats["rejected"] += 1
+                return None
+            self._start()
+            job = {"id": uuid.uuid4().hex, "status": "queued", "priority": priority, "callback": callback,
+                   "submitted_at": time.time(), "started_at": None, "finished_at": None, "result": None,
+                   "error": None}
+            self.jobs[job["id"]] = job
+            self.stats["submitted"] += 1
+            self._queue.put((priority, next(self._order), job, function, request_json))
+            return job
+
+    def _work(self):
+        loop = asyncio.new_event_loop()  # the annotation functions are coroutines
+        while True:
+            _, _, job, function, request_json = self._queue.get()
+            with self._lock:
+                self.running += 1
+            job.update(status="running", started_at=time.time())
+            try:
+                job["result"] = loop.run_until_complete(function(request_json))
+                job["status"] = "done"
+            except Exception as e:
+                logging.exception("Job %s failed", job["id"])
+                job.update(status="failed", error=str(e))
+            job["finished_at"] = time.time()
+            with self._lock:
+                self.running -= 1
+                self.stats[job["status"]] += 1
+                self._forget_old()
+            if job["callback"]:
+                try:
+                    requests.post(job["callback"], json=job, timeout=JOB_CALLBACK_TIMEOUT)
+                except requests.RequestException as e:
+                    logging.error("Callback of job %s to %s failed: %s", job["id"], job["callback"], e)
+
+    def _forget_old(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job["finished_at"] is not None]
+        for job_id in finished[:max(0, len(finished) - self.history)]:
+            del self.jobs[job_id]
+
+    def depth(self) -> dict:
+        return {"queued": self._queue.qsize(), "running": self.running, "workers": self.workers,
+                "max_depth": self.max_depth, **self.stats}
+
+
+job_queue = JobQueue()
+
+
+def wants_async(request: Request) -> bool:
+    if JOB_MODE == "off":
+        return False
+    return JOB_MODE == "always" or "respond-async" in request.headers.get("prefer", "")
+
+
+async def run_or_submit(request: Request, function):
+    """
+    Answers with `await function(request_json)` or, in job mode, queues it and answers 202
+    """
+    request_json = await request.json()
+    if not wants_async(request):
+        return JSONResponse(content=await function(request_json))
+    try:
+        priority = int(request.headers.get("x-priority", "0"))
+    except ValueError:
+        return JSONResponse(status_code=400, content={"detail": "X-Priority must be an integer"})
+    job = job_queue.submit(function, request_json, priority, request.headers.get("x-callback-url"))
+    if job is None:
+        return JSONResponse(status_code=503, content={"detail": "Job queue is full"}, headers={"Retry-After": "5"})
+    return JSONResponse(status_code=202, content={"id": job["id"], "status": job["status"]},
+                        headers={"Location": f"/jobs/{job['id']}"})
+
+
+@router.get("/jobs")
+def jobs_depth():
+    return JSONResponse(content=job_queue.depth())
+
+
+@router.get("/jobs/{job_id}")
+def job_status(job_id: str):
+    job = job_queue.jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"detail": "Unknown job"})
+    return JSONResponse(content=job)
@@ -3,9 +3,13 @@ import json
 import logging
 from fastapi import APIRouter, Request
 from SPARQLWrapper import SPARQLWrapper, JSON
+from SPARQLWrapper.SPARQLExceptions import QueryBadFormed
 from fastapi.responses import JSONResponse, PlainTextResponse
 
 from qanary_helpers.qanary_queries import insert_into_triplestore, get_text_question_in_graph, query_triplestore
+from component import jobs
+from component.mirror import mirror_from_env
+from component.resilience import upstream, metrics
 
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
 
@@ -16,6 +20,17 @@ if not os.getenv("PRODUCTION"):
 
 SERVICE_NAME_COMPONENT = os.environ['SERVICE_NAME_COMPONENT']
 ENDPOINT = os.environ['SPARQL_ENDPOINT']
+# how the server-side timeout of the query builders is passed on: qlever, virtuoso, blazegraph or none
+SPARQL_TIMEOUT_STYLE = os.environ.get(
+    'SPARQL_TIMEOUT_STYLE',
+    'qlever' if 'qlever' in ENDPOINT else 'blazegraph' if 'wikidata' in ENDPOINT else
+    'virtuoso' if 'dbpedia' in ENDPOINT else 'none')
+TIMEOUT_PREDICATE = "urn:qanary:queryTimeout"
+# client timeout (seconds) of queries without a timeout annotation
+SPARQL_CLIENT_TIMEOUT = int(os.environ.get('SPARQL_CLIENT_TIMEOUT', '60'))
+# a malformed query is an error of the query builder, not of the endpoint
+sparql_endpoint = upstream("sparql-endpoint", ignore=(QueryBadFormed,))
+mirror = mirror_from_env(ENDPOINT)  # None without MIRROR_* configuration
 
 headers = {'Content-Type': 'application/json'}
 dummy_answers = {
@@ -37,7 +52,29 @@ router = APIRouter(
 )
 
 
-def execute(query: str, endpoint_url: str = ENDPOINT):
+def execute(query: str, endpoint_url: str = ENDPOINT, timeout: float = None):
+    """
+    Answers from the local mirror if it covers the query, else from the endpoint
+    """
+    if mirror is not None and endpoint_url == mirror.endpoint_url:
+        return mirror.execute(query, lambda q: execute_remote(q, endpoint_url, timeout))
+    return execute_remote(query, endpoint_url, timeout)
+
+
+def set_timeout(sparql: SPARQLWrapper, timeout: float):
+    """
+    Server-side timeout in the form the endpoint understands, the client waits one second longer
+    """
+    if SPARQL_TIMEOUT_STYLE == 'qlever':
+        sparql.addParameter('timeout', f"{timeout:g}s")
+    elif SPARQL_TIMEOUT_STYLE == 'virtuoso':
+        sparql.addParameter('timeout', str(int(timeout * 1000)))
+    elif SPARQL_TIMEOUT_STYLE == 'blazegraph':
+        sparql.addCustomHttpHeader('X-BIGDATA-MAX-QUERY-MILLIS', str(int(timeout * 1000)))
+    sparql.setTimeout(int(timeout) + 1)
+
+
+def execute_remote(query: str, endpoint_url: str = ENDPOINT, timeout: float = None):
     """
     https://dbpedia.org/sparql
     https://query.wikidata.org/bigdata/namespace/wdq/sparql
@@ -45,9 +82,12 @@ def execute(query: str, endpoint_url: str = ENDPOINT):
     try:
         sparql = SPARQLWrapper(endpoint_url)
         sparql.setQuery(query)
+        if timeout:
+            set_timeout(sparql, timeout)
+        else:
+            sparql.setTimeout(SPARQL_CLIENT_TIMEOUT)
         sparql.setReturnFormat(JSON)
-        response = sparql.query().convert()
-        return response
+        return sparql_endpoint.call(lambda: sparql.query().convert(), key=(endpoint_url, query))
     except Exception as e:
         e = str(e)
         logging.error(f"Execute error: {e}")
@@ -58,7 +98,13 @@ def execute(query: str, endpoint_url: str = ENDPOINT):
 
 @router.post("/annotatequestion")
 async def qanary_service(request: Request):
-    request_json = await request.json()
+    return await jobs.run_or_submit(request, annotate)
+
+
+async def annotate(request_json):
+    """
+    Annotates the question of the Qanary request, returns the response JSON
+    """
     triplestore_endpoint_url = request_json["values"]["urn:qanary#endpoint"]
     triplestore_ingraph_uuid = request_json["values"]["urn:qanary#inGraph"]
     
@@ -69,22 +115,25 @@ async def qanary_service(request: Request):
     PREFIX oa: <http://www.w3.org/ns/openannotation/core/> 
     PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
 
-    SELECT ?sparql 
+    SELECT ?sparql ?timeout 
     FROM <{uuid}> 
     WHERE {{ 
         ?a rdf:type qa:AnnotationOfAnswerSPARQL .
         OPTIONAL {{ ?a oa:hasBody ?sparql }} 
+        OPTIONAL {{ ?a <{timeout_predicate}> ?timeout }} 
     }}
     ORDER BY DESC(?score) LIMIT 1
-    """.format(uuid=triplestore_ingraph_uuid)
+    """.format(uuid=triplestore_ingraph_uuid, timeout_predicate=TIMEOUT_PREDICATE)
 
     logging.info(f"Querying for SPARQL queries: {sparql}")
     try:
-        generated_sparql = query_triplestore(triplestore_endpoint_url, sparql)["results"]["bindings"][0]["sparql"]["value"]
+        binding = query_triplestore(triplestore_endpoint_url, sparql)["results"]["bindings"][0]
+        generated_sparql = binding["sparql"]["value"]
+        timeout = float(binding["timeout"]["value"]) if "timeout" in binding else None
 
         logging.info(f"SPARQL query generated: {generated_sparql}")
 
-        json_string = json.dumps(execute(query=generated_sparql, endpoint_url=ENDPOINT), ensure_ascii=False).replace('\\"',"").replace('"', '\\"')
+        json_string = json.dumps(execute(query=generated_sparql, endpoint_url=ENDPOINT, timeout=timeout), ensure_ascii=False).replace('\\"',"").replace('"', '\\"')
     except Exception as e:
         logging.info(f"No SPARQL was generated")
         json_string = json.loads(dummy_answers)
@@ -124,8 +173,19 @@ async def qanary_service(request: Request):
     insert_into_triplestore(triplestore_endpoint_url,
                             SPARQLquery)  # inserting new data to the triplestore
 
-    return JSONResponse(content=request_json)
+    return request_json
 
 @router.get("/health")
 def health():
-    return PlainTextResponse(content="alive") 
\ No newline at end of file
+    return PlainTextResponse(content="alive")
+
+
+@router.get("/mirror/stats")
+def mirror_stats():
+    # hit rate and latency of the local mirror
+    return JSONResponse(content=mirror.report() if mirror is not None else {"enabled": False})
+
+
+@router.get("/metrics/resilience")
+def resilience_metrics():
+    return JSONResponse(content=metrics())
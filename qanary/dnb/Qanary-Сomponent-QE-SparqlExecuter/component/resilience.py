@@ -0,0 +1,297 @@
+"""
+Resilience layer for calls to upstream endpoints (Wikidata search, SPARQL endpoints, the LLM).
+
+Every endpoint gets an `Upstream` (`upstream(name)`, shared by all callers of the process) with
+
+* hedged requests: if a call has not answered after the observed p95 latency of the endpoint, a duplicate
+  is sent and the first answer wins (at most RESILIENCE_HEDGE_RATIO of the calls are hedged, blocking calls
+  only while one of the RESILIENCE_THREADS threads is idle). The latency statistics record the first request.
+* a circuit breaker: after RESILIENCE_FAILURE_THRESHOLD consecutive failures the endpoint is open and calls
+  fail fast for RESILIENCE_RESET_TIMEOUT seconds, then one trial call decides whether it closes again
+* a cache of the last successful results (RESILIENCE_CACHE_SIZE per endpoint), which answers calls while
+  the endpoint is open or failing
+
+    search = upstream("wikidata-search")
+    data = search.call(requests_get_json, url, key=url)          # blocking code
+    text = await upstream("llm").acall(complete, messages, key=question)
+
+`metrics()` returns breaker state, hedge and cache statistics and latency of all endpoints.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+HEDGE_RATIO = float(os.environ.get("RESILIENCE_HEDGE_RATIO", "0.1"))
+MIN_SAMPLES = int(os.environ.get("RESILIENCE_MIN_SAMPLES", "20"))
+MIN_HEDGE_DELAY = float(os.environ.get("RESILIENCE_MIN_HEDGE_DELAY", "0.05"))
+FAILURE_THRESHOLD = int(os.environ.get("RESILIENCE_FAILURE_THRESHOLD", "5"))
+RESET_TIMEOUT = float(os.environ.get("RESILIENCE_RESET_TIMEOUT", "30"))
+CACHE_SIZE = int(os.environ.get("RESILIENCE_CACHE_SIZE", "1000"))
+
+# threads of the blocking calls that are hedged
+THREADS = int(os.environ.get("RESILIENCE_THREADS", "16"))
+_executor = ThreadPoolExecutor(THREADS, thread_name_prefix="upstream")
+_busy_threads = 0
+_busy_lock = threading.Lock()
+_upstreams = {}
+_registry_lock = threading.Lock()
+
+
+def _submit(function, args, kwargs):
+    """
+    Runs the blocking `function` in the executor, counting the busy threads
+    """
+    global _busy_threads
+
+    def run():
+        global _busy_threads
+        try:
+            return function(*args, **kwargs)
+        finally:
+            with _busy_lock:
+                _busy_threads -= 1
+
+    with _busy_lock:
+        _busy_threads += 1
+    return _executor.submit(run)
+
+
+def _has_idle_thread() -> bool:
+    # losing requests keep their thread until they finish, without an idle one a duplicate would only queue
+    with _busy_lock:
+        return _busy_threads < THREADS
+
+
+class CircuitOpenError(RuntimeError):
+    pass
+
+
+class Upstream:
+    """
+    Hedging, circuit breaker and result cache of one endpoint
+    """
+
+    def __init__(self, name: str, hedge_ratio: float = HEDGE_RATIO, failure_threshold: int = FAILURE_THRESHOLD,
+                 reset_timeout: float = RESET_TIMEOUT, cache_size: int = CACHE_SIZE, ignore=()):
+        self.name = name
+        self.hedge_ratio = hedge_ratio
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.cache_size = cache_size
+        self.ignore = tuple(ignore)  # exceptions of the caller (bad queries), not failures of the endpoint
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.latencies = deque(maxlen=200)
+        self.cache = OrderedDict()
+        self.stats = {"calls": 0, "failures": 0, "short_circuits": 0, "cache_hits": 0, "opened": 0, "hedges": 0,
+                      "hedge_wins": 0, "hedges_skipped": 0}
+        self._lock = threading.Lock()
+
+    def hedge_delay(self):
+        """
+        p95 latency of the recent calls, None if hedging is off or not enough calls were seen
+        """
+        with self._lock:
+            if not self.hedge_ratio or len(self.latencies) < MIN_SAMPLES or \
+                    self.stats["hedges"] >= self.hedge_ratio * self.stats["calls"]:
+                return None
+            latencies = sorted(self.latencies)
+        return max(MIN_HEDGE_DELAY, latencies[int(0.95 * (len(latencies) - 1))])
+
+    def _allow(self) -> bool:
+        with self._lock:
+            self.stats["calls"] += 1
+            if self.state == "open" and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = "half-open"
+            if self.state == "half-open":
+                if self.trial_running:
+                    return False
+                self.trial_running = True
+                return True
+            return self.state == "closed"
+
+    def _latency_recorder(self, start: float):
+        """
+        Done callback of the first request of a hedged call: its latency is recorded even if the duplicate
+        answered first, otherwise the p95 drifts down to the winners. A cancelled request counts with the
+        time it ran.
+        """
+        def record(future):
+            if future.cancelled() or future.exception() is None:
+                with self._lock:
+                    self.latencies.append(time.perf_counter() - start)
+        return record
+
+    def _success(self, seconds, key, result):
+        with self._lock:
+            if seconds is not None:  # None: recorded by the first request of a hedge
+                self.latencies.append(seconds)
+            self.consecutive_failures = 0
+            self.trial_running = False
+            if self.state != "closed":
+                logging.info("Circuit of %s closed", self.name)
+            self.state = "closed"
+            if key is not None and self.cache_size:
+                self.cache[key] = result
+                self.cache.move_to_end(key)
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+
+    def _failure(self, error):
+        with self._lock:
+            self.stats["failures"] += 1
+            self.consecutive_failures += 1
+            self.trial_running = False
+            if self.state == "half-open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.stats["opened"] += 1
+                    logging.warning("Circuit of %s open after %d failures: %s", self.name, self.consecutive_failures,
+                                    error)
+                self.state = "open"
+                self.opened_at = time.monotonic()
+
+    def _fallback(self, key, error):
+        with self._lock:
+            if key is not None and key in self.cache:
+                self.stats["cache_hits"] += 1
+                return self.cache[key]
+        raise error
+
+    def _fast_failure(self, key):
+        with self._lock:
+            self.stats["short_circuits"] += 1
+        return self._fallback(key, CircuitOpenError(f"Circuit of {self.name} is open"))
+
+    def call(self, function, *args, key=None, **kwargs):
+        """
+        Calls the blocking `function`, `key` identifies the result in the cache (None: not cached)
+        """
+        if not self._allow():
+            return self._fast_failure(key)
+        start = time.perf_counter()
+        try:
+            delay = self.hedge_delay()
+            if delay is not None and not _has_idle_thread():
+                with self._lock:
+                    self.stats["hedges_skipped"] += 1
+                delay = None
+            if delay is None:
+                result = function(*args, **kwargs)
+                seconds = time.perf_counter() - start
+            else:
+                result = self._hedged(delay, function, args, kwargs)
+                seconds = None
+        except self.ignore:
+            with self._lock:
+                self.trial_running = False
+            raise
+        except Exception as e:
+            self._failure(e)
+            return self._fallback(key, e)
+        self._success(seconds, key, result)
+        return result
+
+    def _hedged(self, delay, function, args, kwargs):
+        futures = [_submit(function, args, kwargs)]
+        futures[0].add_done_callback(self._latency_recorder(time.perf_counter()))
+        done, _ = wait(futures, timeout=delay)
+        if not done:
+            if _has_idle_thread():
+                with self._lock:
+                    self.stats["hedges"] += 1
+                futures.append(_submit(function, args, kwargs))
+            else:
+                with self._lock:
+                    self.stats["hedges_skipped"] += 1
+        pending, error = set(futures), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is not futures[0]:
+                        with self._lock:
+                            self.stats["hedge_wins"] += 1
+                    return future.result()  # the other request finishes in the background
+                error = error or future.exception()
+        raise error
+
+    async def acall(self, function, *args, key=None, **kwargs):
+        """
+        Awaits the coroutine function `function` like `call`, the losing request of a hedge is cancelled
+        """
+        if not self._allow():
+            return self._fast_failure(key)
+        start = time.perf_counter()
+        try:
+            delay = self.hedge_delay()
+            if delay is None:
+                result = await function(*args, **kwargs)
+                seconds = time.perf_counter() - start
+            else:
+                result = await self._ahedged(delay, function, args, kwargs)
+                seconds = None
+        except self.ignore:
+            with self._lock:
+                self.trial_running = False
+            raise
+        except Exception as e:
+            self._failure(e)
+            return self._fallback(key, e)
+        self._success(seconds, key, result)
+        return result
+
+    async def _ahedged(self, delay, function, args, kwargs):
+        tasks = [asyncio.ensure_future(function(*args, **kwargs))]
+        tasks[0].add_done_callback(self._latency_recorder(time.perf_counter()))
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            with self._lock:
+                self.stats["hedges"] += 1
+            tasks.append(asyncio.ensure_future(function(*args, **kwargs)))
+        pending, error = set(tasks), None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not tasks[0]:
+                            with self._lock:
+                                self.stats["hedge_wins"] += 1
+                        return task.result()
+                    error = error or task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def metrics(self) -> dict:
+        with self._lock:
+            latencies = sorted(self.latencies)
+            return {
+                **self.stats,
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "cached_results": len(self.cache),
+                "latency_p50_ms": 1000 * latencies[len(latencies) // 2] if latencies else None,
+                "latency_p95_ms": 1000 * latencies[int(0.95 * (len(latencies) - 1))] if latencies else None,
+            }
+
+
+def upstream(name: str, **kwargs) -> Upstream:
+    """
+    The Upstream of an endpoint, created with `kwargs` on first use
+    """
+    with _registry_lock:
+        if name not in _upstreams:
+            _upstreams[name] = Upstream(name, **kwargs)
+        return _upstreams[name]
+
+
+def metrics() -> dict:
+    return {name: endpoint.metrics() for name, endpoint in _upstreams.items()}
@@ -7,7 +7,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from qanary_helpers.registrator import Registrator
 from qanary_helpers.registration import Registration
 
-from component import qe_sparqlexecuter, version
+from component import qe_sparqlexecuter, jobs, version
 
 
 SERVICE_NAME_COMPONENT = os.environ['SERVICE_NAME_COMPONENT']
@@ -34,6 +34,7 @@ app = FastAPI(
 )
 
 app.include_router(qe_sparqlexecuter.router)
+app.include_router(jobs.router)
 
 app.add_middleware(
     CORSMiddleware,
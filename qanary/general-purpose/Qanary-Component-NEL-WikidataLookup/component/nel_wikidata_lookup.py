@@ -10,6 +10,9 @@ from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse, PlainTextResponse
 
 from qanary_helpers.qanary_queries import insert_into_triplestore, get_text_question_in_graph
+from component import jobs
+from component.idempotency import IdempotencyRecord, request_key, annotation_iri, insert_entity_annotation
+from component.resilience import upstream, metrics
 
 
 nltk.download('stopwords')
@@ -31,6 +34,7 @@ else:
     MAX_NGRAM = 4
 
 headers = {'Content-Type': 'application/json'}
+record = IdempotencyRecord()
 
 router = APIRouter(
     tags=[SERVICE_NAME_COMPONENT],
@@ -38,12 +42,20 @@ router = APIRouter(
 )
 
 
+wikidata_search = upstream("wikidata-search")
+
+
+def get_json(url: str):
+    response = requests.get(url, timeout=20)
+    response.raise_for_status()
+    return response.json()
+
+
 def search_entity(query: str, lang: str = "en", search_limit: int = 3):
     wdt_search_url = "https://www.wikidata.org/w/api.php?action=wbsearchentities&search={search}&format=json&language={lang}&uselang={lang}&type=item&limit={search_limit}"
     try:
-        response = requests.get(wdt_search_url.format(
-            search=query, lang=lang, search_limit=search_limit), timeout=20)
-        data = response.json()
+        url = wdt_search_url.format(search=query, lang=lang, search_limit=search_limit)
+        data = wikidata_search.call(get_json, url, key=url)
         ne_list = []
         for entity in data["search"]:
             wdt_id = entity["id"]
@@ -75,7 +87,13 @@ def generate_ngrams(text, min_n, max_n):
 
 @router.post("/annotatequestion")
 async def qanary_service(request: Request):
-    request_json = await request.json()
+    return await jobs.run_or_submit(request, annotate)
+
+
+async def annotate(request_json):
+    """
+    Annotates the question of the Qanary request, returns the response JSON
+    """
     triplestore_endpoint_url = request_json["values"]["urn:qanary#endpoint"]
     triplestore_ingraph_uuid = request_json["values"]["urn:qanary#inGraph"]
 
@@ -85,6 +103,13 @@ async def qanary_service(request: Request):
     question_uri = get_text_question_in_graph(
         triplestore_endpoint=triplestore_endpoint_url, graph=triplestore_ingraph_uuid)[0]['uri']
 
+    key = request_key(triplestore_ingraph_uuid, SERVICE_NAME_COMPONENT, question_text)
+    entities = record.get(key)
+    if entities is not None:
+        # repeated request: the annotations are already in the graph
+        logging.info(f"Repeated request {key}, annotations exist: {entities}")
+        return request_json
+
     logging.info(f"Querying Wikidata Lookup for question: {question_text}")
 
     ngrams = generate_ngrams(question_text, MIN_NGRAM, MAX_NGRAM)
@@ -94,42 +119,27 @@ async def qanary_service(request: Request):
     entities = []
     for ngram in ngrams:
         entities.extend(search_entity(ngram))
+    # several n-grams find the same entity, it is annotated once
+    entities = list(dict.fromkeys(entities))
 
     logging.info(f"Wikidata Lookup response: {entities}")
 
     for entity in entities:
-        SPARQLquery = f"""
-                        PREFIX dbr: <http://dbpedia.org/resource/>
-                        PREFIX dbo: <http://dbpedia.org/ontology/>
-                        PREFIX qa: <http://www.wdaqua.eu/qa#>
-                        PREFIX oa: <http://www.w3.org/ns/openannotation/core/>
-                        PREFIX rdf: <http://www.w3.org/1999/02/22-rdf-syntax-ns#>
-                        PREFIX xsd: <http://www.w3.org/2001/XMLSchema#>
-                        INSERT {{
-                        GRAPH <{triplestore_ingraph_uuid}> {{
-                            ?newAnnotation rdf:type qa:AnnotationOfEntity ;
-                                oa:hasBody <{entity}> ;
-                                qa:score \"1.0\"^^xsd:float ;
-                                oa:annotatedAt ?time ;
-                                oa:annotatedBy <urn:qanary:{SERVICE_NAME_COMPONENT.replace(" ", "-")}> ;
-                                oa:hasTarget [ 
-                                    a    oa:SpecificResource ;
-                                    oa:hasSource <{question_uri}> ;
-                                ] .
-                            }}
-                        }}
-                        WHERE {{
-                            BIND (IRI(str(RAND())) AS ?newAnnotation) .
-                            BIND (now() as ?time) 
-                        }}
-                    """
-
+        SPARQLquery = insert_entity_annotation(triplestore_ingraph_uuid, annotation_iri(key, entity), entity,
+                                               question_uri, SERVICE_NAME_COMPONENT)
         insert_into_triplestore(triplestore_endpoint_url,
                                 SPARQLquery)  # inserting new data to the triplestore
 
-    return JSONResponse(content=request_json)
+    record.put(key, triplestore_ingraph_uuid, SERVICE_NAME_COMPONENT, entities)
+
+    return request_json
 
 
 @router.get("/health")
 def health():
     return PlainTextResponse(content="alive")
+
+
+@router.get("/metrics/resilience")
+def resilience_metrics():
+    return JSONResponse(content=metrics())
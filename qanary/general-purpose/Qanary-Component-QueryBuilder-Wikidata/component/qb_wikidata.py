@@ -2,9 +2,11 @@ import os
 import logging
 
 from fastapi import APIRouter, Request
-from fastapi.responses import JSONResponse, PlainTextResponse
+from fastapi.responses import PlainTextResponse
 
 from qanary_helpers.qanary_queries import insert_into_triplestore, get_text_question_in_graph, query_triplestore
+from component import jobs
+from component.query_guard import guard_query, QueryRejected, QUERY_TIMEOUT, TIMEOUT_PREDICATE
 
 
 logging.basicConfig(format='%(asctime)s - %(message)s', level=logging.INFO)
@@ -24,7 +26,13 @@ router = APIRouter(
 
 @router.post("/annotatequestion")
 async def qanary_service(request: Request):
-    request_json = await request.json()
+    return await jobs.run_or_submit(request, annotate)
+
+
+async def annotate(request_json):
+    """
+    Annotates the question of the Qanary request, returns the response JSON
+    """
     triplestore_endpoint_url = request_json["values"]["urn:qanary#endpoint"]
     triplestore_ingraph_uuid = request_json["values"]["urn:qanary#inGraph"]
     
@@ -75,6 +83,12 @@ async def qanary_service(request: Request):
             }}
         """
 
+        try:
+            answer_sparql, query_cost = guard_query(answer_sparql)
+        except QueryRejected as e:
+            logging.warning(f"Generated query rejected: {e}")
+            continue
+        logging.info(f"Query cost estimate: {query_cost}")
         answer_sparql = answer_sparql.replace("\n", " ")
         # query candidate
         sparql_AnnotationOfAnswerSPARQL = f"""
@@ -90,6 +104,7 @@ async def qanary_service(request: Request):
                     ?newAnnotation oa:hasTarget <{question_uri}> .
                     ?newAnnotation oa:hasBody "{answer_sparql}" .
                     ?newAnnotation qa:score "1.0"^^xsd:float .
+                    ?newAnnotation <{TIMEOUT_PREDICATE}> "{QUERY_TIMEOUT}"^^xsd:decimal .
                     ?newAnnotation oa:annotatedAt ?time .
                     ?newAnnotation oa:annotatedBy <urn:qanary:{SERVICE_NAME_COMPONENT}> .
                 }}
@@ -104,7 +119,7 @@ async def qanary_service(request: Request):
 
         insert_into_triplestore(triplestore_endpoint_url, sparql_AnnotationOfAnswerSPARQL)
 
-    return JSONResponse(content=request_json)
+    return request_json
 
 
 @router.get("/health")
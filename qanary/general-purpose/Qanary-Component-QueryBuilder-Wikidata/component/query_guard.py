@@ -0,0 +1,228 @@
+"""
+Post-processing of the generated SPARQL SELECT queries before they are stored for the query executer:
+
+* a LIMIT is added (or an existing one lowered) to QUERY_LIMIT
+* language filters (FILTER(LANG(?label) = 'en')) are moved into a nested group with the triple patterns that
+  bind the label ({ ?x rdfs:label ?label FILTER(...) }): a FILTER applies to its whole group, so only in the
+  nested group the endpoint filters the labels before joining them with the rest of the query
+* the cost (intermediate result rows) is estimated from the triple patterns; above QUERY_MAX_COST the query
+  is rewritten (ORDER BY dropped, LIMIT lowered to QUERY_REWRITE_LIMIT so the endpoint can stop early) or,
+  with QUERY_COST_ACTION=reject or if it cannot stream (GROUP BY, aggregates), rejected
+* QUERY_TIMEOUT seconds are stored with the query annotation (TIMEOUT_PREDICATE), the executer passes them
+  on to the endpoint as server-side timeout
+
+    query, info = guard_query(query)   # raises QueryRejected
+"""
+import logging
+import os
+import re
+
+TIMEOUT_PREDICATE = "urn:qanary:queryTimeout"
+
+QUERY_LIMIT = int(os.environ.get("QUERY_LIMIT", "1000"))
+QUERY_MAX_COST = float(os.environ.get("QUERY_MAX_COST", "1e6"))
+QUERY_REWRITE_LIMIT = int(os.environ.get("QUERY_REWRITE_LIMIT", "100"))
+QUERY_COST_ACTION = os.environ.get("QUERY_COST_ACTION", "rewrite")
+QUERY_TIMEOUT = float(os.environ.get("QUERY_TIMEOUT", "10"))
+
+TOKEN = re.compile(r"""<[^<>"{}|^`\\\s]*>"""
+                   r"""|"(?:[^"\\]|\\.)*"(?:@[\w-]+|\^\^(?:<[^>]*>|[\w:-]+))?"""
+                   r"""|'(?:[^'\\]|\\.)*'(?:@[\w-]+|\^\^(?:<[^>]*>|[\w:-]+))?"""
+                   r"""|[{}().;,]|[^\s{}().;,]+""")
+GROUP_KEYWORDS = {"OPTIONAL", "MINUS", "SERVICE", "GRAPH", "UNION"}
+LANG_FILTER = re.compile(r"^FILTER\s*\(\s*(?:LANG\s*\(\s*([?$]\w+)\s*\)\s*=|langMatches\s*\(\s*LANG\s*\(\s*([?$]\w+)\s*\))",
+                         re.IGNORECASE)
+AGGREGATE = re.compile(r"\b(COUNT|SUM|MIN|MAX|AVG|SAMPLE|GROUP_CONCAT)\s*\(", re.IGNORECASE)
+
+# rows per input row of a triple pattern, by (subject, predicate, object) known: a constant or an already bound variable
+FANOUT = {(1, 1, 1): 1, (1, 1, 0): 5, (1, 0, 1): 2, (1, 0, 0): 300,
+          (0, 1, 1): 50, (0, 0, 1): 1000, (0, 1, 0): 1e6, (0, 0, 0): 1e9}
+LANG_SELECTIVITY = 5  # labels per entity and language filter
+
+
+class QueryRejected(ValueError):
+    pass
+
+
+def render(tokens) -> str:
+    text = " ".join(tokens)
+    return re.sub(r"\(\s+", "(", re.sub(r"\s+\)", ")", text))
+
+
+def is_variable(token: str) -> bool:
+    return token[:1] in "?$"
+
+
+def _balanced(tokens, start, opening, closing) -> int:
+    """
+    Index after the token closing the bracket opened at `start`
+    """
+    depth = 0
+    for i in range(start, len(tokens)):
+        if tokens[i] == opening:
+            depth += 1
+        elif tokens[i] == closing:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+    raise QueryRejected(f"Unbalanced {opening}{closing} in query")
+
+
+def parse_group(tokens):
+    """
+    Splits the tokens of a group into elements: ("triples", tokens, triples), ("filter", tokens),
+    ("values", tokens, variables, rows), ("bind", tokens) and ("group", tokens) for nested groups
+    """
+    elements = []
+    i = 0
+    while i < len(tokens):
+        token, upper = tokens[i], tokens[i].upper()
+        if token == ".":
+            i += 1
+        elif upper in ("FILTER", "BIND"):
+            start = i
+            i += 1
+            if tokens[i] != "(":  # FILTER langMatches(...), FILTER NOT EXISTS {...}
+                while tokens[i] not in ("(", "{"):
+                    i += 1
+            i = _balanced(tokens, i, tokens[i], ")" if tokens[i] == "(" else "}")
+            kind = "filter" if upper == "FILTER" and "{" not in tokens[start:i] else "group" if upper == "FILTER" \
+                else "bind"
+            elements.append((kind, tokens[start:i]))
+        elif upper == "VALUES":
+            start = i
+            brace = tokens.index("{", i)
+            variables = [t for t in tokens[i + 1:brace] if is_variable(t)]
+            i = _balanced(tokens, brace, "{", "}")
+            body = tokens[brace + 1:i - 1]
+            rows = body.count("(") if len(variables) > 1 else len(body)
+            elements.append(("values", tokens[start:i], variables, max(rows, 1)))
+        elif upper in GROUP_KEYWORDS or token == "{":
+            start = i
+            brace = tokens.index("{", i)
+            i = _balanced(tokens, brace, "{", "}")
+            elements.append(("group", tokens[start:i]))
+        else:
+            start = i
+            subject, triples, predicate = token, [], None
+            i += 1
+            expect = "predicate"
+            while i < len(tokens) and tokens[i] != ".":
+                if tokens[i].upper() in ("FILTER", "BIND", "VALUES", "{") or tokens[i].upper() in GROUP_KEYWORDS:
+                    break
+                if tokens[i] == ";":
+                    expect = "predicate"
+                elif tokens[i] == ",":
+                    expect = "object"
+                elif expect == "predicate":
+                    predicate, expect = tokens[i], "object"
+                else:
+                    triples.append((subject, predicate, tokens[i]))
+                i += 1
+            elements.append(("triples", tokens[start:i], triples))
+    return elements
+
+
+def estimate_cost(elements) -> dict:
+    """
+    Estimated intermediate rows of a greedy join of the triple patterns (cheapest pattern first)
+    """
+    lang_variables = set()
+    for element in elements:
+        if element[0] == "filter":
+            match = LANG_FILTER.match(render(element[1]))
+            if match:
+                lang_variables.add(match.group(1) or match.group(2))
+    bound, rows = set(), 1.0
+    for element in elements:
+        if element[0] == "values":
+            bound.update(element[2])
+            rows *= element[3]
+    patterns = [triple for element in elements if element[0] == "triples" for triple in element[2]]
+
+    def fanout(triple):
+        known = tuple(int(not is_variable(term) or term in bound) for term in triple)
+        value = FANOUT[known]
+        if is_variable(triple[2]) and triple[2] not in bound and triple[2] in lang_variables:
+            value = max(1, value / LANG_SELECTIVITY)
+        return value
+
+    cost = 0.0
+    while patterns:
+        cheapest = min(patterns, key=fanout)
+        patterns.remove(cheapest)
+        rows *= fanout(cheapest)
+        cost += rows
+        bound.update(term for term in cheapest if is_variable(term))
+    return {"cost": cost, "rows": rows, "groups": sum(element[0] == "group" for element in elements)}
+
+
+def place_language_filters(elements):
+    """
+    Moves each language filter into a nested group with the triple patterns that bind its variable as object
+    """
+    binding = {}
+    for index, element in enumerate(elements):
+        if element[0] == "triples":
+            for _, _, obj in element[2]:
+                if is_variable(obj):
+                    binding.setdefault(obj, index)
+    attached = {}
+    moved = set()
+    for index, element in enumerate(elements):
+        if element[0] == "filter":
+            match = LANG_FILTER.match(render(element[1]))
+            variable = match and (match.group(1) or match.group(2))
+            if variable in binding:
+                attached.setdefault(binding[variable], []).append(element)
+                moved.add(index)
+    result = []
+    for index, element in enumerate(elements):
+        if index in attached:
+            filters = [token for attached_filter in attached[index] for token in attached_filter[1]]
+            result.append(("group", ["{"] + element[1] + ["."] + filters + ["}"]))
+        elif index not in moved:
+            result.append(element)
+    return result
+
+
+def guard_query(query: str, limit: int = QUERY_LIMIT, max_cost: float = QUERY_MAX_COST,
+                rewrite_limit: int = QUERY_REWRITE_LIMIT, action: str = QUERY_COST_ACTION):
+    """
+    Returns the rewritten query and the cost estimate, raises QueryRejected if the query is too expensive
+    """
+    tokens = TOKEN.findall(query)
+    uppers = [token.upper() for token in tokens]
+    if "SELECT" not in uppers:
+        return query, {"cost": None}
+    select = uppers.index("SELECT")
+    where = tokens.index("{", select)
+    end = _balanced(tokens, where, "{", "}")
+    head, body, tail = tokens[:where], tokens[where + 1:end - 1], tokens[end:]
+
+    elements = parse_group(body)
+    info = estimate_cost(elements)
+    elements = place_language_filters(elements)
+    tail_upper = [token.upper() for token in tail]
+    current_limit = int(tail[tail_upper.index("LIMIT") + 1]) if "LIMIT" in tail_upper else None
+    if "LIMIT" in tail_upper:
+        position = tail_upper.index("LIMIT")
+        tail = tail[:position] + tail[position + 2:]
+    limit = min(limit, current_limit) if current_limit is not None else limit
+
+    if info["cost"] > max_cost:
+        streaming = "GROUP" not in tail_upper and "HAVING" not in tail_upper and not AGGREGATE.search(render(head))
+        if action != "rewrite" or not streaming:
+            raise QueryRejected(f"Estimated cost {info['cost']:.0f} above {max_cost:.0f}")
+        tail_upper = [token.upper() for token in tail]
+        if "ORDER" in tail_upper:
+            # ORDER BY runs up to OFFSET, the only modifier after it once LIMIT is removed
+            order_end = tail_upper.index("OFFSET") if "OFFSET" in tail_upper else len(tail)
+            tail = tail[:tail_upper.index("ORDER")] + tail[order_end:]
+        limit = min(limit, rewrite_limit)
+        info["rewritten"] = True
+        logging.warning("Query cost %.0f above %.0f, rewritten with LIMIT %d", info["cost"], max_cost, limit)
+
+    info["limit"] = limit
+    group = [token for element in elements for token in element[1] + (["."] if element[0] == "triples" else [])]
+    return render(head + ["{"] + group + ["}"] + tail + ["LIMIT", str(limit)]), info
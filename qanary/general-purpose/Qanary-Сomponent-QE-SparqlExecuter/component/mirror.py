@@ -0,0 +1,240 @@
+"""
+Local read-through mirror of the hot part of the remote knowledge graph.
+
+Triples are kept in an in-memory, indexed rdflib graph, loaded at startup from an N-Triples extract
+(`MIRROR_PATH`, also .nt.gz, or .hdt with the optional rdflib-hdt package) and from the triples learned
+from earlier answers (`MIRROR_LEARNED`). A query is answered locally only if it is covered:
+
+* learned: the same query (whitespace normalized) was answered remotely before and its matching triples
+  were fetched with a CONSTRUCT query built from its WHERE clause (in a background thread, `MIRROR_LEARN=true`)
+* extract: all IRIs the query starts from (subjects and objects of its triple patterns, VALUES) are seeds of
+  the extract (`MIRROR_SEEDS`, one IRI per line): the extract has to contain every triple the query shapes of
+  the pipeline reach from a seed
+
+Only queries built from triple patterns, FILTER, VALUES, BIND, DISTINCT, ORDER BY and LIMIT are mirrored (the
+local evaluation applies the LIMIT, too). OPTIONAL, MINUS, OFFSET, SERVICE, aggregates etc. always go to the remote
+endpoint, like every query that is not covered.
+"""
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from functools import lru_cache
+
+from rdflib import Graph, URIRef
+from rdflib.plugins.sparql import prepareQuery
+from SPARQLWrapper import SPARQLWrapper, TURTLE
+
+# algebra operators whose results only depend on the triples matched by the triple patterns
+SUPPORTED_OPERATORS = {"SelectQuery", "Project", "Distinct", "Reduced", "BGP", "Filter", "Join", "ToMultiSet",
+                       "values", "Extend", "OrderBy"}
+SELECT_CLAUSE = re.compile(r"\bSELECT\b[^{]*?(?:\bWHERE\b)?\s*(?=\{)", re.IGNORECASE | re.DOTALL)
+
+
+def normalize(query: str) -> str:
+    return " ".join(query.split())
+
+
+@lru_cache(maxsize=1024)
+def analyze(query: str):
+    """
+    Parses a (normalized) query, returns (prepared query, triple patterns, start IRIs) or None if the
+    query cannot be mirrored
+    """
+    try:
+        prepared = prepareQuery(query)
+    except Exception as e:
+        logging.debug("Mirror cannot parse query: %s", e)
+        return None
+    if any("EXISTS" in name for name in component_names(prepared.algebra)):
+        return None  # FILTER (NOT) EXISTS depends on triples outside the matched ones
+    patterns, start_iris = [], set()
+    pending = [prepared.algebra]
+    top = prepared.algebra.p
+    while pending:
+        node = pending.pop()
+        if node is top and node.name == "Slice" and not node.start:
+            pass  # the LIMIT of the query guards, an OFFSET needs rows the mirror may not have
+        elif node.name not in SUPPORTED_OPERATORS:
+            return None
+        if node.name == "BGP":
+            patterns.extend(node.triples)
+            start_iris.update(term for s, _, o in node.triples for term in (s, o) if isinstance(term, URIRef))
+        elif node.name == "values":
+            start_iris.update(term for row in node.res for term in row.values() if isinstance(term, URIRef))
+        # operands of an operator, its expressions are not operators
+        pending.extend(node[key] for key in ("p", "p1", "p2") if key in node)
+    if not patterns:
+        return None
+    return prepared, patterns, frozenset(start_iris)
+
+
+def component_names(value):
+    """
+    Names of all algebra operators and expressions in a parsed query
+    """
+    if isinstance(value, dict):
+        if hasattr(value, "name"):
+            yield value.name
+        for child in value.values():
+            yield from component_names(child)
+    elif isinstance(value, (list, tuple)):
+        for child in value:
+            yield from component_names(child)
+
+
+def construct_query(query: str, patterns) -> str:
+    """
+    CONSTRUCT query returning the triples that match the triple patterns of a SELECT query
+    """
+    template = " . ".join(" ".join(term.n3() for term in pattern) for pattern in patterns)
+    return SELECT_CLAUSE.sub(lambda _: f"CONSTRUCT {{ {template} }} WHERE ", query, count=1)
+
+
+def load_triples(graph: Graph, path: str):
+    if path.endswith(".hdt"):
+        from rdflib_hdt import HDTDocument  # optional, only for HDT extracts
+        triples, _ = HDTDocument(path).search((None, None, None))
+        for triple in triples:
+            graph.add(triple)
+    elif path.endswith(".gz"):
+        with gzip.open(path, "rb") as f:
+            graph.parse(source=f, format="nt")
+    else:
+        graph.parse(path, format="nt")
+
+
+class LocalMirror:
+    """
+    Answers covered queries from the local graph, everything else from the remote endpoint
+    """
+
+    def __init__(self, endpoint_url: str, path: str = None, seeds_path: str = None, learn: bool = False,
+                 learned_path: str = None, max_triples: int = 5_000_000):
+        self.endpoint_url = endpoint_url
+        self.graph = Graph()
+        self.seeds = set()
+        self.covered = set()
+        self.learn_enabled = learn
+        self.learned_path = learned_path
+        self.max_triples = max_triples
+        self.stats = {"hits": 0, "misses": 0, "uncovered": 0, "unsupported": 0, "learned_queries": 0,
+                      "learn_errors": 0, "local_seconds": 0.0, "remote_seconds": 0.0}
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=100)
+
+        start = time.perf_counter()
+        if path:
+            load_triples(self.graph, path)
+        if seeds_path:
+            with open(seeds_path, encoding="utf-8") as f:
+                self.seeds = {URIRef(line.strip().strip("<>")) for line in f if line.strip()}
+        if learned_path and os.path.exists(learned_path):
+            self.graph.parse(learned_path, format="nt")
+            with open(learned_path + ".queries", encoding="utf-8") as f:
+                self.covered = {json.loads(line) for line in f}
+        logging.info("Mirror loaded: %d triples, %d seeds, %d learned queries in %.1f s", len(self.graph),
+                     len(self.seeds), len(self.covered), time.perf_counter() - start)
+        if learn:
+            threading.Thread(target=self._learn_loop, name="mirror-learn", daemon=True).start()
+
+    def is_covered(self, query: str, analysis) -> bool:
+        return query in self.covered or bool(analysis[2]) and analysis[2] <= self.seeds
+
+    def execute(self, query: str, remote):
+        """
+        Result (SPARQL JSON) of the query, from the local graph if it is covered, else from `remote(query)`
+        """
+        normalized = normalize(query)
+        analysis = analyze(normalized)
+        if analysis is None:
+            self.stats["unsupported"] += 1
+        elif self.is_covered(normalized, analysis):
+            start = time.perf_counter()
+            try:
+                with self._lock:
+                    result = json.loads(self.graph.query(analysis[0]).serialize(format="json"))
+            except Exception as e:
+                logging.error("Mirror query failed, asking the remote endpoint: %s", e)
+            else:
+                self.stats["hits"] += 1
+                self.stats["local_seconds"] += time.perf_counter() - start
+                return result
+        else:
+            self.stats["uncovered"] += 1
+
+        self.stats["misses"] += 1
+        start = time.perf_counter()
+        result = remote(query)
+        self.stats["remote_seconds"] += time.perf_counter() - start
+        if analysis is not None and self.learn_enabled and "error" not in result:
+            try:
+                self._queue.put_nowait((normalized, analysis[1]))
+            except queue.Full:
+                pass
+        return result
+
+    def _learn_loop(self):
+        while True:
+            query, patterns = self._queue.get()
+            if query in self.covered:
+                continue
+            if len(self.graph) >= self.max_triples:
+                logging.warning("Mirror is full (%d triples), not learning", len(self.graph))
+                continue
+            try:
+                self.learn(query, patterns)
+            except Exception as e:
+                self.stats["learn_errors"] += 1
+                logging.error("Mirror could not learn query: %s", e)
+
+    def learn(self, query: str, patterns):
+        """
+        Fetches the triples matching the query's patterns from the remote endpoint and marks the query as covered
+        """
+        sparql = SPARQLWrapper(self.endpoint_url)
+        sparql.setQuery(construct_query(query, patterns))
+        sparql.setReturnFormat(TURTLE)
+        triples = Graph().parse(data=sparql.query().convert(), format="turtle")
+        with self._lock:
+            for triple in triples:
+                self.graph.add(triple)
+            self.covered.add(query)
+        self.stats["learned_queries"] += 1
+        if self.learned_path:
+            with open(self.learned_path, "a", encoding="utf-8") as f:
+                f.write(triples.serialize(format="nt"))
+            with open(self.learned_path + ".queries", "a", encoding="utf-8") as f:
+                f.write(json.dumps(query) + "\n")
+
+    def report(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_rate": self.stats["hits"] / lookups if lookups else None,
+            "local_ms_per_hit": 1000 * self.stats["local_seconds"] / self.stats["hits"] if self.stats["hits"] else None,
+            "remote_ms_per_miss": 1000 * self.stats["remote_seconds"] / self.stats["misses"]
+            if self.stats["misses"] else None,
+            "triples": len(self.graph),
+            "seeds": len(self.seeds),
+            "covered_queries": len(self.covered),
+        }
+
+
+def mirror_from_env(endpoint_url: str):
+    """
+    The mirror configured by MIRROR_PATH, MIRROR_SEEDS, MIRROR_LEARN, MIRROR_LEARNED and MIRROR_MAX_TRIPLES,
+    None if neither an extract nor learned triples nor learning is configured
+    """
+    path = os.environ.get("MIRROR_PATH")
+    learned_path = os.environ.get("MIRROR_LEARNED")
+    learn = os.environ.get("MIRROR_LEARN", "false").lower() == "true"
+    if not path and not learned_path and not learn:
+        return None
+    return LocalMirror(endpoint_url, path=path, seeds_path=os.environ.get("MIRROR_SEEDS"), learn=learn,
+                       learned_path=learned_path,
+                       max_triples=int(os.environ.get("MIRROR_MAX_TRIPLES", "5000000")))
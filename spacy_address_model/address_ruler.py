@@ -0,0 +1,135 @@
+"""
+Rule-based address entities for the `entity_ruler`: token patterns for POST_CODE and HOUSE_NR,
+street suffix patterns for STREET and a CITY gazetteer (matched on lowercase tokens) built from
+the City column of the training CSV files.
+
+    python address_ruler.py build                 # writes config/address_patterns(_ner).jsonl
+    python address_ruler.py parse "I live in Leipzig, Gustav-Freytag-Straße 42a."
+    python address_ruler.py bench
+
+config/config_ruler.cfg puts an entity_ruler with the high precision patterns (postcodes, house
+number ranges, gazetteer cities; address_patterns_ner.jsonl) in front of the statistical ner, which
+keeps these entities and only predicts the rest. All patterns (address_patterns.jsonl, including
+bare numbers as house numbers and street suffixes) make up the ruler-only pipeline without a trained
+model (`ruler_pipeline`).
+"""
+import argparse
+import csv
+import itertools
+import json
+import os
+import time
+
+import spacy
+from spacy.training import Corpus
+
+DEFAULT_PATTERNS = "./config/address_patterns.jsonl"
+DEFAULT_NER_PATTERNS = "./config/address_patterns_ner.jsonl"
+# only the training data, cities of the dev data in the gazetteer would inflate the dev scores
+DEFAULT_CSVS = ["./corpus/trainingdata/address_data.csv"]
+
+NUMBER = r"^\d{1,4}[a-zA-Z]?$"
+STREET_SUFFIXES = ["straße", "strasse", "str.", "weg", "platz", "allee", "gasse", "ring", "damm", "ufer", "chaussee",
+                   "street", "road", "avenue", "lane"]
+STREET_SUFFIX_REGEX = r"(?i)^\w+(" + "|".join(suffix.replace(".", r"\.") for suffix in STREET_SUFFIXES) + r")$"
+
+# high precision patterns, used in front of the statistical ner
+PRECISE_PATTERNS = [
+    # German postcodes: five digits
+    {"label": "POST_CODE", "pattern": [{"TEXT": {"REGEX": r"^\d{5}$"}}]},
+    # house number ranges: 12-14, 12/14
+    {"label": "HOUSE_NR", "pattern": [{"TEXT": {"REGEX": r"^\d{1,4}[a-zA-Z]?[-/]\d{1,4}[a-zA-Z]?$"}}]},
+    {"label": "HOUSE_NR", "pattern": [{"TEXT": {"REGEX": NUMBER}}, {"ORTH": {"IN": ["-", "/"]}},
+                                      {"TEXT": {"REGEX": NUMBER}}]},
+]
+
+# broader patterns, only for the ruler-only pipeline (other numbers and capitalized words also match)
+BROAD_PATTERNS = [
+    # 42, 42a
+    {"label": "HOUSE_NR", "pattern": [{"TEXT": {"REGEX": NUMBER}}]},
+    # Hauptstraße, Mühlenweg
+    {"label": "STREET", "pattern": [{"TEXT": {"REGEX": STREET_SUFFIX_REGEX}, "IS_TITLE": True}]},
+    # Schönseer Straße, Gustav-Freytag-Straße, Am Alten Ring
+    {"label": "STREET", "pattern": [{"IS_TITLE": True, "OP": "+"}, {"ORTH": "-", "OP": "?"},
+                                    {"IS_TITLE": True, "OP": "?"}, {"ORTH": "-", "OP": "?"},
+                                    {"LOWER": {"IN": STREET_SUFFIXES}}]},
+]
+
+
+def city_patterns(csv_paths):
+    """
+    Gazetteer patterns (phrases) from the City column, duplicates removed
+    """
+    cities = set()
+    for path in csv_paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            cities.update(row["City"].strip() for row in csv.DictReader(f) if row.get("City", "").strip())
+    return [{"label": "CITY", "pattern": city} for city in sorted(cities)]
+
+
+def write_patterns(patterns, output_path):
+    with open(output_path, "w", encoding="utf-8") as f:
+        for pattern in patterns:
+            f.write(json.dumps(pattern, ensure_ascii=False) + "\n")
+    return len(patterns)
+
+
+def build_patterns(csv_paths, output_path=DEFAULT_PATTERNS, ner_output_path=DEFAULT_NER_PATTERNS):
+    """
+    Writes all patterns (ruler-only pipeline) and the high precision patterns (in front of the ner)
+    """
+    cities = city_patterns(csv_paths)
+    return (write_patterns(PRECISE_PATTERNS + BROAD_PATTERNS + cities, output_path),
+            write_patterns(PRECISE_PATTERNS + cities, ner_output_path))
+
+
+def ruler_pipeline(patterns_path=DEFAULT_PATTERNS, lang="en"):
+    """
+    Blank pipeline with only the entity_ruler, no trained model needed
+    """
+    nlp = spacy.blank(lang)
+    ruler = nlp.add_pipe("entity_ruler", config={"phrase_matcher_attr": "LOWER"})
+    ruler.from_disk(patterns_path)
+    return nlp
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="write the patterns file")
+    build_parser.add_argument("--csv", nargs="+", default=DEFAULT_CSVS, help="CSV files with a City column")
+    build_parser.add_argument("-o", "--output", default=DEFAULT_PATTERNS)
+    build_parser.add_argument("--ner-output", default=DEFAULT_NER_PATTERNS)
+    parse_parser = subparsers.add_parser("parse", help="print the entities the ruler finds")
+    parse_parser.add_argument("text", nargs="+")
+    parse_parser.add_argument("--patterns", default=DEFAULT_PATTERNS)
+    bench_parser = subparsers.add_parser("bench", help="latency of the ruler-only pipeline per text")
+    bench_parser.add_argument("--patterns", default=DEFAULT_PATTERNS)
+    bench_parser.add_argument("--data", default=DEFAULT_CSVS[0])
+    bench_parser.add_argument("--texts", type=int, default=5000)
+    bench_parser.add_argument("--dev", default="./corpus/spacy-docbins/test", help="DocBins to score the ruler on")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        counts = build_patterns(args.csv, args.output, args.ner_output)
+        print(f"{counts[0]} patterns written to {args.output}, {counts[1]} to {args.ner_output}")
+    elif args.command == "parse":
+        nlp = ruler_pipeline(args.patterns)
+        for doc in nlp.pipe(args.text):
+            print(doc.text, [(ent.text, ent.label_) for ent in doc.ents])
+    else:
+        nlp = ruler_pipeline(args.patterns)
+        with open(args.data, newline="", encoding="utf-8") as f:
+            samples = [row["Address"] for row in csv.DictReader(f)]
+        texts = list(itertools.islice(itertools.cycle(samples), args.texts))
+        start = time.perf_counter()
+        for text in texts:
+            nlp(text)
+        print(f"nlp(text): {(time.perf_counter() - start) / len(texts) * 1000:.3f} ms per text")
+        start = time.perf_counter()
+        list(nlp.pipe(texts, batch_size=256))
+        print(f"nlp.pipe: {len(texts) / (time.perf_counter() - start):.0f} texts/s")
+        if os.path.exists(args.dev):
+            scores = nlp.evaluate(list(Corpus(args.dev)(nlp)))
+            print(f"F1 on {args.dev}: {scores['ents_f']:.3f}",
+                  {label: round(values["f"], 3) for label, values in sorted(scores["ents_per_type"].items())})
@@ -0,0 +1,137 @@
+"""
+Trains and evaluates variants of config/config.cfg to compare accuracy and CPU inference speed.
+
+    python generate_spacy_data.py
+    python benchmark_configs.py
+    python benchmark_configs.py --width 96 64 32 --depth 4 2 --embed-size 2000 500 --max-steps 2000
+    python benchmark_configs.py --variants baseline small tiny --json results.json
+
+Every variant is the base config plus overrides (tok2vec width/depth/embed size, NER hidden width,
+batch size schedule). For each trained model (model-best) the report lists the F1 score per entity
+label on the dev corpus, throughput of `nlp.pipe` (docs/s), p50/p99 latency of `nlp(text)` per doc
+and the size of the model directory.
+"""
+import argparse
+import itertools
+import json
+import os
+import time
+
+import spacy
+from spacy.cli.train import train
+from spacy.training import Corpus
+
+TOK2VEC = "components.ner.model.tok2vec"
+
+# named variants: overrides of config/config.cfg
+VARIANTS = {
+    "baseline": {},
+    "narrow": {f"{TOK2VEC}.width": 64},
+    "shallow": {f"{TOK2VEC}.depth": 2},
+    "small": {f"{TOK2VEC}.width": 64, f"{TOK2VEC}.depth": 2, f"{TOK2VEC}.embed_size": 1000,
+              "components.ner.model.hidden_width": 48},
+    "tiny": {f"{TOK2VEC}.width": 32, f"{TOK2VEC}.depth": 1, f"{TOK2VEC}.embed_size": 500,
+             "components.ner.model.hidden_width": 32},
+    "no-subwords": {f"{TOK2VEC}.subword_features": False},
+    "large-batches": {"training.batcher.size.start": 500, "training.batcher.size.stop": 2000},
+}
+
+
+def grid_variants(widths, depths, embed_sizes) -> dict:
+    return {f"w{width}-d{depth}-e{embed_size}": {f"{TOK2VEC}.width": width, f"{TOK2VEC}.depth": depth,
+                                                 f"{TOK2VEC}.embed_size": embed_size}
+            for width, depth, embed_size in itertools.product(widths, depths, embed_sizes)}
+
+
+def directory_size(path) -> int:
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(path) for name in names)
+
+
+def percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def evaluate(model_path, dev_path, speed_docs=2000) -> dict:
+    """
+    Scores a trained pipeline on the dev corpus and measures its speed on the dev texts
+    """
+    nlp = spacy.load(model_path)
+    examples = list(Corpus(dev_path)(nlp))
+    scores = nlp.evaluate(examples)
+    texts = [example.reference.text for example in examples]
+    texts = list(itertools.islice(itertools.cycle(texts), speed_docs))
+
+    list(nlp.pipe(texts[:100]))  # warm-up
+    start = time.perf_counter()
+    for _ in nlp.pipe(texts, batch_size=256):
+        pass
+    docs_per_second = len(texts) / (time.perf_counter() - start)
+
+    latencies = []
+    for text in texts[:1000]:
+        start = time.perf_counter()
+        nlp(text)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "f1": scores["ents_f"],
+        "f1_per_label": {label: values["f"] for label, values in sorted((scores["ents_per_type"] or {}).items())},
+        "docs_per_second": docs_per_second,
+        "p50_ms": percentile(latencies, 0.5),
+        "p99_ms": percentile(latencies, 0.99),
+        "size_bytes": directory_size(model_path),
+    }
+
+
+def run_variant(name, overrides, config, train_path, dev_path, output_dir, max_steps=None, speed_docs=2000) -> dict:
+    output = os.path.join(output_dir, name)
+    overrides = {"paths.train": train_path, "paths.dev": dev_path, **overrides}
+    if max_steps:
+        overrides["training.max_steps"] = max_steps
+    start = time.perf_counter()
+    train(config, output, overrides=overrides)
+    result = {"variant": name, "overrides": overrides, "train_seconds": time.perf_counter() - start}
+    result.update(evaluate(os.path.join(output, "model-best"), dev_path, speed_docs))
+    return result
+
+
+def print_report(results):
+    labels = sorted({label for result in results for label in result["f1_per_label"]})
+    header = f"{'variant':<22} {'F1':>6} " + " ".join(f"{label:>9}" for label in labels) + \
+             f" {'docs/s':>8} {'p50 ms':>7} {'p99 ms':>7} {'size MB':>8}"
+    print(header)
+    print("-" * len(header))
+    for result in results:
+        per_label = " ".join(f"{result['f1_per_label'].get(label, 0):>9.3f}" for label in labels)
+        print(f"{result['variant']:<22} {result['f1']:>6.3f} {per_label} {result['docs_per_second']:>8.0f} "
+              f"{result['p50_ms']:>7.2f} {result['p99_ms']:>7.2f} {result['size_bytes'] / 1e6:>8.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--config", default="./config/config.cfg")
+    parser.add_argument("--train", default="./corpus/spacy-docbins/train")
+    parser.add_argument("--dev", default="./corpus/spacy-docbins/test")
+    parser.add_argument("--output-dir", default="./benchmarks")
+    parser.add_argument("--variants", nargs="+", choices=list(VARIANTS), help="named variants (default: all)")
+    parser.add_argument("--width", type=int, nargs="+", help="grid instead of named variants: tok2vec widths")
+    parser.add_argument("--depth", type=int, nargs="+", default=[4], help="grid: tok2vec depths")
+    parser.add_argument("--embed-size", type=int, nargs="+", default=[2000], help="grid: tok2vec embedding rows")
+    parser.add_argument("--max-steps", type=int, help="override training.max_steps (faster, less accurate runs)")
+    parser.add_argument("--speed-docs", type=int, default=2000, help="docs for the throughput measurement")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    if args.width:
+        variants = grid_variants(args.width, args.depth, args.embed_size)
+    else:
+        variants = {name: VARIANTS[name] for name in (args.variants or VARIANTS)}
+
+    results = [run_variant(name, overrides, args.config, args.train, args.dev, args.output_dir, args.max_steps,
+                           args.speed_docs)
+               for name, overrides in variants.items()]
+    print()
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
@@ -0,0 +1,62 @@
+"""
+Measures the entity span generation of generate_spacy_data.py on synthetic corpora.
+
+The synthetic rows combine streets, house numbers, postcodes and cities of the training CSV
+in a few sentence patterns, so most address components are distinct like in a real corpus.
+
+    python benchmark_entity_spans.py
+    python benchmark_entity_spans.py --rows 10000 100000 1000000 --workers 1 4 --chunk-size 50000
+"""
+import argparse
+import csv
+import os
+import random
+import tempfile
+import time
+
+import pandas as pd
+
+from generate_spacy_data import read_entity_spans
+
+SENTENCES = [
+    "I live in {street} {house_nr} in {post_code} {city}",
+    "Please deliver to {street} {house_nr}, {post_code} {city}.",
+    "My address is {street} {house_nr},{post_code} {city}!",
+    "Send it to {post_code} {city}, {street} {house_nr}",
+    "I recently moved to {city} into the {street}.",
+]
+
+
+def write_synthetic_corpus(path, rows, source="./corpus/trainingdata/address_data.csv", seed=42):
+    reference = pd.read_csv(source, dtype=str).dropna(subset=["Street", "City"])
+    streets, cities = reference["Street"].unique().tolist(), reference["City"].unique().tolist()
+    rng = random.Random(seed)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Address", "Street", "House_Nr", "Post_Code", "City"])
+        for _ in range(rows):
+            sentence = rng.choice(SENTENCES)
+            # distinct street names per row (e.g. "Hauptstraße 17"), like a large real corpus
+            values = {"street": f"{rng.choice(streets)} {rng.randint(1, 99)}", "house_nr": str(rng.randint(1, 999)),
+                      "post_code": f"{rng.randint(1000, 99999):05d}", "city": rng.choice(cities)}
+            writer.writerow([sentence.format(**values), values["street"],
+                             values["house_nr"] if "{house_nr}" in sentence else "",
+                             values["post_code"] if "{post_code}" in sentence else "", values["city"]])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000, 1000000])
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--chunk-size", type=int, default=20000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            path = os.path.join(directory, f"synthetic_{rows}.csv")
+            write_synthetic_corpus(path, rows)
+            for workers in args.workers:
+                start = time.perf_counter()
+                examples = read_entity_spans(path, workers, args.chunk_size)
+                seconds = time.perf_counter() - start
+                print(f"{rows:>8} rows, {workers} worker(s): {seconds:7.2f} s, {len(examples) / seconds:9.0f} rows/s")
@@ -1,10 +1,51 @@
+"""
+Generates the training and test corpus from the annotated address CSV files
+(columns Address, Street, House_Nr, Post_Code, City) as directories of DocBin shards:
+corpus/spacy-docbins/train/ and corpus/spacy-docbins/test/.
+
+    python generate_spacy_data.py
+    python generate_spacy_data.py --workers 4 --chunk-size 50000
+    python generate_spacy_data.py --check-golden      # compare the entity spans with corpus/golden/
+    python generate_spacy_data.py --cache-dir ./corpus/.cache --chunk-size 5000    # incremental rebuild
+
+The CSV is streamed in chunks: the entity spans are computed per chunk in worker processes (string
+cleaning is vectorized, the regex of an address component is compiled once), the texts are tokenized
+with `nlp.pipe` and written to shards of `--shard-size` docs. Rows whose spans do not fit the tokens
+are written to <corpus>.rejects.jsonl.
+
+With `--cache-dir` only new or changed chunks of the CSV files are processed, the DocBins of the other
+chunks are reused from the cache; `manifest.json` in the output directory records the source hashes,
+the chunks of every shard and the fingerprint of spaCy version, tokenizer and this script.
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+from collections import deque
+from functools import lru_cache
+from itertools import chain
+from multiprocessing import Pool
+
+import pandas as pd
 import spacy
 from spacy.tokens import DocBin
-import pandas as pd
-import re
 
 # pd.set_option('display.max_colwidth', -1)
 
+# Define custom entity tag list: tag -> (CSV column, entity label)
+TAGS = {
+    "StreetTag": ("Street", "STREET"),
+    "HouseNrTag": ("House_Nr", "HOUSE_NR"),
+    "PostCodeTag": ("Post_Code", "POST_CODE"),
+    "CityTag": ("City", "CITY"),
+}
+tag_list = list(TAGS)
+
+GOLDEN_DIR = "./corpus/golden"
+
 
 def massage_data(address):
     # Pre process address string to remove new line characters, add comma punctuations etc.
@@ -14,6 +55,31 @@ def massage_data(address):
     return cleansed_address3
 
 
+def massage_addresses(addresses: pd.Series) -> pd.Series:
+    """
+    Vectorized `massage_data` for a column of addresses
+    """
+    return (addresses.str.replace(r'(,)(?!\s)', ', ', regex=True)
+            .str.replace(r'(\\n)', ', ', regex=True)
+            .str.replace(r'(?!\s)(-)(?!\s)', ' - ', regex=True))
+
+
+def prepare_components(components: pd.Series) -> list:
+    """
+    Cleans a column of address components the way they are searched in the address, None for missing values
+    """
+    missing = components.isna() | (components.astype(str) == 'nan')
+    cleaned = (components.astype(str).str.replace(r'\.', '', regex=True)
+               .str.replace(r'(?!\s)(-)(?!\s)', ' - ', regex=True))
+    return cleaned.mask(missing, None).tolist()
+
+
+@lru_cache(maxsize=65536)
+def component_pattern(address_component):
+    # the component is used as a regular expression (not escaped), like it always was
+    return re.compile('\\b(?:' + address_component + ')\\b')
+
+
 def get_address_span(address=None, address_component=None, label=None):
     """
     Search for specified address component and get the span.
@@ -26,17 +92,14 @@ def get_address_span(address=None, address_component=None, label=None):
     else:
         address_component1 = re.sub(r'\.', '', address_component)
         address_component2 = re.sub(r'(?!\s)(-)(?!\s)', ' - ', address_component1)
-        span = re.search('\\b(?:' + address_component2 + ')\\b', address)
-        # print(address + ' and entity ' + address_component)
-        return span.start(), span.end(), label
+        return find_span(address, address_component2, label)
 
 
-def extend_list(entity_list, entity):
-    if pd.isna(entity):
-        return entity_list
-    else:
-        entity_list.append(entity)
-        return entity_list
+def find_span(address, cleaned_component, label):
+    span = component_pattern(cleaned_component).search(address)
+    if span is None:
+        raise ValueError(f"{label} '{cleaned_component}' not found in: {address}")
+    return span.start(), span.end(), label
 
 
 # Address,Street,House_Nr,Post_Code,City
@@ -44,80 +107,367 @@ def create_entity_spans(df, tag_list):
     """
     Create entity spans for training/test datasets
     """
-    df['Address'] = df['Address'].apply(lambda x: massage_data(x))
-    df["StreetTag"] = df.apply(
-        lambda row: get_address_span(address=row['Address'], address_component=row['Street'], label='STREET'), axis=1)
-    df["HouseNrTag"] = df.apply(
-        lambda row: get_address_span(address=row['Address'], address_component=row['House_Nr'], label='HOUSE_NR'),
-        axis=1)
-    df["PostCodeTag"] = df.apply(
-        lambda row: get_address_span(address=row['Address'], address_component=row['Post_Code'], label='POST_CODE'),
-        axis=1)
-    df["CityTag"] = df.apply(
-        lambda row: get_address_span(address=row['Address'], address_component=row['City'], label='CITY'), axis=1)
-    df['EmptySpan'] = df.apply(lambda x: [], axis=1)
-
-    for i in tag_list:
-        df['EntitySpans'] = df.apply(lambda row: extend_list(row['EmptySpan'], row[i]), axis=1)
-        df['EntitySpans'] = df[['EntitySpans', 'Address']].apply(lambda x: (x[1], x[0]), axis=1)
-    return df['EntitySpans']
+    df = df.astype(str)
+    addresses = massage_addresses(df['Address']).tolist()
+    labels = [TAGS[tag][1] for tag in tag_list]
+    columns = [prepare_components(df[TAGS[tag][0]]) for tag in tag_list]
+
+    entity_spans = []
+    for address, *components in zip(addresses, *columns):
+        spans = [find_span(address, component, label)
+                 for component, label in zip(components, labels) if component is not None]
+        entity_spans.append((address, spans))
+    return pd.Series(entity_spans, index=df.index, dtype=object)
+
+
+def _chunk_entity_spans(df):
+    return create_entity_spans(df, tag_list).tolist()
+
+
+def iter_entity_spans(path, workers=1, chunk_size=20000):
+    """
+    Reads a CSV file in chunks and yields the (text, spans) pairs of every chunk in file order.
+    With `workers` > 1 the chunks are processed in parallel, at most 2 chunks per worker are in flight.
+    """
+    chunks = pd.read_csv(filepath_or_buffer=path, sep=",", dtype=str, chunksize=chunk_size)
+    if workers <= 1:
+        for chunk in chunks:
+            yield _chunk_entity_spans(chunk)
+        return
+    with Pool(workers) as pool:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(pool.apply_async(_chunk_entity_spans, (chunk,)))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
+def read_entity_spans(path, workers=1, chunk_size=20000):
+    """
+    Returns the (text, spans) pairs of all rows of a CSV file
+    """
+    return [example for chunk in iter_entity_spans(path, workers, chunk_size) for example in chunk]
+
+
+def prepare_shard_directory(directory):
+    """
+    Creates the directory and removes the shards of a previous (larger) run,
+    they would otherwise be read as part of the corpus
+    """
+    os.makedirs(directory, exist_ok=True)
+    for name in os.listdir(directory):
+        if name.endswith(".spacy"):
+            os.remove(os.path.join(directory, name))
+
+
+def shard_path(directory, index):
+    return os.path.join(directory, f"shard-{index:05d}.spacy")
+
+
+class ShardedDocBinWriter:
+    """
+    Writes docs into DocBin files of `shard_size` docs each (shard-00000.spacy, ...) in a directory,
+    which `spacy.Corpus` (e.g. `spacy train --paths.train <directory>`) reads as one corpus
+    """
+
+    def __init__(self, directory, shard_size=10000):
+        prepare_shard_directory(directory)
+        self.directory = directory
+        self.shard_size = shard_size
+        self.docs = 0
+        self.shards = 0
+        self._doc_bin = DocBin()
+
+    def add(self, doc):
+        self._doc_bin.add(doc)
+        self.docs += 1
+        if len(self._doc_bin) >= self.shard_size:
+            self.flush()
+
+    def flush(self):
+        if len(self._doc_bin):
+            self._doc_bin.to_disk(shard_path(self.directory, self.shards))
+            self.shards += 1
+            self._doc_bin = DocBin()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
 
 
 # https://spacy.io/usage/training#training-data
-def get_doc_bin(training_data, nlp):
-    """
-    Create DocBin object for building training/test corpus
-    """
-    # the DocBin will store the example documents
-    db = DocBin()
-    for text, annotations in training_data:
-        doc = nlp(text)  # Construct a Doc object
-        ents = []
-        for start, end, label in annotations:
-            span = doc.char_span(start, end, label=label)
-            ents.append(span)
-        if None in ents:
-            print('None Type detected in:')
-            print(text)
-            print('with annotations')
-            print(annotations)
-            print('creates entitites:')
-            print(ents)
-            continue
-        doc.ents = ents
-        db.add(doc)
-    return db
-
-
-# Load blank English model. This is needed for initializing a Document object for our training/test set.
-nlp = spacy.blank("en")
-
-# Define custom entity tag list
-tag_list = ["StreetTag", "HouseNrTag", "PostCodeTag", "CityTag"]
-
-###### Training dataset prep ###########
-# Read the training dataset into pandas
-df_train = pd.read_csv(filepath_or_buffer="./corpus/trainingdata/address_data.csv", sep=",", dtype=str)
-
-# Get entity spans
-df_entity_spans = create_entity_spans(df_train.astype(str), tag_list)
-training_data = df_entity_spans.values.tolist()
-
-# Get & Persist DocBin to disk
-doc_bin_train = get_doc_bin(training_data, nlp)
-doc_bin_train.to_disk("./corpus/spacy-docbins/train.spacy")
-######################################
-
-
-###### Validation dataset prep ###########
-# Read the validation dataset into pandas
-df_test = pd.read_csv(filepath_or_buffer="./corpus/trainingdata/address_validation_data.csv", sep=",", dtype=str)
-
-# Get entity spans
-df_entity_spans = create_entity_spans(df_test.astype(str), tag_list)
-validation_data = df_entity_spans.values.tolist()
-
-# Get & Persist DocBin to disk
-doc_bin_test = get_doc_bin(validation_data, nlp)
-doc_bin_test.to_disk("./corpus/spacy-docbins/test.spacy")
-##########################################
+def make_docs(training_data, nlp, batch_size=1000):
+    """
+    Tokenizes the texts with `nlp.pipe` and sets the entity spans. Yields (doc, None), or (None, reject)
+    if a span does not fit the token boundaries or spans overlap.
+    """
+    for doc, annotations in nlp.pipe(training_data, as_tuples=True, batch_size=batch_size):
+        ents = [doc.char_span(start, end, label=label) for start, end, label in annotations]
+        if None not in ents:
+            try:
+                doc.ents = ents
+                yield doc, None
+                continue
+            except ValueError:  # overlapping spans
+                pass
+        yield None, {"text": doc.text, "annotations": [list(annotation) for annotation in annotations],
+                     "entities": [ent.text if ent is not None else None for ent in ents]}
+
+
+def write_corpus(csv_path, directory, nlp, workers=1, chunk_size=20000, batch_size=1000, shard_size=10000,
+                 reject_path=None) -> dict:
+    """
+    Streams a CSV file into sharded DocBins, rows with spans that do not fit the tokens go to the reject file
+    (JSON lines, default `<directory>.rejects.jsonl`). Only one chunk and one shard are held in memory.
+    """
+    reject_path = reject_path or directory.rstrip("/\\") + ".rejects.jsonl"
+    examples = chain.from_iterable(iter_entity_spans(csv_path, workers, chunk_size))
+    rejected = 0
+    with ShardedDocBinWriter(directory, shard_size) as writer, open(reject_path, "w", encoding="utf-8") as rejects:
+        for doc, reject in make_docs(examples, nlp, batch_size):
+            if doc is None:
+                rejects.write(json.dumps(reject, ensure_ascii=False) + "\n")
+                rejected += 1
+            else:
+                writer.add(doc)
+    return {"docs": writer.docs, "shards": writer.shards, "rejected": rejected, "rejects": reject_path}
+
+
+def build_fingerprint(nlp) -> str:
+    """
+    Hash of everything besides the CSV rows that determines the docs: spaCy version, tokenizer and this script
+    """
+    digest = hashlib.sha256()
+    digest.update(spacy.__version__.encode("utf-8"))
+    digest.update(nlp.tokenizer.to_bytes())
+    with open(__file__, "rb") as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def content_chunks(path, chunk_size=20000):
+    """
+    Reads a CSV file and splits it into content-defined chunks: a chunk ends after a row whose hash is
+    divisible by `chunk_size` (at most 4 * `chunk_size` rows), so adding, changing or removing rows only
+    changes the chunks around these rows and the other chunks keep their content
+    """
+    max_rows = 4 * chunk_size
+    rest = None
+    for frame in pd.read_csv(filepath_or_buffer=path, sep=",", dtype=str, chunksize=max_rows):
+        if rest is not None:
+            frame = pd.concat([rest, frame])
+        hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+        start = 0
+        for end in (hashes % chunk_size == 0).nonzero()[0] + 1:
+            while end - start > max_rows:
+                yield frame.iloc[start:start + max_rows]
+                start += max_rows
+            yield frame.iloc[start:end]
+            start = end
+        while len(frame) - start > max_rows:
+            yield frame.iloc[start:start + max_rows]
+            start += max_rows
+        rest = frame.iloc[start:]
+    if rest is not None and len(rest):
+        yield rest
+
+
+# pipeline of a worker process building cache entries
+_nlp = {}
+
+
+def build_chunk(chunk, cache_path, lang="en", batch_size=1000) -> dict:
+    """
+    Computes the docs of a chunk and stores them in the cache: `<cache_path>.spacy` with the docs and
+    `<cache_path>.json` with the counts and the rejected rows (written last, marks the entry as complete)
+    """
+    nlp = _nlp.get(lang) or _nlp.setdefault(lang, spacy.blank(lang))
+    doc_bin = DocBin()
+    rejects = []
+    for doc, reject in make_docs(create_entity_spans(chunk, tag_list).tolist(), nlp, batch_size):
+        if doc is None:
+            rejects.append(reject)
+        else:
+            doc_bin.add(doc)
+    doc_bin.to_disk(cache_path + ".spacy.tmp")
+    os.replace(cache_path + ".spacy.tmp", cache_path + ".spacy")
+    entry = {"rows": len(chunk), "docs": len(doc_bin), "rejects": rejects}
+    with open(cache_path + ".json.tmp", "w", encoding="utf-8") as f:
+        json.dump(entry, f, ensure_ascii=False)
+    os.replace(cache_path + ".json.tmp", cache_path + ".json")
+    return entry
+
+
+def _link(source, target):
+    try:
+        os.link(source, target)
+    except OSError:
+        shutil.copyfile(source, target)
+
+
+def write_corpus_incremental(csv_path, directory, nlp, cache_dir, workers=1, chunk_size=20000, batch_size=1000,
+                             reject_path=None) -> dict:
+    """
+    Like `write_corpus`, but every content-defined chunk of the CSV is cached under the hash of its rows and
+    the fingerprint (`build_fingerprint`): only new or changed chunks are tokenized, the shards of the corpus
+    are hard links (or copies) of the cached DocBins.
+    """
+    reject_path = reject_path or directory.rstrip("/\\") + ".rejects.jsonl"
+    fingerprint = build_fingerprint(nlp)
+    os.makedirs(cache_dir, exist_ok=True)
+    prepare_shard_directory(directory)
+
+    pool = Pool(workers) if workers > 1 else None
+    chunks = []
+    try:
+        for chunk in content_chunks(csv_path, chunk_size):
+            digest = hashlib.sha256(fingerprint.encode("ascii"))
+            digest.update(chunk.to_csv(index=False).encode("utf-8"))
+            key = digest.hexdigest()
+            cache_path = os.path.join(cache_dir, key)
+            if os.path.exists(cache_path + ".json"):
+                chunks.append((key, None))
+            elif pool is not None:
+                chunks.append((key, pool.apply_async(build_chunk, (chunk, cache_path, nlp.lang, batch_size))))
+            else:
+                chunks.append((key, build_chunk(chunk, cache_path, nlp.lang, batch_size)))
+
+        stats = {"docs": 0, "rows": 0, "rejected": 0, "reused": 0, "built": 0, "rejects": reject_path,
+                 "fingerprint": fingerprint, "shards": []}
+        with open(reject_path, "w", encoding="utf-8") as rejects:
+            for index, (key, result) in enumerate(chunks):
+                cache_path = os.path.join(cache_dir, key)
+                if result is None:
+                    with open(cache_path + ".json", encoding="utf-8") as f:
+                        entry = json.load(f)
+                    stats["reused"] += 1
+                else:
+                    entry = result.get() if pool is not None else result
+                    stats["built"] += 1
+                shard = shard_path(directory, index)
+                _link(cache_path + ".spacy", shard)
+                for reject in entry["rejects"]:
+                    rejects.write(json.dumps(reject, ensure_ascii=False) + "\n")
+                stats["rows"] += entry["rows"]
+                stats["docs"] += entry["docs"]
+                stats["rejected"] += len(entry["rejects"])
+                stats["shards"].append({"file": os.path.basename(shard), "chunk": key, "rows": entry["rows"],
+                                        "docs": entry["docs"]})
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    return stats
+
+
+def file_sha256(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def prune_cache(cache_dir, keep):
+    """
+    Removes the cache entries whose chunk key is not in `keep`, returns the number of removed entries
+    """
+    removed = 0
+    for name in os.listdir(cache_dir):
+        key = name.split(".", 1)[0]
+        if key not in keep:
+            os.remove(os.path.join(cache_dir, name))
+            removed += name.endswith(".json")
+    return removed
+
+
+def golden_path(csv_path):
+    return os.path.join(GOLDEN_DIR, os.path.splitext(os.path.basename(csv_path))[0] + ".spans.jsonl")
+
+
+def to_jsonl(entity_spans) -> str:
+    return "".join(json.dumps([text, [list(span) for span in spans]], ensure_ascii=False) + "\n"
+                   for text, spans in entity_spans)
+
+
+def check_golden(csv_path, entity_spans) -> bool:
+    """
+    Compares the entity spans of a CSV file with its golden file, prints the first difference
+    """
+    with open(golden_path(csv_path), encoding="utf-8") as f:
+        expected = f.read().splitlines()
+    actual = to_jsonl(entity_spans).splitlines()
+    for line, (want, got) in enumerate(zip(expected, actual), start=1):
+        if want != got:
+            print(f"{csv_path} row {line}: expected {want}, got {got}")
+            return False
+    if len(expected) != len(actual):
+        print(f"{csv_path}: expected {len(expected)} rows, got {len(actual)}")
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--train", default="./corpus/trainingdata/address_data.csv")
+    parser.add_argument("--test", default="./corpus/trainingdata/address_validation_data.csv")
+    parser.add_argument("--output-dir", default="./corpus/spacy-docbins")
+    parser.add_argument("--workers", type=int, default=1, help="processes computing the entity spans")
+    parser.add_argument("--chunk-size", type=int, default=20000, help="CSV rows per chunk")
+    parser.add_argument("--batch-size", type=int, default=1000, help="texts per nlp.pipe batch")
+    parser.add_argument("--shard-size", type=int, default=10000, help="docs per DocBin file")
+    parser.add_argument("--cache-dir", help="incremental build: reuse the cached DocBins of unchanged chunks "
+                                            "(shards are content-defined chunks of about --chunk-size rows)")
+    parser.add_argument("--prune-cache", action="store_true", help="remove cache entries the corpora do not use")
+    parser.add_argument("--check-golden", action="store_true",
+                        help="only compare the entity spans with the golden files, exit code 1 on differences")
+    parser.add_argument("--update-golden", action="store_true", help="rewrite the golden files")
+    args = parser.parse_args()
+
+    if args.check_golden or args.update_golden:
+        ok = True
+        for csv_path in (args.train, args.test):
+            entity_spans = read_entity_spans(csv_path, args.workers, args.chunk_size)
+            if args.update_golden:
+                with open(golden_path(csv_path), "w", encoding="utf-8") as f:
+                    f.write(to_jsonl(entity_spans))
+            elif check_golden(csv_path, entity_spans):
+                print(f"{csv_path}: {len(entity_spans)} rows match {golden_path(csv_path)}")
+            else:
+                ok = False
+        sys.exit(0 if ok else 1)
+
+    # Load blank English model. This is needed for initializing a Document object for our training/test set.
+    nlp = spacy.blank("en")
+
+    # Get entity spans & persist sharded DocBins to disk
+    manifest = {"spacy_version": spacy.__version__, "lang": nlp.lang, "corpora": {}}
+    for csv_path, name in ((args.train, "train"), (args.test, "test")):
+        directory = os.path.join(args.output_dir, name)
+        if args.cache_dir:
+            stats = write_corpus_incremental(csv_path, directory, nlp, args.cache_dir, args.workers, args.chunk_size,
+                                             args.batch_size)
+            manifest["fingerprint"] = stats.pop("fingerprint")
+            manifest["corpora"][name] = {"source": csv_path, "source_sha256": file_sha256(csv_path),
+                                         "directory": directory, "rows": stats["rows"], "docs": stats["docs"],
+                                         "rejected": stats["rejected"], "shards": stats["shards"]}
+            print(f"{csv_path}: {stats['docs']} docs in {len(stats['shards'])} shard(s) of {directory} "
+                  f"({stats['reused']} cached, {stats['built']} built), {stats['rejected']} rejected rows in "
+                  f"{stats['rejects']}")
+        else:
+            stats = write_corpus(csv_path, directory, nlp, args.workers, args.chunk_size, args.batch_size,
+                                 args.shard_size)
+            print(f"{csv_path}: {stats['docs']} docs in {stats['shards']} shard(s) of {directory}, "
+                  f"{stats['rejected']} rejected rows in {stats['rejects']}")
+
+    if args.cache_dir:
+        # the manifest pins the exact input of a `spacy train` run: sources, chunks and fingerprint
+        with open(os.path.join(args.output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        if args.prune_cache:
+            keep = {shard["chunk"] for corpus in manifest["corpora"].values() for shard in corpus["shards"]}
+            print(f"{prune_cache(args.cache_dir, keep)} unused cache entries removed")
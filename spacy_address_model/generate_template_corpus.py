@@ -0,0 +1,238 @@
+"""
+Generates a synthetic training corpus from the address templates in corpus/trainingdata/templates/
+(texts with the placeholders STREET, HOUSENR, POSTCODE and CITY in the first column).
+
+    python generate_template_corpus.py --count 1000000 --workers 4
+    python generate_template_corpus.py --values corpus/trainingdata/address_data.csv --streets streets.txt
+
+Streets, postcodes and cities are taken from the Street, Post_Code and City columns of the `--values`
+CSV files or from text files with one value per line; house numbers are generated. The entity
+offsets are computed while the placeholders are substituted. Batches of examples are generated by
+worker processes (batch i is seeded with `--seed` and i, so the corpus does not depend on the number
+of workers), deduplicated by text, tokenized in the workers and written as DocBin shards to
+`--output-dir`, which `spacy train --paths.train <directory>` reads as one corpus.
+"""
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from multiprocessing import Pool
+
+import pandas as pd
+import spacy
+from spacy.tokens import DocBin
+
+from generate_spacy_data import make_docs, massage_data, prepare_shard_directory, shard_path
+
+# placeholder -> entity label
+PLACEHOLDERS = {"STREET": "STREET", "HOUSENR": "HOUSE_NR", "POSTCODE": "POST_CODE", "CITY": "CITY"}
+PLACEHOLDER_PATTERN = re.compile(r"\b(" + "|".join(PLACEHOLDERS) + r")\b")
+
+DEFAULT_TEMPLATES = "./corpus/trainingdata/templates/*/*.csv"
+
+
+def load_templates(paths):
+    """
+    Reads the templates (first column, the header row is skipped) and splits each into
+    alternating literal text and placeholders: ["I live in ", "STREET", " ", "HOUSENR", "."]
+    """
+    templates = []
+    for path in paths:
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = csv.reader(f)
+            next(rows, None)
+            for row in rows:
+                if row and PLACEHOLDER_PATTERN.search(row[0]):
+                    # like the annotated corpus: ", " after commas, " - " around hyphens
+                    templates.append(PLACEHOLDER_PATTERN.split(massage_data(row[0].strip())))
+    return templates
+
+
+def load_values(csv_paths, streets=None, postcodes=None, cities=None) -> dict:
+    """
+    Returns the distinct values per placeholder, text files (one value per line) replace the CSV columns
+    """
+    frame = pd.concat([pd.read_csv(path, dtype=str) for path in csv_paths]) if csv_paths else pd.DataFrame()
+    values = {}
+    for placeholder, column, path in (("STREET", "Street", streets), ("POSTCODE", "Post_Code", postcodes),
+                                      ("CITY", "City", cities)):
+        if path:
+            with open(path, encoding="utf-8") as f:
+                column_values = [line.strip() for line in f]
+        else:
+            column_values = frame[column].dropna().tolist() if column in frame else []
+        values[placeholder] = sorted({massage_data(value.strip()) for value in column_values if value.strip()})
+        if not values[placeholder]:
+            raise ValueError(f"No values for {placeholder}")
+    return values
+
+
+def house_number(rng: random.Random) -> str:
+    number = str(rng.randint(1, 300))
+    return number + rng.choice("abcdef") if rng.random() < 0.1 else number
+
+
+def fill_template(parts, values, rng: random.Random):
+    """
+    Substitutes the placeholders of a split template, returns the text and the entity spans
+    """
+    text = []
+    spans = []
+    offset = 0
+    for i, part in enumerate(parts):
+        if i % 2:  # placeholders are at the odd positions
+            value = house_number(rng) if part == "HOUSENR" else rng.choice(values[part])
+            spans.append((offset, offset + len(value), PLACEHOLDERS[part]))
+            part = value
+        text.append(part)
+        offset += len(part)
+    return "".join(text), spans
+
+
+# templates, values and pipeline of a worker process, set once by the pool initializer
+_worker = {}
+
+
+def _init_worker(templates, values, lang):
+    _worker.update(templates=templates, values=values, nlp=spacy.blank(lang))
+
+
+def generate_batch(seed, index, size):
+    """
+    Generates `size` examples (duplicates within the batch removed) with the seed of batch `index`
+    """
+    rng = random.Random(f"{seed}:{index}")
+    templates, values = _worker["templates"], _worker["values"]
+    batch = {}
+    for _ in range(size):
+        text, spans = fill_template(rng.choice(templates), values, rng)
+        batch.setdefault(text, spans)
+    return list(batch.items())
+
+
+def write_shard(path, examples, batch_size=1000):
+    """
+    Tokenizes the examples and writes them as one DocBin file, returns the number of docs and the rejects
+    """
+    doc_bin = DocBin()
+    rejects = []
+    for doc, reject in make_docs(examples, _worker["nlp"], batch_size):
+        if doc is None:
+            rejects.append(reject)
+        else:
+            doc_bin.add(doc)
+    doc_bin.to_disk(path)
+    return len(doc_bin), rejects
+
+
+class _Done:
+    """
+    Result of a function called in the current process, with the interface of `AsyncResult`
+    """
+
+    def __init__(self, function, args):
+        self._result = function(*args)
+
+    def get(self):
+        return self._result
+
+
+def generate_corpus(templates, values, directory, count, seed=0, workers=1, batch_size=10000,
+                    shard_size=10000, lang="en", reject_path=None) -> dict:
+    """
+    Writes `count` distinct examples to DocBin shards in `directory`. Stops early if a whole batch
+    adds no new example (all combinations of templates and values are used up).
+    """
+    reject_path = reject_path or directory.rstrip("/\\") + ".rejects.jsonl"
+    prepare_shard_directory(directory)
+    seen = set()
+    shard = []
+    stats = {"examples": 0, "duplicates": 0, "docs": 0, "rejected": 0, "shards": 0, "rejects": reject_path}
+
+    if workers > 1:
+        pool = Pool(workers, initializer=_init_worker, initargs=(templates, values, lang))
+        submit = pool.apply_async
+    else:
+        pool = None
+        _init_worker(templates, values, lang)
+        submit = _Done
+    batches = deque()
+    shards = deque()
+
+    def collect_shard(rejects_file):
+        docs, rejects = shards.popleft().get()
+        stats["docs"] += docs
+        stats["rejected"] += len(rejects)
+        for reject in rejects:
+            rejects_file.write(json.dumps(reject, ensure_ascii=False) + "\n")
+
+    try:
+        with open(reject_path, "w", encoding="utf-8") as rejects_file:
+            index = 0
+            exhausted = False
+            while stats["examples"] < count and not exhausted:
+                while len(batches) < 2 * workers:
+                    batches.append(submit(generate_batch, (seed, index, batch_size)))
+                    index += 1
+                new = 0
+                for text, spans in batches.popleft().get():
+                    key = hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest()
+                    if key in seen:
+                        stats["duplicates"] += 1
+                        continue
+                    seen.add(key)
+                    new += 1
+                    shard.append((text, spans))
+                    stats["examples"] += 1
+                    if len(shard) == shard_size or stats["examples"] == count:
+                        shards.append(submit(write_shard, (shard_path(directory, stats["shards"]), shard)))
+                        stats["shards"] += 1
+                        shard = []
+                        while len(shards) > 2 * workers:
+                            collect_shard(rejects_file)
+                    if stats["examples"] == count:
+                        break
+                exhausted = new == 0
+            if shard:
+                shards.append(submit(write_shard, (shard_path(directory, stats["shards"]), shard)))
+                stats["shards"] += 1
+            while shards:
+                collect_shard(rejects_file)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--templates", nargs="+", default=sorted(glob.glob(DEFAULT_TEMPLATES)))
+    parser.add_argument("--values", nargs="*", default=["./corpus/trainingdata/address_data.csv"],
+                        help="CSV files with the columns Street, Post_Code and City")
+    parser.add_argument("--streets", help="text file with one street per line")
+    parser.add_argument("--postcodes", help="text file with one postcode per line")
+    parser.add_argument("--cities", help="text file with one city per line")
+    parser.add_argument("--count", type=int, default=100000, help="number of distinct examples")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--batch-size", type=int, default=10000, help="examples generated per task")
+    parser.add_argument("--shard-size", type=int, default=10000, help="docs per DocBin file")
+    parser.add_argument("--output-dir", default="./corpus/spacy-docbins/templates")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = generate_corpus(load_templates(args.templates),
+                            load_values(args.values, args.streets, args.postcodes, args.cities),
+                            args.output_dir, args.count, args.seed, args.workers, args.batch_size, args.shard_size)
+    seconds = time.perf_counter() - start
+    print(f"{stats['docs']} docs in {stats['shards']} shard(s) of {args.output_dir} in {seconds:.1f} s "
+          f"({stats['docs'] / seconds:.0f} docs/s), {stats['duplicates']} duplicates skipped, "
+          f"{stats['rejected']} rejected examples in {stats['rejects']}")
+    if stats["examples"] < args.count:
+        print(f"Only {stats['examples']} distinct examples: the templates and values allow no more")